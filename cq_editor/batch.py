@@ -0,0 +1,432 @@
+"""
+Headless batch rendering. Scripts run with the same semantics as in the
+editor and everything they show is exported, no display or Qt application
+is needed:
+
+    cq-editor-batch part.py examples/ -o out -f step -f stl -j 8
+
+Top-level variables of the scripts can be swept over a grid of values, every
+combination is rendered as a separate variant:
+
+    cq-editor-batch part.py --set width=10,20,30 --set height=1,2 --table out.csv
+"""
+
+import argparse
+import ast
+import csv
+import json
+import os
+import re
+import sys
+from collections import Counter
+from functools import lru_cache
+from itertools import product
+from multiprocessing import get_context
+from random import seed
+from time import perf_counter
+from traceback import format_exc
+
+import cadquery as cq
+from OCP.AIS import AIS_InteractiveObject
+from path import Path
+
+from .runner import (
+    compile_script,
+    make_module,
+    inject_locals,
+    inject_parameters,
+    cleanup_locals,
+    script_context,
+)
+from .cq_utils import find_cq_objects, export, to_compound, is_obj_empty
+
+FORMATS = ("step", "stl", "brep")
+
+UNSAFE_CHARS = re.compile(r"[^\w.=-]+")
+
+# restart pool processes now and then, OCCT does not give memory back
+MAX_TASKS_PER_WORKER = 100
+
+
+def export_name(stem, name):
+    """File name of an object shown by a script, without the extension."""
+
+    return f"{stem}-{UNSAFE_CHARS.sub('_', name)}"
+
+
+def unique_names(names):
+    """
+    Number the repeats of a name, e.g. of object names that sanitize alike.
+    Names that differ only by case are repeats too, for case-insensitive
+    file systems.
+    """
+
+    rv = []
+    seen = set()
+
+    for name in names:
+        candidate, i = name, 1
+        while candidate.casefold() in seen:
+            i += 1
+            candidate = f"{name}-{i}"
+
+        seen.add(candidate.casefold())
+        rv.append(candidate)
+
+    return rv
+
+
+def script_stems(scripts):
+    """
+    Export file prefix of every script. Scripts of the same name in different
+    directories are told apart by their directory.
+    """
+
+    scripts = [Path(script).absolute() for script in scripts]
+    counts = Counter(script.stem for script in scripts)
+
+    stems = [
+        (
+            f"{UNSAFE_CHARS.sub('_', script.parent.name)}-{script.stem}"
+            if counts[script.stem] > 1
+            else script.stem
+        )
+        for script in scripts
+    ]
+
+    return dict(zip(scripts, unique_names(stems)))
+
+
+def variant_name(parameters):
+    """Readable description of parameter values."""
+
+    return "-".join(f"{k}={v}" for k, v in parameters.items())
+
+
+def _shape(obj):
+
+    if isinstance(obj, cq.Assembly):
+        return obj.toCompound()
+
+    return to_compound(obj)
+
+
+def measure(cq_objects):
+    """Volume and bounding box (min and max corner) of every shown object."""
+
+    rv = {}
+
+    for name, obj in cq_objects.items():
+        shape = _shape(obj.shape)
+        bb = shape.BoundingBox()
+        rv[name] = dict(
+            volume=shape.Volume(),
+            bbox=[bb.xmin, bb.ymin, bb.zmin, bb.xmax, bb.ymax, bb.zmax],
+        )
+
+    return rv
+
+
+def export_objects(cq_objects, stem, output, formats, precision):
+    """
+    Export shown objects to output/stem-name.format, returns the files of
+    every object.
+    """
+
+    files = {}
+    fnames = unique_names([export_name(stem, name) for name in cq_objects])
+
+    for (name, obj), base in zip(cq_objects.items(), fnames):
+        shape = _shape(obj.shape)
+
+        for fmt in formats:
+            fname = Path(output) / f"{base}.{fmt}"
+            export(shape, fmt, fname, precision)
+            files.setdefault(name, []).append(str(fname))
+
+    return files
+
+
+@lru_cache(maxsize=16)
+def _compile(cq_script, filename, parameters):
+
+    cq_code, _ = compile_script(cq_script, filename, parameters)
+
+    return cq_code
+
+
+def render_file(
+    filename,
+    output=None,
+    formats=("step",),
+    precision=0.1,
+    parameters=None,
+    stem=None,
+):
+    """
+    Run one script and export every object it shows (or every CadQuery
+    object it defines) to output, the files start with stem (the script name
+    by default). Returns a JSON serializable summary with the timings of
+    every stage. Objects that are not shapes are skipped.
+
+    parameters overrides the values of top-level variables. The script is
+    compiled once per process for all variants of the same parameters.
+    """
+
+    filename = Path(filename).absolute()
+    parameters = parameters or {}
+    messages = []
+    timings = {}
+
+    result = dict(
+        script=str(filename),
+        parameters=parameters,
+        objects=[],
+        skipped=[],
+        measures={},
+        files=[],
+        timings=timings,
+        log=messages,
+        error=None,
+    )
+
+    try:
+        start = perf_counter()
+        cq_code = _compile(filename.read_text(), filename, tuple(parameters))
+        module = make_module(filename)
+        cq_objects, injected_names = inject_locals(
+            module, log=lambda x: messages.append(str(x))
+        )
+        if parameters:
+            injected_names |= inject_parameters(module, parameters)
+        timings["compile"] = perf_counter() - start
+
+        seed(59798267586177)
+
+        start = perf_counter()
+        with script_context(filename):
+            exec(cq_code, module.__dict__, module.__dict__)
+        timings["exec"] = perf_counter() - start
+
+        cleanup_locals(module, injected_names)
+
+        if len(cq_objects) == 0:
+            cq_objects = find_cq_objects(module.__dict__)
+
+        # empty objects are not shown in the editor either
+        cq_objects = {k: v for k, v in cq_objects.items() if not is_obj_empty(v.shape)}
+
+        # presentations shown as they are have nothing to measure or export
+        result["skipped"] = [
+            k
+            for k, v in cq_objects.items()
+            if isinstance(v.shape, AIS_InteractiveObject)
+        ]
+        for name in result["skipped"]:
+            del cq_objects[name]
+
+        result["objects"] = list(cq_objects)
+        result["measures"] = measure(cq_objects)
+
+        if output is not None:
+            stem = stem or filename.stem
+            if parameters:
+                stem += "-" + UNSAFE_CHARS.sub("_", variant_name(parameters))
+
+            start = perf_counter()
+            files = export_objects(cq_objects, stem, output, formats, precision)
+            timings["export"] = perf_counter() - start
+
+            for name, object_files in files.items():
+                result["measures"][name]["files"] = object_files
+                result["files"].extend(object_files)
+    except Exception:
+        result["error"] = format_exc()
+
+    return result
+
+
+def _render_job(kwargs):
+
+    return render_file(**kwargs)
+
+
+def find_scripts(paths):
+    """Expand directories to the scripts they contain."""
+
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(p.files("*.py"))
+        else:
+            yield p
+
+
+def parse_values(text):
+    """Values of a --set option, Python literals or plain strings."""
+
+    values = []
+
+    for el in text.split(","):
+        try:
+            values.append(ast.literal_eval(el.strip()))
+        except (ValueError, SyntaxError):
+            values.append(el.strip())
+
+    return values
+
+
+def sweep(grid):
+    """Every combination of the parameter values in grid (name -> values)."""
+
+    names = list(grid)
+
+    for values in product(*grid.values()):
+        yield dict(zip(names, values))
+
+
+def write_table(results, filename):
+    """Write one CSV row per shown object of every result."""
+
+    parameters = list(dict.fromkeys(k for r in results for k in r["parameters"]))
+    header = ["script", *parameters, "object", "volume"]
+    header += ["xmin", "ymin", "zmin", "xmax", "ymax", "zmax", "files", "error"]
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+
+        for r in results:
+            row = [r["script"], *(r["parameters"].get(p, "") for p in parameters)]
+            error = r["error"].strip().splitlines()[-1] if r["error"] else ""
+
+            if not r["measures"]:
+                writer.writerow(row + [""] * 9 + [error])
+
+            for name, m in r["measures"].items():
+                files = " ".join(m.get("files", []))
+                writer.writerow(row + [name, m["volume"], *m["bbox"], files, error])
+
+
+def run(jobs, processes=None):
+    """
+    Render jobs (keyword arguments of render_file) in a pool of processes,
+    yielding the results as they are done.
+    """
+
+    processes = processes or os.cpu_count()
+
+    if processes == 1:
+        yield from map(_render_job, jobs)
+        return
+
+    ctx = get_context("spawn")
+    with ctx.Pool(processes, maxtasksperchild=MAX_TASKS_PER_WORKER) as pool:
+        yield from pool.imap_unordered(_render_job, jobs)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        prog="cq-editor-batch",
+        description="Render CadQuery scripts without a display and export the "
+        "objects they show",
+    )
+    parser.add_argument("scripts", nargs="+", help="scripts or directories of scripts")
+    parser.add_argument(
+        "-o", "--output", help="export directory, nothing is exported if omitted"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="append",
+        choices=FORMATS,
+        help="export format, can be repeated (default: step)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of processes"
+    )
+    parser.add_argument(
+        "--precision", type=float, default=0.1, help="STL export tolerance"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUES",
+        help="comma separated values of a top-level variable to sweep over, "
+        "can be repeated",
+    )
+    parser.add_argument("--report", help="write the results and timings as JSON")
+    parser.add_argument(
+        "--table", help="write the objects of every variant as a CSV table"
+    )
+
+    args = parser.parse_args(argv)
+
+    grid = {}
+    for option in args.set:
+        name, _, values = option.partition("=")
+        if not name.isidentifier() or not values:
+            parser.error(f"invalid --set {option}")
+        grid[name] = parse_values(values)
+
+    output = None
+    if args.output:
+        output = Path(args.output).absolute()
+        output.makedirs_p()
+
+    # a script given twice is rendered once
+    scripts = list(dict.fromkeys(s.absolute() for s in find_scripts(args.scripts)))
+    stems = script_stems(scripts)
+
+    jobs = [
+        dict(
+            filename=script,
+            output=output,
+            formats=args.format or ["step"],
+            precision=args.precision,
+            parameters=parameters,
+            stem=stems[script],
+        )
+        for script in scripts
+        for parameters in sweep(grid)
+    ]
+
+    start = perf_counter()
+    results = []
+
+    for result in run(jobs, args.jobs):
+        results.append(result)
+
+        status = "failed" if result["error"] else "ok"
+        total = sum(result["timings"].values())
+        variant = variant_name(result["parameters"])
+        print(f"{status:6} {result['script']} {variant} ({total:.2f} s)")
+        if result["error"]:
+            print(result["error"], file=sys.stderr)
+
+    failed = sum(1 for r in results if r["error"])
+    print(
+        f"{len(results) - failed} rendered, {failed} failed in "
+        f"{perf_counter() - start:.2f} s"
+    )
+
+    # the pool returns results as they are done
+    order = {
+        (str(Path(job["filename"]).absolute()), variant_name(job["parameters"])): i
+        for i, job in enumerate(jobs)
+    }
+    results.sort(key=lambda r: order[r["script"], variant_name(r["parameters"])])
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.table:
+        write_table(results, args.table)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Benchmarks of the render pipeline: running the script, building the object
+tree, making the AIS objects, tessellating, displaying and fitting the view.
+The bundled examples are timed together with a few synthetic stress cases.
+
+    QT_QPA_PLATFORM=offscreen python -m cq_editor.benchmark --save baseline.json
+    QT_QPA_PLATFORM=offscreen python -m cq_editor.benchmark --compare baseline.json
+
+Comparing with a baseline flags every stage that got slower than the
+threshold and exits with a non-zero status if there is any. The benchmark
+uses the default preferences and settings of its own, the ones of the user
+are neither read nor changed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+
+import cadquery as cq
+from PyQt5.QtCore import QSettings
+from PyQt5.QtWidgets import QApplication
+
+from . import __version__
+from .cq_utils import TESSELLATION_CACHE
+from .profiler import PROFILER
+
+# relative slowdown reported as a regression
+THRESHOLD = 0.2
+
+# differences below this are noise, whatever the ratio [s]
+MIN_DIFFERENCE = 5e-3
+
+STRESS_CASES = {
+    # half of the parts are repeated, half are unique
+    "assembly_1k_parts": """
+import cadquery as cq
+
+bolt = cq.Workplane().polygon(6, 2).extrude(1).faces(">Z").workplane().circle(0.5).extrude(5)
+
+assy = cq.Assembly()
+for i in range(1000):
+    part = bolt if i % 2 else cq.Workplane().box(2, 2, 0.5 + 1e-3 * i)
+    assy.add(part, loc=cq.Location((3 * (i % 40), 3 * (i // 40), 0)), name=f"part{i}")
+
+show_object(assy)
+""",
+    # 130 x 130 separate boxes, 101400 faces
+    "compound_100k_faces": """
+import cadquery as cq
+
+result = cq.Workplane().rarray(1.5, 1.5, 130, 130).box(1, 1, 1, combine=False)
+
+show_object(result)
+""",
+}
+
+
+def find_cases(win, names=None):
+    """Script of every benchmark case, the examples first."""
+
+    cases = {
+        path.stem: path.read_text() for path in sorted(win._examples_dir().glob("*.py"))
+    }
+    cases.update(STRESS_CASES)
+
+    if names:
+        cases = {k: v for k, v in cases.items() if k in names}
+
+    return cases
+
+
+def _reset(parameters):
+
+    for param in parameters.children():
+        if param.hasDefault():
+            param.setToDefault()
+        _reset(param)
+
+
+def configure(win):
+    """
+    Render every time from scratch, in the foreground and profiled. All other
+    preferences are set to their defaults.
+    """
+
+    for component in (win, *win.components.values()):
+        if component.preferences:
+            _reset(component.preferences)
+
+    debugger = win.components["debugger"]
+    debugger.preferences["Profile renders"] = True
+    debugger.preferences["Render in background"] = False
+    debugger.preferences["Render in worker process"] = False
+    debugger.preferences["Incremental render"] = False
+
+    object_tree = win.components["object_tree"]
+    object_tree.preferences["Clear all before each run"] = True
+    object_tree.preferences["Update changed objects only"] = False
+
+
+def run_case(win, script, repeat=3):
+    """Median time of every pipeline stage and of the whole render."""
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+
+    editor.set_text(script)
+
+    timings = {}
+    for _ in range(repeat):
+        # the faces would be tessellated only once otherwise
+        TESSELLATION_CACHE.clear()
+
+        debugger.render()
+        QApplication.processEvents()
+
+        profile = PROFILER.profiles[-1]
+        for stage, seconds in profile.stages.items():
+            timings.setdefault(stage, []).append(seconds)
+        timings.setdefault("total", []).append(profile.total)
+
+    return {stage: median(values) for stage, values in timings.items()}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Stages slower than in the baseline by more than threshold, as
+    (case, stage, baseline time, new time) tuples.
+    """
+
+    rv = []
+
+    for case, stages in results.items():
+        for stage, seconds in stages.items():
+            previous = baseline.get(case, {}).get(stage)
+            if previous is None:
+                continue
+
+            if (
+                seconds > (1 + threshold) * previous
+                and seconds - previous > MIN_DIFFERENCE
+            ):
+                rv.append((case, stage, previous, seconds))
+
+    return rv
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        prog="cq-editor-benchmark",
+        description="Time the render pipeline of CQ-editor",
+    )
+    parser.add_argument("cases", nargs="*", help="cases to run (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="renders per case")
+    parser.add_argument("--save", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline to check for regressions")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="relative slowdown reported as a regression",
+    )
+
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    from .main_window import MainWindow
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = QSettings(os.path.join(tmp, "settings.ini"), QSettings.IniFormat)
+
+        win = MainWindow(settings=settings)
+        win.show()
+        configure(win)
+
+        results = {}
+        for name, script in find_cases(win, args.cases).items():
+            results[name] = run_case(win, script, args.repeat)
+            print(f"{name:30} {results[name]['total']:8.3f} s")
+
+        # the benchmark scripts are not to be saved
+        win.components["editor"].reset_modified()
+        win.close()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                dict(
+                    date=datetime.now().isoformat(),
+                    machine=platform.platform(),
+                    python=platform.python_version(),
+                    cq_editor=__version__,
+                    cadquery=cq.__version__,
+                    results=results,
+                ),
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, args.threshold)
+        for case, stage, previous, seconds in regressions:
+            print(
+                f"regression: {case} {stage} {previous:.3f} s -> {seconds:.3f} s "
+                f"(+{100 * (seconds / previous - 1):.0f}%)"
+            )
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
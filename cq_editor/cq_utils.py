@@ -1,12 +1,37 @@
 import cadquery as cq
 from cadquery.occ_impl.assembly import toCAF
 
+import io
+import os
+import re
+import shutil
+import struct
+import tempfile
+from collections import OrderedDict
+from hashlib import sha1
 from typing import List, Union
 from importlib import reload
 from types import SimpleNamespace
 
 from OCP.XCAFPrs import XCAFPrs_AISObject
-from OCP.TopoDS import TopoDS_Shape
+from OCP.XCAFDoc import XCAFDoc_ShapeTool
+from OCP.TopoDS import TopoDS, TopoDS_Shape, TopoDS_Compound
+from OCP.TopAbs import (
+    TopAbs_FACE,
+    TopAbs_EDGE,
+    TopAbs_SOLID,
+    TopAbs_FORWARD,
+    TopAbs_REVERSED,
+)
+from OCP.TopExp import TopExp, TopExp_Explorer
+from OCP.TopLoc import TopLoc_Location
+from OCP.TopTools import TopTools_IndexedMapOfShape, TopTools_FormatVersion
+from OCP.BRep import BRep_Tool, BRep_Builder
+from OCP.BRepTools import BRepTools
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.StlAPI import StlAPI_Writer
+from OCP.StdPrs import StdPrs_ToolTriangulatedShape
+from OCP.Prs3d import Prs3d_Drawer
 from OCP.AIS import AIS_InteractiveObject, AIS_Shape
 from OCP.Quantity import (
     Quantity_TOC_RGB as TOC_RGB,
@@ -22,6 +47,9 @@ from PyQt5.QtGui import QColor
 DEFAULT_FACE_COLOR = Quantity_Color(GOLD)
 DEFAULT_MATERIAL = Graphic3d_MaterialAspect(Graphic3d_NOM_JADE)
 
+# faces meshed and written at once by export_stl
+STL_CHUNK_FACES = 100
+
 
 def is_cq_obj(obj):
 
@@ -76,6 +104,222 @@ def to_workplane(obj: cq.Shape):
     return rv
 
 
+def _unique_shapes(shape, kind):
+
+    rv = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(shape, kind, rv)
+
+    return [rv.FindKey(i) for i in range(1, rv.Extent() + 1)]
+
+
+class TessellationCache(object):
+    """
+    Triangulations of faces, keyed by the geometry of the face and the angular
+    deviation. Shapes rebuilt by every run of a script get the triangulation
+    of identical faces from a previous run instead of being meshed again.
+    Least recently used entries are dropped once max_size (in bytes) is
+    exceeded, 0 disables the cache.
+    """
+
+    # regularity of edges between faces, written in arbitrary order
+    _CONTINUITY = re.compile(rb"\n4 [CG][0-9N] [^\n]*")
+
+    def __init__(self, max_size=0, deviation=1e-5, angle=0.1):
+
+        self.max_size = max_size
+        self.deviation = deviation
+        self.angle = angle
+
+        self._items = OrderedDict()  # key -> (triangulation, polygons, size)
+        self.size = 0
+
+    def clear(self):
+
+        self._items.clear()
+        self.size = 0
+
+    def configure(self, max_size, deviation, angle):
+
+        self.max_size = max_size
+        self.deviation = deviation
+        self.angle = angle
+
+        self._evict()
+
+    def _evict(self):
+
+        while self._items and self.size > self.max_size:
+            *_, size = self._items.popitem(last=False)[1]
+            self.size -= size
+
+    def _key(self, face):
+
+        stream = io.BytesIO()
+        BRepTools.Write_s(
+            face,
+            stream,
+            False,
+            False,
+            TopTools_FormatVersion.TopTools_FormatVersion_CURRENT,
+        )
+        data = self._CONTINUITY.sub(b"", stream.getvalue())
+
+        return sha1(data).digest(), self.angle
+
+    @staticmethod
+    def _triangulation(face):
+
+        return BRep_Tool.Triangulation_s(TopoDS.Face_s(face), TopLoc_Location())
+
+    @staticmethod
+    def _extract(face):
+
+        face = TopoDS.Face_s(face)
+        loc = TopLoc_Location()
+        tri = BRep_Tool.Triangulation_s(face, loc)
+
+        polygons = []
+        size = tri.NbNodes() * 64 + tri.NbTriangles() * 12
+
+        for edge in _unique_shapes(face, TopAbs_EDGE):
+            edge = TopoDS.Edge_s(edge)
+
+            # seam edges have one polygon per side
+            if BRep_Tool.IsClosed_s(edge, face):
+                polygon = tuple(
+                    BRep_Tool.PolygonOnTriangulation_s(
+                        TopoDS.Edge_s(edge.Oriented(o)), tri, loc
+                    )
+                    for o in (TopAbs_FORWARD, TopAbs_REVERSED)
+                )
+            else:
+                polygon = (BRep_Tool.PolygonOnTriangulation_s(edge, tri, loc),)
+
+            if any(p is None for p in polygon):
+                return None
+
+            polygons.append(polygon)
+            size += sum(p.NbNodes() * 12 for p in polygon)
+
+        return tri, polygons, size
+
+    @staticmethod
+    def _apply(face, tri, polygons):
+
+        face = TopoDS.Face_s(face)
+        loc = TopLoc_Location()
+        builder = BRep_Builder()
+
+        builder.UpdateFace(face, tri)
+        for edge, polygon in zip(_unique_shapes(face, TopAbs_EDGE), polygons):
+            builder.UpdateEdge(TopoDS.Edge_s(edge), *polygon, tri, loc)
+
+    def _reuse(self, shape, deflection):
+        """Apply cached triangulations, returns the faces still to be meshed."""
+
+        missing = []
+
+        for face in _unique_shapes(shape, TopAbs_FACE):
+            # instances of the same part share their faces, so drop the locations
+            face = face.Located(TopLoc_Location())
+            tri = self._triangulation(face)
+            if tri is not None and tri.Deflection() <= deflection:
+                continue
+
+            key = self._key(face)
+            item = self._items.get(key)
+
+            if item and item[0].Deflection() <= deflection:
+                self._items.move_to_end(key)
+                self._apply(face, *item[:2])
+            else:
+                missing.append((key, face))
+
+        return missing
+
+    def _store(self, missing):
+
+        for key, face in missing:
+            item = self._extract(face) if self._triangulation(face) else None
+
+            if item:
+                if key in self._items:
+                    self.size -= self._items[key][-1]
+                self._items[key] = item
+                self.size += item[-1]
+
+        self._evict()
+
+    def _drawer(self):
+
+        rv = Prs3d_Drawer()
+        rv.SetDeviationCoefficient(self.deviation)
+        rv.SetDeviationAngle(self.angle)
+
+        return rv
+
+    def reuse(self, shapes: List[TopoDS_Shape]):
+        """Apply cached triangulations to shapes without meshing anything."""
+
+        if not self.max_size:
+            return
+
+        drawer = self._drawer()
+
+        for shape in shapes:
+            deflection = StdPrs_ToolTriangulatedShape.GetDeflection_s(shape, drawer)
+            self._reuse(shape, deflection)
+
+    def tessellate(self, shapes: List[TopoDS_Shape], parallel=False):
+        """
+        Triangulate shapes the way the viewer would, reusing cached
+        triangulations of identical faces. Shapes needing a similar deflection
+        are meshed together, optionally using all cores.
+        """
+
+        drawer = self._drawer()
+
+        todo = []
+        missing = []
+
+        for shape in shapes:
+            deflection = StdPrs_ToolTriangulatedShape.GetDeflection_s(shape, drawer)
+
+            if self.max_size:
+                faces = self._reuse(shape, deflection)
+                missing.extend(faces)
+                if not faces:
+                    continue
+            elif BRepTools.Triangulation_s(shape, deflection):
+                continue
+
+            todo.append((deflection, shape))
+
+        # a finer mesh is fine for display, so deflections within a factor of
+        # two share one mesher run
+        groups = []
+        for deflection, shape in sorted(todo, key=lambda el: el[0]):
+            if groups and deflection <= 2 * groups[-1][0]:
+                groups[-1][1].append(shape)
+            else:
+                groups.append((deflection, [shape]))
+
+        builder = BRep_Builder()
+        for deflection, group in groups:
+            compound = TopoDS_Compound()
+            builder.MakeCompound(compound)
+            for shape in group:
+                builder.Add(compound, shape)
+
+            BRepMesh_IncrementalMesh(compound, deflection, False, self.angle, parallel)
+
+        if missing:
+            self._store(missing)
+
+
+TESSELLATION_CACHE = TessellationCache()
+
+
 def make_AIS(
     obj: Union[
         cq.Workplane,
@@ -116,14 +360,236 @@ def make_AIS(
     return ais, shape
 
 
+def get_ais_shape(ais: AIS_InteractiveObject) -> Union[TopoDS_Shape, None]:
+    """Shape shown by an AIS object, None for other presentations."""
+
+    if isinstance(ais, XCAFPrs_AISObject):
+        # assemblies are resolved only when displayed
+        return XCAFDoc_ShapeTool.GetShape_s(ais.GetLabel())
+    elif isinstance(ais, AIS_Shape):
+        return ais.Shape()
+
+
+def _matrix(loc: TopLoc_Location) -> tuple:
+
+    t = loc.Transformation()
+
+    return tuple(t.Value(i, j) for i in range(1, 4) for j in range(1, 5))
+
+
+def same_location(loc1: cq.Location, loc2: cq.Location, tol=1e-7) -> bool:
+    """True if both locations describe the same transformation."""
+
+    return all(
+        abs(v1 - v2) <= tol
+        for v1, v2 in zip(_matrix(loc1.wrapped), _matrix(loc2.wrapped))
+    )
+
+
+def instance_location(shape: cq.Shape, prototype: cq.Shape) -> Union[cq.Location, None]:
+    """
+    Location that moves prototype onto shape if both are placements of the
+    same underlying shapes, None otherwise.
+    """
+
+    children = list(shape)
+    proto_children = list(prototype)
+
+    if not children or len(children) != len(proto_children):
+        return None
+
+    for child, proto_child in zip(children, proto_children):
+        if not child.wrapped.IsPartner(proto_child.wrapped):
+            return None
+        if child.wrapped.Orientation() != proto_child.wrapped.Orientation():
+            return None
+
+    loc = children[0].location() * proto_children[0].location().inverse
+
+    # the parts need to keep their relative placement
+    for child, proto_child in zip(children[1:], proto_children[1:]):
+        if not same_location(loc * proto_child.location(), child.location()):
+            return None
+
+    return loc
+
+
+def shape_id(shape: TopoDS_Shape) -> tuple:
+    """
+    Hashable identity of a shape: the underlying shape, its orientation and
+    its location. Unlike hash(shape), locations are compared by value, so
+    equal locations made anew give the same identity.
+    """
+
+    return (
+        hash(shape.Located(TopLoc_Location())),
+        shape.Orientation(),
+        _matrix(shape.Location()),
+    )
+
+
+def shape_key(obj) -> Union[tuple, None]:
+    """
+    Identity of the shapes of a shown object. Objects with equal keys consist
+    of the same underlying shapes in the same places, so they look the same.
+    None for objects that cannot be compared, e.g. AIS objects.
+    """
+
+    if isinstance(obj, cq.Assembly):
+        # unnamed nodes get a new random name every time
+        return tuple(
+            (
+                _matrix(node.loc.wrapped),
+                node.color.toTuple() if node.color is not None else None,
+                shape_key(node.obj) if node.obj is not None else None,
+            )
+            for _, node in obj.traverse()
+        )
+    elif isinstance(obj, AIS_InteractiveObject):
+        return None
+
+    # compounds are compared by content, wrapping compounds are made anew
+    shapes = obj if isinstance(obj, cq.Compound) else to_compound(obj)
+
+    return tuple(shape_id(s.wrapped) for s in shapes)
+
+
+def _stl_chunks(shape: TopoDS_Shape, max_faces: int):
+    """Solids and free faces of shape, grouped by about max_faces faces."""
+
+    builder = BRep_Builder()
+    chunk, size = None, 0
+
+    free_faces = []
+    explorer = TopExp_Explorer(shape, TopAbs_FACE, TopAbs_SOLID)
+    while explorer.More():
+        free_faces.append(explorer.Current())
+        explorer.Next()
+
+    for el in _unique_shapes(shape, TopAbs_SOLID) + free_faces:
+        if chunk is None:
+            chunk, size = TopoDS_Compound(), 0
+            builder.MakeCompound(chunk)
+
+        builder.Add(chunk, el)
+        size += len(_unique_shapes(el, TopAbs_FACE))
+
+        if size >= max_faces:
+            yield chunk
+            chunk = None
+
+    if chunk is not None:
+        yield chunk
+
+
+def export_stl(
+    shape: TopoDS_Shape,
+    file,
+    tolerance=1e-3,
+    angular_tolerance=0.1,
+    max_faces=STL_CHUNK_FACES,
+    remesh=True,
+) -> int:
+    """
+    Write a binary STL file chunk by chunk. Every chunk of solids (or free
+    faces) is meshed and appended to the file. The triangulation of a face is
+    dropped after the last chunk using it (instances share their faces), so
+    the memory needed depends on the largest chunk instead of the whole
+    shape. Returns the number of triangles, a shape without any raises
+    ValueError.
+
+    Triangulations the shape had before, e.g. from the viewer, are kept and
+    written as they are if they are at least as fine as tolerance. With
+    remesh=False they are written whatever their tolerance, only faces
+    without a triangulation are meshed.
+    """
+
+    def bare(face):
+        return hash(face.Located(TopLoc_Location()).Oriented(TopAbs_FORWARD))
+
+    chunks = list(_stl_chunks(shape, max_faces))
+
+    # index of the last chunk with every face
+    last = {}
+    for i, chunk in enumerate(chunks):
+        for face in _unique_shapes(chunk, TopAbs_FACE):
+            last[bare(face)] = i
+
+    # faces meshed here, by the chunks after which they are dropped
+    meshed = {}
+    seen = set()
+
+    builder = BRep_Builder()
+    writer = StlAPI_Writer()
+    writer.ASCIIMode = False
+    count = 0
+
+    fd, tmp = tempfile.mkstemp(suffix=".stl")
+    os.close(fd)
+
+    try:
+        with open(file, "wb") as f:
+            f.write(b"STL written by CQ-editor".ljust(80, b"\0"))
+            f.write(struct.pack("<I", 0))
+
+            for i, chunk in enumerate(chunks):
+                missing = TopoDS_Compound()
+                builder.MakeCompound(missing)
+
+                for face in _unique_shapes(chunk, TopAbs_FACE):
+                    key = bare(face)
+                    if key in seen:
+                        continue
+
+                    seen.add(key)
+                    loc = TopLoc_Location()
+                    if BRep_Tool.Triangulation_s(TopoDS.Face_s(face), loc) is None:
+                        meshed.setdefault(last[key], []).append(face)
+                        builder.Add(missing, face)
+
+                BRepMesh_IncrementalMesh(
+                    chunk if remesh else missing,
+                    tolerance,
+                    True,
+                    angular_tolerance,
+                    True,
+                )
+
+                # no triangles, nothing written
+                if writer.Write(chunk, tmp):
+                    with open(tmp, "rb") as chunk_file:
+                        chunk_file.seek(80)
+                        count += struct.unpack("<I", chunk_file.read(4))[0]
+                        shutil.copyfileobj(chunk_file, f)
+
+                for face in meshed.pop(i, []):
+                    BRepTools.Clean_s(face)
+
+            f.seek(80)
+            f.write(struct.pack("<I", count))
+    finally:
+        os.remove(tmp)
+
+    # e.g. wires, an empty file would go unnoticed
+    if count == 0:
+        os.remove(file)
+        raise ValueError("Nothing to export to STL, the shape has no faces")
+
+    return count
+
+
 def export(
-    obj: Union[cq.Workplane, List[cq.Workplane]], type: str, file, precision=1e-1
+    obj: Union[cq.Workplane, List[cq.Workplane]],
+    type: str,
+    file,
+    precision=1e-1,
+    remesh=True,
 ):
 
     comp = to_compound(obj)
 
     if type == "stl":
-        comp.exportStl(file, tolerance=precision)
+        export_stl(comp.wrapped, file, tolerance=precision, remesh=remesh)
     elif type == "step":
         comp.exportStep(file)
     elif type == "brep":
@@ -6,7 +6,15 @@ if "CASROOT" in os.environ:
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-from cq_editor.__main__ import main
+
+def main():
+
+    # imported here so that render worker processes, which import the
+    # launching script again, do not create a GUI application
+    from cq_editor.__main__ import main as run_editor
+
+    run_editor()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,299 @@
+"""
+Background export.
+
+OCCT keeps the GIL while meshing and writing, so exports run in a separate
+process instead of a thread. The shape travels pickled (cadquery pickles
+shapes as binary BREP, triangulations of the viewer included) and is
+written to a temporary file next to the target, which replaces the target
+only once it is complete. A cancelled or failed export leaves an existing
+file untouched.
+
+Many objects and formats are exported at once by a pool of processes, one
+job per object and format, and listed in a manifest.json next to the files.
+"""
+
+import json
+import os
+from datetime import datetime
+from multiprocessing import get_context, TimeoutError
+from time import perf_counter
+from traceback import format_exc
+
+import cadquery as cq
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from . import __version__
+from .batch import UNSAFE_CHARS, MAX_TASKS_PER_WORKER, unique_names
+from .cq_utils import export
+
+
+def _export(conn, shape, export_type, fname, precision, remesh):
+
+    try:
+        export(shape, export_type, fname, precision, remesh)
+    except Exception:
+        conn.send(format_exc())
+        return
+
+    # some exporters only report failures with their return value
+    conn.send(None if os.path.exists(fname) else f"Could not write {fname}")
+
+
+class ExportJob(QThread):
+    """
+    Writes one shape in a worker process. The thread only waits for the
+    process, finished is emitted once the file is written, the export failed
+    (error is set) or it was cancelled.
+    """
+
+    def __init__(self, parent, shape, export_type, fname, precision=None, remesh=True):
+
+        super(ExportJob, self).__init__(parent)
+
+        self.shape = shape
+        self.export_type = export_type
+        self.fname = fname
+        self.precision = precision
+        self.remesh = remesh
+
+        self.error = None
+        self.cancelled = False
+
+        self._ctx = get_context("spawn")
+        self._process = None
+
+    @property
+    def description(self):
+
+        return self.fname
+
+    @property
+    def tmp_fname(self):
+
+        return f"{self.fname}.part"
+
+    def run(self):
+
+        conn, child_conn = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_export,
+            args=(
+                child_conn,
+                self.shape,
+                self.export_type,
+                self.tmp_fname,
+                self.precision,
+                self.remesh,
+            ),
+            name="cq-editor-export",
+            daemon=True,
+        )
+
+        if self.cancelled:
+            return
+
+        self._process = process
+        process.start()
+        child_conn.close()
+
+        # cancelled while the process was starting
+        if self.cancelled:
+            process.kill()
+
+        try:
+            error = conn.recv()
+        except EOFError:
+            error = f"Export process exited unexpectedly ({process.exitcode})"
+        finally:
+            process.join()
+            conn.close()
+
+        if not self.cancelled and not error:
+            try:
+                os.replace(self.tmp_fname, self.fname)
+            except OSError as e:
+                error = str(e)
+
+        if self.cancelled or error:
+            self.error = None if self.cancelled else error
+            self._remove_tmp()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+        if self._process is not None and self._process.is_alive():
+            self._process.kill()
+
+    def _remove_tmp(self):
+
+        if os.path.exists(self.tmp_fname):
+            os.remove(self.tmp_fname)
+
+
+def _safe_name(name):
+
+    name = UNSAFE_CHARS.sub("_", name)
+
+    # "." and ".." would leave the output directory
+    return name if name.strip(".") else "_"
+
+
+def export_name(path):
+    """File name of an object tree path, without the extension."""
+
+    return os.path.join(*(_safe_name(el) for el in path.split("/")))
+
+
+def export_file(shape, export_type, fname, precision=0.1):
+    """
+    Export one shape through a temporary file, returns a JSON serializable
+    summary for the manifest.
+    """
+
+    start = perf_counter()
+    tmp_fname = f"{fname}.part"
+    error = None
+
+    try:
+        export(shape, export_type, tmp_fname, precision)
+        os.replace(tmp_fname, fname)
+    except Exception:
+        error = format_exc()
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+    return dict(
+        file=str(fname),
+        format=export_type,
+        size=os.path.getsize(fname) if error is None else None,
+        seconds=perf_counter() - start,
+        error=error,
+    )
+
+
+def _export_job(kwargs):
+
+    return export_file(**kwargs)
+
+
+class ExportBatch(QThread):
+    """
+    Exports (tree path, shape) pairs in every format with a pool of
+    processes, the thread only hands out the jobs and collects the results.
+    sigProgress reports the number of written files and of all files.
+    """
+
+    sigProgress = pyqtSignal(int, int)
+
+    def __init__(self, parent, objects, formats, output, precision=0.1, processes=None):
+
+        super(ExportBatch, self).__init__(parent)
+
+        self.output = output
+        self.precision = precision
+        self.processes = processes or os.cpu_count()
+
+        # tree path of every file, for the manifest
+        self._paths = {}
+        self.jobs = []
+
+        # tree paths that sanitize alike must not write the same files
+        names = unique_names([export_name(path) for path, _ in objects])
+
+        for (path, shape), name in zip(objects, names):
+            for fmt in formats:
+                fname = os.path.join(output, f"{name}.{fmt}")
+                self._paths[fname] = path
+                self.jobs.append(
+                    dict(
+                        shape=shape,
+                        export_type=fmt,
+                        fname=fname,
+                        precision=precision,
+                    )
+                )
+
+        self.results = []
+        self.error = None
+        self.cancelled = False
+
+    @property
+    def description(self):
+
+        return f"{len(self.jobs)} files to {self.output}"
+
+    @property
+    def manifest(self):
+
+        return os.path.join(self.output, "manifest.json")
+
+    def run(self):
+
+        for job in self.jobs:
+            os.makedirs(os.path.dirname(job["fname"]), exist_ok=True)
+
+        results = self.results
+        processes = max(1, min(self.processes, len(self.jobs)))
+
+        ctx = get_context("spawn")
+        with ctx.Pool(processes, maxtasksperchild=MAX_TASKS_PER_WORKER) as pool:
+            rv = pool.imap_unordered(_export_job, self.jobs)
+
+            # poll, so that a cancel does not wait for a long export
+            while len(results) < len(self.jobs) and not self.cancelled:
+                try:
+                    results.append(rv.next(timeout=0.1))
+                except TimeoutError:
+                    continue
+
+                self.sigProgress.emit(len(results), len(self.jobs))
+
+        if self.cancelled:
+            for job in self.jobs:
+                if os.path.exists(f"{job['fname']}.part"):
+                    os.remove(f"{job['fname']}.part")
+            return
+
+        # the pool returns the results as they are done
+        order = {job["fname"]: i for i, job in enumerate(self.jobs)}
+        results.sort(key=lambda r: order[r["file"]])
+
+        self.write_manifest()
+
+        failed = [r for r in results if r["error"]]
+        if failed:
+            self.error = "\n".join(
+                f"{r['file']}: {r['error'].strip().splitlines()[-1]}" for r in failed
+            )
+
+    def write_manifest(self):
+
+        files = [
+            dict(
+                object=self._paths[r["file"]],
+                format=r["format"],
+                file=os.path.relpath(r["file"], self.output),
+                size=r["size"],
+                seconds=r["seconds"],
+                error=r["error"],
+            )
+            for r in self.results
+        ]
+
+        with open(self.manifest, "w") as f:
+            json.dump(
+                dict(
+                    date=datetime.now().isoformat(),
+                    cq_editor=__version__,
+                    cadquery=cq.__version__,
+                    precision=self.precision,
+                    files=files,
+                ),
+                f,
+                indent=2,
+            )
+
+    def cancel(self):
+
+        self.cancelled = True
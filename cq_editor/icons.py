@@ -40,7 +40,9 @@ _icons_specs = {
         },
     ),
     "run": (("fa5s.play",), {}),
+    "stop": (("fa5s.stop",), {}),
     "debug": (("fa5s.bug",), {}),
+    "profile": (("fa5s.stopwatch",), {}),
     "delete": (("fa5s.trash",), {}),
     "delete-many": (
         (
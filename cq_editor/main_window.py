@@ -12,6 +12,8 @@ from PyQt5.QtWidgets import (
     QAction,
     QApplication,
     QMenu,
+    QProgressBar,
+    QToolButton,
 )
 from logbook import Logger
 import cadquery as cq
@@ -83,10 +85,10 @@ class MainWindow(QMainWindow, MainMixin):
         ],
     )
 
-    def __init__(self, parent=None, filename=None):
+    def __init__(self, parent=None, filename=None, settings=None):
 
         super(MainWindow, self).__init__(parent)
-        MainMixin.__init__(self)
+        MainMixin.__init__(self, settings)
 
         self.setWindowIcon(icon("app"))
 
@@ -243,6 +245,11 @@ class MainWindow(QMainWindow, MainMixin):
         else:
             super(MainWindow, self).closeEvent(event)
 
+        # do not leave a render or an export running behind a closed window
+        if event.isAccepted():
+            self.components["debugger"].shutdown()
+            self.components["object_tree"].cancel_export(wait=True)
+
     def prepare_panes(self):
 
         self.registerComponent(
@@ -420,11 +427,29 @@ class MainWindow(QMainWindow, MainMixin):
         self.status_label = QLabel("", parent=self)
         self.statusBar().insertPermanentWidget(0, self.status_label)
 
-    def prepare_actions(self):
+        # busy indicator shown while a background render is running
+        self.render_progress = QProgressBar(self, minimum=0, maximum=0)
+        self.render_progress.setMaximumWidth(120)
+        self.render_progress.setFormat("Rendering")
+        self.render_progress.hide()
+        self.statusBar().insertPermanentWidget(0, self.render_progress)
 
-        self.components["debugger"].sigRendered.connect(
-            self.components["object_tree"].addObjects
+        # busy indicator and cancel button of background exports
+        self.export_progress = QProgressBar(self, minimum=0, maximum=0)
+        self.export_progress.setMaximumWidth(120)
+        self.export_progress.setFormat("Exporting")
+        self.export_progress.hide()
+        self.statusBar().insertPermanentWidget(0, self.export_progress)
+
+        self.export_cancel = QToolButton(
+            self, icon=icon("stop"), toolTip="Cancel export", autoRaise=True
         )
+        self.export_cancel.hide()
+        self.statusBar().insertPermanentWidget(1, self.export_cancel)
+
+    def prepare_actions(self):
+
+        self.components["debugger"].sigRendered.connect(self.show_rendered)
         self.components["debugger"].sigTraceback.connect(
             self.components["traceback_viewer"].addTraceback
         )
@@ -434,6 +459,24 @@ class MainWindow(QMainWindow, MainMixin):
         self.components["debugger"].sigLocals.connect(
             self.components["console"].push_vars
         )
+        self.components["debugger"].sigRendering.connect(
+            self.render_progress.setVisible
+        )
+        self.components["debugger"].sigProfiled.connect(
+            lambda profile: self.statusBar().showMessage(profile.summary())
+        )
+
+        self.components["object_tree"].sigExporting.connect(self.show_exporting)
+        self.components["object_tree"].sigExportProgress.connect(
+            self.show_export_progress
+        )
+        self.components["object_tree"].sigExporting.connect(
+            self.export_cancel.setVisible
+        )
+        self.components["object_tree"].sigExported.connect(
+            lambda msg: self.statusBar().showMessage(msg, 5000)
+        )
+        self.export_cancel.clicked.connect(self.components["object_tree"].cancel_export)
 
         self.components["object_tree"].sigObjectsAdded[list].connect(
             self.components["viewer"].display_many
@@ -490,6 +533,9 @@ class MainWindow(QMainWindow, MainMixin):
         self.components["debugger"].sigLineChanged.connect(
             self.components["editor"].set_debug_line
         )
+        self.components["debugger"].sigLineProfile.connect(
+            self.components["editor"].set_line_profile
+        )
         self.components["debugger"].sigDebugging.connect(
             self.components["object_tree"].stashObjects
         )
@@ -534,6 +580,25 @@ class MainWindow(QMainWindow, MainMixin):
             }
         )
 
+    def show_rendered(self, objects):
+        """Show the results of a render, redrawing the viewer only once."""
+
+        with self.components["viewer"].batch():
+            self.components["object_tree"].addObjects(objects)
+
+    def show_exporting(self, busy):
+
+        # busy until an export reports its progress
+        self.export_progress.setRange(0, 0)
+        self.export_progress.setFormat("Exporting")
+        self.export_progress.setVisible(busy)
+
+    def show_export_progress(self, done, total):
+
+        self.export_progress.setRange(0, total)
+        self.export_progress.setValue(done)
+        self.export_progress.setFormat("Exporting %v/%m")
+
     def _examples_dir(self):
         # In a PyInstaller bundle examples are extracted alongside the package.
         # In development they live next to the cq_editor package directory.
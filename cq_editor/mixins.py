@@ -22,9 +22,9 @@ class MainMixin(object):
     docks = {}
     preferences = None
 
-    def __init__(self):
+    def __init__(self, settings=None):
 
-        self.settings = QSettings(self.org, self.name)
+        self.settings = settings or QSettings(self.org, self.name)
 
     def registerComponent(self, name, component, dock=None):
 
@@ -0,0 +1,239 @@
+"""
+Timings of the render pipeline: running the script, building the object tree
+and displaying the results in the viewer.
+
+The stages are timed by the components themselves through PROFILER, which
+ignores them unless a render is being profiled. LineProfiler times the
+individual lines of the script.
+"""
+
+import json
+import sys
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from threading import get_ident
+from time import perf_counter
+
+from .render_worker import memory_usage
+from .runner import DUMMY_FILE
+
+
+def format_time(seconds):
+
+    if seconds < 1:
+        return f"{1e3 * seconds:.0f} ms"
+
+    return f"{seconds:.2f} s"
+
+
+class RenderProfile(object):
+    """Wall time of every stage of one render, in total and per shown object."""
+
+    def __init__(self, script_path=None):
+
+        self.started = datetime.now()
+        self.script_path = script_path
+        self.stages = OrderedDict()  # stage -> seconds
+        self.objects = OrderedDict()  # object name -> {stage: seconds}
+
+    def add(self, stage, seconds, obj=None):
+
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+        if obj is not None:
+            stages = self.objects.setdefault(obj, OrderedDict())
+            stages[stage] = stages.get(stage, 0) + seconds
+
+    @property
+    def total(self):
+
+        return sum(self.stages.values())
+
+    def summary(self):
+        """One line breakdown, slowest stages first."""
+
+        stages = sorted(self.stages.items(), key=lambda el: el[1], reverse=True)
+
+        return f"Render {format_time(self.total)}: " + ", ".join(
+            f"{stage} {format_time(seconds)}" for stage, seconds in stages
+        )
+
+    def report(self):
+        """Full breakdown, every stage and every object in pipeline order."""
+
+        lines = [f"Render profile, {format_time(self.total)} in total"]
+        lines.extend(
+            f"  {stage}: {format_time(seconds)}"
+            for stage, seconds in self.stages.items()
+        )
+
+        for obj, stages in self.objects.items():
+            lines.append(
+                f"  {obj}: "
+                + ", ".join(
+                    f"{stage} {format_time(seconds)}"
+                    for stage, seconds in stages.items()
+                )
+            )
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+
+        return dict(
+            started=self.started.isoformat(),
+            script=str(self.script_path) if self.script_path else None,
+            total=self.total,
+            stages=dict(self.stages),
+            objects={obj: dict(stages) for obj, stages in self.objects.items()},
+        )
+
+
+class Profiler(object):
+    """
+    Collects the profiles of the last renders. A profile records the stages
+    timed by the thread it is active in, a background render hands it over
+    to the render thread while it runs.
+    """
+
+    def __init__(self, history=100):
+
+        self._active = {}  # thread ident -> profile
+        self.profiles = deque(maxlen=history)
+
+    @property
+    def current(self):
+        """Profile of the current thread, if any."""
+
+        return self._active.get(get_ident())
+
+    def begin(self, script_path=None):
+
+        profile = self._active[get_ident()] = RenderProfile(script_path)
+
+        return profile
+
+    def end(self):
+
+        profile = self.detach()
+        if profile is not None:
+            self.profiles.append(profile)
+
+        return profile
+
+    def attach(self, profile):
+        """Record the stages timed by the current thread into profile."""
+
+        if profile is not None:
+            self._active[get_ident()] = profile
+
+    def detach(self):
+        """Stop recording in the current thread, the profile is returned."""
+
+        return self._active.pop(get_ident(), None)
+
+    @contextmanager
+    def stage(self, name, obj=None):
+        """Time the enclosed block as one stage, optionally of one object."""
+
+        profile = self.current
+        if profile is None:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            profile.add(name, perf_counter() - start, obj)
+
+    def export(self, filename):
+        """Write the collected profiles to a JSON file."""
+
+        with open(filename, "w") as f:
+            json.dump([p.to_dict() for p in self.profiles], f, indent=2)
+
+
+PROFILER = Profiler()
+
+
+class LineProfiler(object):
+    """
+    Wall time and memory growth per line of the script, measured while the
+    profiler is active in the current thread. Lines calling functions of the
+    script include the time spent in them. Reading the memory takes longer
+    than a short line, so it is sampled every MEMORY_INTERVAL [s] at most and
+    the growth shows up on the lines that run long.
+    """
+
+    MEMORY_INTERVAL = 0.01
+
+    def __init__(self):
+
+        self.lines = {}  # line number -> [seconds, MB, hits]
+        self.total = 0.0
+        self._open = {}  # frame -> (line number, start time, start memory)
+        self._previous = None
+        self._start = None
+        self._memory = 0.0
+        self._sampled = None
+
+    def __enter__(self):
+
+        self._previous = sys.gettrace()
+        self._memory = memory_usage()
+        self._start = self._sampled = perf_counter()
+        sys.settrace(self._trace)
+
+        return self
+
+    def __exit__(self, *args):
+
+        sys.settrace(self._previous)
+        end = perf_counter()
+        self.total = end - self._start
+
+        # frames left by an exception
+        memory = self._sample_memory(end, force=True)
+        for frame in list(self._open):
+            self._close(frame, end, memory)
+
+    def _sample_memory(self, now, force=False):
+
+        if force or now - self._sampled >= self.MEMORY_INTERVAL:
+            self._memory = memory_usage()
+            self._sampled = now
+
+        return self._memory
+
+    def _close(self, frame, end, memory):
+
+        lineno, start, start_memory = self._open.pop(frame)
+
+        stats = self.lines.setdefault(lineno, [0.0, 0.0, 0])
+        stats[0] += end - start
+        stats[1] += memory - start_memory
+        stats[2] += 1
+
+    def _trace(self, frame, event, arg):
+
+        if frame.f_code.co_filename != DUMMY_FILE:
+            return None
+
+        return self._trace_local
+
+    def _trace_local(self, frame, event, arg):
+
+        if event == "line":
+            # the time spent sampling is left out of both lines
+            end = perf_counter()
+            memory = self._sample_memory(end)
+            if frame in self._open:
+                self._close(frame, end, memory)
+            self._open[frame] = (frame.f_lineno, perf_counter(), memory)
+        elif event == "return" and frame in self._open:
+            end = perf_counter()
+            self._close(frame, end, self._sample_memory(end))
+
+        return self._trace_local
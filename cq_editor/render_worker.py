@@ -0,0 +1,278 @@
+"""
+Persistent render worker process.
+
+The worker keeps cadquery imported between runs and executes scripts with the
+same semantics as the debugger. Results travel back pickled (cadquery pickles
+shapes as BREP), so OCCT memory used while rendering stays in the worker and
+is released whenever the worker is recycled.
+"""
+
+import io
+import os
+import sys
+import pickle
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from random import seed
+from traceback import extract_tb, StackSummary
+from types import SimpleNamespace
+
+from .runner import (
+    ExecutionCache,
+    compile_script,
+    inject_locals,
+    cleanup_locals,
+    script_context,
+    RenderCancelled,
+    RenderTimeout,
+)
+from .cq_utils import find_cq_objects, reload_cq
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STATM = "/proc/self/statm"
+HAS_STATM = os.path.exists(STATM)
+
+
+def memory_usage():
+    """
+    Resident memory of the current process in MB. Without /proc the peak
+    resident memory is reported instead, 0 if unknown.
+    """
+
+    if HAS_STATM:
+        try:
+            with open(STATM) as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+        except (OSError, ValueError):
+            pass
+
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+    return 0
+
+
+def _dumps(obj):
+
+    try:
+        return pickle.dumps(obj)
+    except Exception:
+        return None
+
+
+def _pack_error(exc_info):
+    """Make an exception and its traceback picklable."""
+
+    t, exc, tb = exc_info
+    frames = [(f.filename, f.lineno, f.name, f.line) for f in extract_tb(tb)]
+
+    if _dumps((t, exc)) is None:
+        t, exc = RuntimeError, RuntimeError(f"{t.__name__}: {exc}")
+
+    return t, exc, frames
+
+
+# results of the previous run, used by incremental renders
+_cache = ExecutionCache()
+
+
+def _render(script, path, options):
+    """Execute one script and pack everything the editor needs to show it."""
+
+    output = io.StringIO()
+    messages = []
+    values = {}
+
+    def pack(obj):
+        # objects shown and listed as variables are sent only once
+        if id(obj) not in values:
+            values[id(obj)] = _dumps(obj)
+        return id(obj) if values[id(obj)] is not None else None
+
+    seed(59798267586177)
+
+    try:
+        if options["reload_cq"] or not options["incremental"]:
+            _cache.clear()
+        if options["reload_cq"]:
+            reload_cq()
+
+        script_options = (
+            options["add_to_path"],
+            options["change_dir"],
+            options["reload_modules"],
+        )
+        log = lambda x: messages.append(str(x))
+
+        with redirect_stdout(output):
+            if options["incremental"]:
+                cq_objects, module, injected_names = _cache.execute(
+                    script,
+                    path,
+                    key=script_options,
+                    context=lambda: script_context(path, *script_options),
+                    log=log,
+                )
+                if _cache.reused:
+                    messages.append(
+                        f"Reused the results of {_cache.reused} statement(s)"
+                    )
+            else:
+                cq_code, module = compile_script(script, path)
+                cq_objects, injected_names = inject_locals(module, log=log)
+
+                with script_context(path, *script_options):
+                    exec(cq_code, module.__dict__, module.__dict__)
+
+        cleanup_locals(module, injected_names)
+
+        if len(cq_objects) == 0:
+            cq_objects = find_cq_objects(module.__dict__)
+
+        objects = {k: (pack(v.shape), v.options) for k, v in cq_objects.items()}
+        local_vars = {
+            k: pack(v) for k, v in module.__dict__.items() if not k.startswith("_")
+        }
+        error = None
+    except Exception:
+        objects, local_vars = {}, {}
+        error = _pack_error(sys.exc_info())
+
+    return dict(
+        objects=objects,
+        locals=local_vars,
+        values={k: v for k, v in values.items() if v is not None},
+        error=error,
+        output=output.getvalue(),
+        messages=messages,
+        memory=memory_usage(),
+    )
+
+
+def serve(conn):
+    """Main loop of the worker process."""
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        if request is None:
+            break
+
+        conn.send(_render(**request))
+
+
+class RenderWorker(object):
+    """
+    Handle to the worker process, used from the editor process. The worker is
+    restarted after max_runs renders or once it uses more than max_memory MB
+    (0 disables either limit).
+    """
+
+    def __init__(self, max_runs=0, max_memory=0):
+
+        self.max_runs = max_runs
+        self.max_memory = max_memory
+
+        self._ctx = get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._runs = 0
+        self._killed = False
+
+    @property
+    def alive(self):
+
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Start the worker unless it is already running."""
+
+        self._killed = False
+
+        if self.alive:
+            return
+
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(
+            target=serve, args=(child_conn,), name="cq-editor-render", daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+
+        self._runs = 0
+
+    def render(self, script, path=None, timeout=0, **options):
+        """
+        Run a script in the worker and block until it is done. Returns the
+        shown objects, the script variables, exc_info (or None) and the
+        captured output.
+        """
+
+        self.start()
+
+        self._conn.send(dict(script=script, path=path, options=options))
+
+        try:
+            if not self._conn.poll(timeout if timeout > 0 else None):
+                self.kill()
+                raise RenderTimeout
+
+            reply = self._conn.recv()
+        except (EOFError, OSError):
+            if self._killed:
+                raise RenderCancelled
+            self._process.join(1)
+            exitcode = self._process.exitcode
+            self._process = None
+            raise RuntimeError(f"Render worker exited unexpectedly ({exitcode})")
+
+        self._runs += 1
+        if (self.max_runs and self._runs >= self.max_runs) or (
+            self.max_memory and reply["memory"] > self.max_memory
+        ):
+            self.shutdown()
+            self.start()
+
+        values = {k: pickle.loads(v) for k, v in reply["values"].items()}
+        objects = {
+            k: SimpleNamespace(shape=values[v], options=o)
+            for k, (v, o) in reply["objects"].items()
+            if v is not None
+        }
+        local_vars = {k: values[v] for k, v in reply["locals"].items() if v is not None}
+
+        exc_info = None
+        if reply["error"]:
+            t, exc, frames = reply["error"]
+            exc_info = (t, exc, StackSummary.from_list(frames))
+
+        return objects, local_vars, exc_info, reply["output"], reply["messages"]
+
+    def kill(self):
+        """Abort whatever the worker is doing, the next render restarts it."""
+
+        if self.alive:
+            self._killed = True
+            self._process.kill()
+
+            # the next render must not find the dying process still alive
+            self._process.join()
+            self._process = None
+
+    def shutdown(self):
+
+        if self.alive:
+            self._conn.send(None)
+            self._process.join(5)
+            self.kill()
+
+        self._process = None
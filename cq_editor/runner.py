@@ -0,0 +1,460 @@
+"""
+Script execution semantics shared by the debugger and the render worker.
+
+Nothing in here depends on Qt, so it can be used in processes without a GUI.
+"""
+
+import ast
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+from hashlib import sha1
+from inspect import currentframe
+from importlib.abc import MetaPathFinder
+from random import randrange as rrr, getstate, setstate
+from threading import get_ident
+from types import ModuleType, SimpleNamespace
+
+import cadquery as cq
+from logbook import info
+from path import Path
+
+DUMMY_FILE = "<cq_editor-string>"
+
+# module global holding the parameter values of a script
+PARAMETERS = "__cq_parameters__"
+
+
+class RenderCancelled(BaseException):
+    """Raised inside a running script to abort the render."""
+
+
+class RenderTimeout(RenderCancelled):
+    """Raised inside a running script that exceeded the time limit."""
+
+
+def rand_color(alpha=0.0, cfloat=False):
+    # helper function to generate a random color dict
+    # for CQ-editor's show_object function
+    lower = 10
+    upper = 100  # not too high to keep color brightness in check
+    if cfloat:  # for two output types depending on need
+        return (
+            (rrr(lower, upper) / 255),
+            (rrr(lower, upper) / 255),
+            (rrr(lower, upper) / 255),
+            alpha,
+        )
+    return {
+        "alpha": alpha,
+        "color": (
+            rrr(lower, upper),
+            rrr(lower, upper),
+            rrr(lower, upper),
+        ),
+    }
+
+
+def make_module(cq_script_path=None):
+    """Empty module for a script to run in."""
+
+    module = ModuleType("__cq_main__")
+    if cq_script_path:
+        module.__dict__["__file__"] = cq_script_path
+
+    return module
+
+
+def _parametrize(tree, parameters):
+    """
+    Make top-level assignments to the names in parameters take the value from
+    the PARAMETERS dict instead, if it has one for the name.
+    """
+
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+            target = stmt.targets[0]
+        elif isinstance(stmt, ast.AnnAssign) and stmt.value is not None:
+            target = stmt.target
+        else:
+            continue
+
+        if not isinstance(target, ast.Name) or target.id not in parameters:
+            continue
+
+        override = ast.parse(
+            f"{PARAMETERS}[{target.id!r}] if {target.id!r} in {PARAMETERS} else 0",
+            mode="eval",
+        ).body
+        override.orelse = stmt.value
+        stmt.value = ast.copy_location(override, stmt.value)
+
+    return ast.fix_missing_locations(tree)
+
+
+def compile_script(cq_script, cq_script_path=None, parameters=()):
+    """
+    Compile a script into a code object and the module it will run in.
+    Top-level assignments to the names in parameters can be overridden per
+    run with inject_parameters, without compiling the script again.
+    """
+
+    module = make_module(cq_script_path)
+
+    if parameters:
+        tree = _parametrize(ast.parse(cq_script, DUMMY_FILE), set(parameters))
+        cq_code = compile(tree, DUMMY_FILE, "exec")
+        inject_parameters(module, {})
+    else:
+        cq_code = compile(cq_script, DUMMY_FILE, "exec")
+
+    return cq_code, module
+
+
+def inject_parameters(module, values):
+    """
+    Set the values of parameters of a script compiled with compile_script.
+    Returns the names to clean up later.
+    """
+
+    module.__dict__.update(values)
+    module.__dict__[PARAMETERS] = dict(values)
+
+    return {PARAMETERS}
+
+
+def inject_locals(module, log=None):
+    """
+    Add show_object, debug, rand_color, log and cq to the module namespace.
+    Returns the dict filled by show_object and the names to clean up later.
+    """
+
+    cq_objects = {}
+
+    def _show_object(obj, name=None, options={}):
+
+        if name:
+            cq_objects.update({name: SimpleNamespace(shape=obj, options=options)})
+        else:
+            # get locals of the enclosing scope
+            d = currentframe().f_back.f_locals
+
+            # try to find the name
+            try:
+                name = list(d.keys())[list(d.values()).index(obj)]
+            except ValueError:
+                # use id if not found
+                name = str(id(obj))
+
+            cq_objects.update({name: SimpleNamespace(shape=obj, options=options)})
+
+    def _debug(obj, name=None):
+
+        _show_object(obj, name, options=dict(color="red", alpha=0.2))
+
+    module.__dict__["show_object"] = _show_object
+    module.__dict__["debug"] = _debug
+    module.__dict__["rand_color"] = rand_color
+    module.__dict__["log"] = log if log else lambda x: info(str(x))
+    module.__dict__["cq"] = cq
+
+    return cq_objects, set(module.__dict__) - {"cq"}
+
+
+def cleanup_locals(module, injected_names):
+
+    for name in injected_names:
+        module.__dict__.pop(name)
+
+
+@contextmanager
+def script_context(
+    cq_script_path=None, add_to_path=True, change_dir=True, reload_modules=True
+):
+    """Environment a script runs in: path, working dir and module unloading."""
+
+    with ExitStack() as stack:
+        p = Path(cq_script_path or "").absolute().dirname()
+
+        if add_to_path and p.exists():
+            sys.path.insert(0, p)
+            stack.callback(sys.path.remove, p)
+        if change_dir and p.exists():
+            stack.enter_context(p)
+        if reload_modules:
+            stack.enter_context(module_manager())
+
+        yield
+
+
+class ImportRecorder(MetaPathFinder):
+    """Records the modules imported by one thread, finds nothing itself."""
+
+    def __init__(self):
+
+        self.ident = get_ident()
+        self.names = set()
+
+    def find_spec(self, fullname, path, target=None):
+
+        # only called for modules that are not loaded yet
+        if get_ident() == self.ident:
+            self.names.add(fullname)
+
+        return None
+
+
+@contextmanager
+def module_manager():
+    """
+    unloads any modules loaded while the context manager is active, by the
+    thread that entered it - other threads, like the GUI, keep their imports
+    """
+    recorder = ImportRecorder()
+    sys.meta_path.insert(0, recorder)
+
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(recorder)
+        for module_name in recorder.names:
+            sys.modules.pop(module_name, None)
+
+
+# calls that are known not to modify their arguments
+_PURE_CALLS = {"show_object", "debug", "log", "print", "rand_color"}
+
+# objects whose methods return new objects instead of modifying themselves
+_PURE_TYPES = (
+    ModuleType,
+    type,
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    bool,
+    tuple,
+    frozenset,
+    cq.Workplane,
+    cq.Shape,
+    cq.Vector,
+    cq.Location,
+)
+
+# methods of the types above that do modify the object in place
+_IN_PLACE_METHODS = {"move", "locate"}
+
+
+def _binds_names(target):
+
+    if isinstance(target, ast.Name):
+        return True
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        return all(_binds_names(el) for el in target.elts)
+    elif isinstance(target, ast.Starred):
+        return _binds_names(target.value)
+
+    return False
+
+
+def _calls_are_pure(node, namespace):
+
+    for call in (n for n in ast.walk(node) if isinstance(n, ast.Call)):
+        func = call.func
+
+        if isinstance(func, ast.Attribute):
+            if func.attr in _IN_PLACE_METHODS:
+                return False
+
+            # find the object the method chain starts from
+            root = func.value
+            while isinstance(root, (ast.Attribute, ast.Call, ast.Subscript)):
+                root = root.func if isinstance(root, ast.Call) else root.value
+
+            if isinstance(root, ast.Name) and not isinstance(
+                namespace.get(root.id), _PURE_TYPES
+            ):
+                return False
+
+    return True
+
+
+def is_pure_statement(stmt, namespace):
+    """
+    Guess if a top-level statement leaves the objects that already exist in
+    namespace untouched. Rebinding names is fine, changing objects in place
+    (augmented, attribute or item assignment, method calls on mutable objects)
+    is not.
+    """
+
+    if isinstance(stmt, (ast.Import, ast.ImportFrom, ast.Pass)):
+        return True
+    elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return _calls_are_pure(ast.Module(stmt.decorator_list, []), namespace)
+    elif isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+        targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+        return all(_binds_names(t) for t in targets) and _calls_are_pure(
+            stmt, namespace
+        )
+    elif isinstance(stmt, ast.Expr):
+        value = stmt.value
+        if isinstance(value, ast.Constant):
+            return True
+        return (
+            isinstance(value, ast.Call)
+            and isinstance(value.func, ast.Name)
+            and value.func.id in _PURE_CALLS
+            and _calls_are_pure(value, namespace)
+        )
+    elif isinstance(stmt, (ast.If, ast.For, ast.While)):
+        if isinstance(stmt, ast.For) and not _binds_names(stmt.target):
+            return False
+        test = stmt.iter if isinstance(stmt, ast.For) else stmt.test
+        return _calls_are_pure(test, namespace) and all(
+            is_pure_statement(el, namespace) for el in stmt.body + stmt.orelse
+        )
+
+    return False
+
+
+def _mtime(filename):
+
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+class ExecutionCache(object):
+    """
+    Incremental execution of scripts. The namespace is snapshotted after every
+    top-level statement, the next run restores the snapshot taken after the
+    last unchanged statement and executes only the rest of the script.
+
+    A statement is identified by its source, its position and everything
+    before it. The whole script runs again if a statement after the reused
+    ones changed objects in place, if a module imported by the script changed
+    on disk or if the key (path and run options) differs.
+    """
+
+    def __init__(self):
+
+        self.clear()
+
+    def clear(self):
+
+        self._key = None
+        self._module = None
+        self._injected_names = None
+        self._executed = []  # (fingerprint, pure) of every statement run
+        self._snapshots = []  # (namespace, shown objects, random state)
+        self._imported = {}  # module file -> mtime
+        self.reused = 0
+
+    def _statements(self, cq_script):
+
+        tree = ast.parse(cq_script, DUMMY_FILE)
+
+        # future imports apply to the whole module
+        if any(
+            isinstance(stmt, ast.ImportFrom) and stmt.module == "__future__"
+            for stmt in tree.body
+        ):
+            return [(None, tree, compile(tree, DUMMY_FILE, "exec"))]
+
+        rv = []
+        fingerprint = sha1()
+
+        for stmt in tree.body:
+            fingerprint.update(ast.dump(stmt, include_attributes=True).encode())
+            module = ast.Module([stmt], [])
+            rv.append(
+                (fingerprint.hexdigest(), stmt, compile(module, DUMMY_FILE, "exec"))
+            )
+
+        return rv
+
+    def _reusable(self, statements):
+        """Number of leading statements that do not need to run again."""
+
+        if self._module is None:
+            return 0
+
+        # only statements that completed have a snapshot
+        completed = self._executed[: len(self._snapshots)]
+
+        n = 0
+        for (fingerprint, *_), (previous, _) in zip(statements, completed):
+            if fingerprint is None or fingerprint != previous:
+                break
+            n += 1
+
+        # objects in the snapshot might have been changed by later statements
+        if not all(pure for _, pure in self._executed[n:]):
+            return 0
+
+        return n
+
+    def execute(self, cq_script, cq_script_path=None, key=None, context=None, log=None):
+        """
+        Run cq_script reusing what is possible from the previous run. Returns
+        the shown objects, the module and the injected names, like
+        compile_script and inject_locals followed by exec would.
+        """
+
+        statements = self._statements(cq_script)
+
+        key = (cq_script_path, key)
+        if key != self._key or any(_mtime(f) != t for f, t in self._imported.items()):
+            self.clear()
+            self._key = key
+
+        n = self._reusable(statements)
+
+        if n == 0:
+            _, module = compile_script(cq_script, cq_script_path)
+            cq_objects, injected_names = inject_locals(module, log)
+
+            self._module = module
+            self._injected_names = injected_names
+            self._executed = []
+            self._snapshots = []
+            self._imported = {}
+        else:
+            module = self._module
+            namespace, shown, state = self._snapshots[n - 1]
+
+            module.__dict__.clear()
+            module.__dict__.update(namespace)
+            cq_objects, _ = inject_locals(module, log)
+            cq_objects.update(shown)
+            setstate(state)
+
+        self.reused = n
+
+        namespace = module.__dict__
+        loaded_modules = set(sys.modules)
+
+        with context() if context else ExitStack():
+            try:
+                for i in range(n, len(statements)):
+                    fingerprint, stmt, code = statements[i]
+
+                    del self._snapshots[i:]
+                    self._executed[i:] = [
+                        (fingerprint, is_pure_statement(stmt, namespace))
+                    ]
+
+                    exec(code, namespace, namespace)
+
+                    self._snapshots.append(
+                        (dict(namespace), dict(cq_objects), getstate())
+                    )
+            finally:
+                for name in set(sys.modules) - loaded_modules:
+                    filename = getattr(sys.modules[name], "__file__", None)
+                    if filename:
+                        self._imported[filename] = _mtime(filename)
+
+        return cq_objects, module, self._injected_names
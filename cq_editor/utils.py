@@ -128,6 +128,11 @@ def get_open_filename(suffix, curr_dir):
     return rv
 
 
+def get_save_directory():
+
+    return QFileDialog.getExistingDirectory()
+
+
 def check_gtihub_for_updates(
     parent, mod, github_org="cadquery", github_proj="cadquery"
 ):
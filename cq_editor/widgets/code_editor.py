@@ -1,10 +1,15 @@
 # Much of this code was adapted from https://github.com/leixingyu/codeEditor which is under
 # an MIT license
 import os
+from difflib import SequenceMatcher
+
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtGui import QPalette, QColor
 
+from ..profiler import format_time
+
 DARK_BLUE = QtGui.QColor(118, 150, 185)
+HEAT_COLOR = QtGui.QColor(230, 60, 30)
 
 
 class SearchWidget(QtWidgets.QWidget):
@@ -280,6 +285,21 @@ class LineNumberArea(QtWidgets.QWidget):
 
         return None
 
+    def event(self, event):
+        """
+        Shows the profile of the line under the mouse as a tooltip.
+        """
+        if event.type() == QtCore.QEvent.ToolTip:
+            line_number = self.get_line_number_from_position(event.pos())
+            text = self._code_editor.line_profile_text(line_number)
+            if text:
+                QtWidgets.QToolTip.showText(event.globalPos(), text, self)
+            else:
+                QtWidgets.QToolTip.hideText()
+            return True
+
+        return super(LineNumberArea, self).event(event)
+
     def paintEvent(self, event):
         self._code_editor.lineNumberAreaPaintEvent(event)
 
@@ -464,6 +484,11 @@ class CodeEditor(CodeTextEdit):
 
         self._filename = ""
 
+        # line number -> (seconds, MB, hits) from the last profiled render
+        self.line_profile = {}
+        self._line_profile_total = 0
+        self.textChanged.connect(self.clear_line_profile)
+
     def keyPressEvent(self, event):
         # Handle Ctrl+F for search
         if (
@@ -729,6 +754,56 @@ class CodeEditor(CodeTextEdit):
         # Set the document to be modified
         self.document().setModified(True)
 
+    def update_text(self, new_text):
+        """
+        Changes the text content of the editor to new_text, replacing only the
+        lines that differ in a single undo step. Cursor and scroll position
+        follow the unchanged text.
+        :param str new_text: Text to be set in the editor.
+        :return: True if the text changed.
+        """
+        document = self.document()
+
+        # one line per block, only "\n" starts a new block (unlike e.g. form
+        # feeds for str.splitlines), the last line has no line end
+        old_lines = []
+        block = document.begin()
+        while block.isValid():
+            old_lines.append(block.text() + "\n")
+            block = block.next()
+        old_lines[-1] = old_lines[-1][:-1]
+
+        new_lines = [line + "\n" for line in new_text.split("\n")]
+        new_lines[-1] = new_lines[-1][:-1]
+
+        # positions are taken from the blocks so that they are counted like
+        # Qt does
+        def line_position(i):
+            if i < len(old_lines):
+                return document.findBlockByNumber(i).position()
+            return document.characterCount() - 1
+
+        opcodes = [
+            op
+            for op in SequenceMatcher(None, old_lines, new_lines).get_opcodes()
+            if op[0] != "equal"
+        ]
+        if not opcodes:
+            return False
+
+        cursor = QtGui.QTextCursor(document)
+        cursor.beginEditBlock()
+
+        # from the end, so the positions of the earlier lines stay valid
+        for _, i1, i2, j1, j2 in reversed(opcodes):
+            cursor.setPosition(line_position(i1))
+            cursor.setPosition(line_position(i2), QtGui.QTextCursor.KeepAnchor)
+            cursor.insertText("".join(new_lines[j1:j2]))
+
+        cursor.endEditBlock()
+
+        return True
+
     def set_text_from_file(self, file_name):
         """
         Allows the editor text to be set from a file.
@@ -786,6 +861,10 @@ class CodeEditor(CodeTextEdit):
             top = self.blockBoundingGeometry(block).translated(offset).top()
             bottom = top + self.blockBoundingRect(block).height()
 
+            max_time = max(
+                (seconds for seconds, *_ in self.line_profile.values()), default=0
+            ) or float("inf")
+
             while block.isValid() and top <= event.rect().bottom():
                 if block.isVisible() and bottom >= event.rect().top():
                     line_number = block_number + 1
@@ -820,6 +899,19 @@ class CodeEditor(CodeTextEdit):
                         )
                         painter.drawPolygon(arrow)
 
+                    # Draw the heat bar of the profiled render
+                    if line_number in self.line_profile:
+                        heat = self.line_profile[line_number][0] / max_time
+                        color = QtGui.QColor(HEAT_COLOR)
+                        color.setAlphaF(0.15 + 0.85 * heat)
+                        painter.fillRect(
+                            self.line_number_area.width() - 6,
+                            int(top),
+                            4,
+                            int(bottom - top),
+                            color,
+                        )
+
                     # Draw the line number
                     number = str(line_number)
                     painter.setPen(DARK_BLUE)
@@ -836,6 +928,42 @@ class CodeEditor(CodeTextEdit):
         finally:
             painter.end()
 
+    def set_line_profile(self, lines, total=None):
+        """
+        Shows the time spent on every line as a heat bar next to the line numbers.
+        total is the duration of the whole run, lines calling functions of the
+        script include the time spent in them.
+        """
+        self.line_profile = {
+            line_number: tuple(stats) for line_number, stats in lines.items()
+        }
+        self._line_profile_total = total or sum(el[0] for el in lines.values())
+        self.line_number_area.update()
+
+    def clear_line_profile(self):
+        """
+        Removes the heat bar, the profile no longer matches edited code.
+        """
+        if self.line_profile:
+            self.line_profile = {}
+            self.line_number_area.update()
+
+    def line_profile_text(self, line_number):
+        """
+        Describes the profile of a line, None if it was not profiled.
+        """
+        if line_number not in self.line_profile:
+            return None
+
+        seconds, memory, hits = self.line_profile[line_number]
+        share = seconds / (self._line_profile_total or 1)
+
+        text = f"{format_time(seconds)} ({100 * share:.0f}%), {hits} hit(s)"
+        if memory >= 1:
+            text += f", +{memory:.0f} MB"
+
+        return text
+
     def update_line_number_area_width(self, newBlockCount):
         self.setViewportMargins(self.line_number_area_width(), 0, 0, 0)
 
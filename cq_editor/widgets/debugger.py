@@ -1,33 +1,49 @@
 import sys
-from contextlib import ExitStack, contextmanager
+import ctypes
+from contextlib import ExitStack, nullcontext
+from functools import partial
+from threading import Lock, Timer, get_ident
 from enum import Enum, auto
-from types import SimpleNamespace, FrameType, ModuleType
+from types import FrameType, TracebackType
 from typing import List
 from bdb import BdbQuit
-from inspect import currentframe
 
-import cadquery as cq
 from PyQt5 import QtCore
 from PyQt5.QtCore import (
     Qt,
     QObject,
     pyqtSlot,
     pyqtSignal,
+    QEvent,
     QEventLoop,
     QAbstractTableModel,
+    QThread,
 )
-from PyQt5.QtWidgets import QAction, QTableView
+from PyQt5.QtWidgets import QAction, QApplication, QMenu, QTableView, QWidget
 
 from logbook import info
 from path import Path
 from pyqtgraph.parametertree import Parameter
 from ..icons import icon
-from random import randrange as rrr, seed
+from ..utils import get_save_filename
+from random import seed
 
 from ..cq_utils import find_cq_objects, reload_cq
 from ..mixins import ComponentMixin
-
-DUMMY_FILE = "<cq_editor-string>"
+from ..profiler import PROFILER, LineProfiler
+from ..render_worker import RenderWorker
+from ..runner import (
+    DUMMY_FILE,
+    ExecutionCache,
+    RenderCancelled,
+    RenderTimeout,
+    rand_color,
+    compile_script,
+    inject_locals,
+    cleanup_locals,
+    script_context,
+    module_manager,
+)
 
 
 class DbgState(Enum):
@@ -111,6 +127,126 @@ class LocalsView(QTableView, ComponentMixin):
         self.setModel(model)
 
 
+def cancel_thread(ident, exc_type=RenderCancelled):
+    """Asynchronously raise exc_type in the thread with the given ident."""
+
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(ident), ctypes.py_object(exc_type)
+    )
+
+
+class Watchdog:
+    """
+    Raises RenderTimeout in the thread that entered it once time_limit [s] is
+    exceeded, 0 disables it. A timer firing while the watchdog is left does
+    nothing, so the timeout never escapes into the code run afterwards. One
+    that fired just before is raised by __exit__ at the latest.
+    """
+
+    def __init__(self, time_limit):
+
+        self._ident = get_ident()
+        self._lock = Lock()
+        self._done = False
+        self._timer = Timer(time_limit, self._expire) if time_limit > 0 else None
+
+    def __enter__(self):
+
+        if self._timer:
+            self._timer.start()
+
+        return self
+
+    def __exit__(self, *args):
+
+        with self._lock:
+            self._done = True
+
+            if self._timer:
+                self._timer.cancel()
+
+    def _expire(self):
+
+        with self._lock:
+            if not self._done:
+                cancel_thread(self._ident, RenderTimeout)
+
+
+class RenderThread(QThread):
+    """Runs a render callable outside of the GUI thread and keeps its result."""
+
+    def __init__(self, parent, target, cancel=None, profile=None, context=nullcontext):
+
+        super(RenderThread, self).__init__(parent)
+
+        self._target = target
+        self._cancel = cancel
+        self._context = context
+        self.profile = profile
+        self._ident = None
+        self._cancelled = False
+        self.result = None
+
+    def run(self):
+
+        self._ident = get_ident()
+        PROFILER.attach(self.profile)
+
+        try:
+            if self._cancelled:
+                raise RenderCancelled
+
+            with self._context():
+                self.result = self._target()
+        except RenderCancelled:
+            # cancelled before or after the script itself ran
+            self.result = (None, None, sys.exc_info())
+        finally:
+            PROFILER.detach()
+
+    def cancel(self):
+
+        self._cancelled = True
+
+        if self._cancel:
+            self._cancel()
+        elif self._ident is not None and self.isRunning():
+            cancel_thread(self._ident)
+
+
+class StopOnlyFilter(QObject):
+    """Swallows the user input of the application, except for one action."""
+
+    INPUT = (
+        QEvent.KeyPress,
+        QEvent.KeyRelease,
+        QEvent.MouseButtonPress,
+        QEvent.MouseButtonRelease,
+        QEvent.MouseButtonDblClick,
+        QEvent.Wheel,
+        QEvent.ContextMenu,
+        QEvent.Shortcut,
+    )
+
+    def __init__(self, action):
+
+        super(StopOnlyFilter, self).__init__(action)
+
+        self._action = action
+
+    def eventFilter(self, obj, event):
+
+        if event.type() not in self.INPUT or obj is self._action:
+            return False
+
+        # menus would give access to the other actions too
+        return not (
+            isinstance(obj, QWidget)
+            and not isinstance(obj, QMenu)
+            and obj in self._action.associatedWidgets()
+        )
+
+
 class Debugger(QObject, ComponentMixin):
 
     name = "Debugger"
@@ -122,6 +258,50 @@ class Debugger(QObject, ComponentMixin):
             {"name": "Add script dir to path", "type": "bool", "value": True},
             {"name": "Change working dir to script dir", "type": "bool", "value": True},
             {"name": "Reload imported modules", "type": "bool", "value": True},
+            {
+                "name": "Render in background",
+                "type": "bool",
+                "value": False,
+                "tip": "Keep the editor responsive while the script runs, "
+                "otherwise only Stop render takes input meanwhile. The working "
+                "dir is the script dir for the whole editor meanwhile",
+            },
+            {
+                "name": "Incremental render",
+                "type": "bool",
+                "value": False,
+                "tip": "Re-run only the top-level statements from the first "
+                "edited one onwards",
+            },
+            {
+                "name": "Render time limit [s]",
+                "type": "float",
+                "value": 0.0,
+                "limits": (0, None),
+                "tip": "Stop renders running longer than this, 0 disables the limit",
+            },
+            {"name": "Render in worker process", "type": "bool", "value": False},
+            {
+                "name": "Worker runs before restart",
+                "type": "int",
+                "value": 100,
+                "limits": (0, None),
+                "tip": "Restart the worker process after this many renders, 0 never",
+            },
+            {
+                "name": "Worker memory limit [MB]",
+                "type": "int",
+                "value": 4096,
+                "limits": (0, None),
+                "tip": "Restart the worker process when it uses more memory, 0 never",
+            },
+            {
+                "name": "Profile renders",
+                "type": "bool",
+                "value": False,
+                "tip": "Time every stage of a render and show the breakdown in "
+                "the status bar and the log",
+            },
         ],
     )
 
@@ -134,6 +314,9 @@ class Debugger(QObject, ComponentMixin):
     sigLocalsChanged = pyqtSignal(dict)
     sigCQChanged = pyqtSignal(dict, bool)
     sigDebugging = pyqtSignal(bool)
+    sigRendering = pyqtSignal(bool)
+    sigProfiled = pyqtSignal(object)
+    sigLineProfile = pyqtSignal(dict, float)
 
     _frames: List[FrameType]
     _stop_debugging: bool
@@ -185,6 +368,73 @@ class Debugger(QObject, ComponentMixin):
         self._frames = []
         self._stop_debugging = False
 
+        self._render_thread = None
+        self._render_pending = False
+        self._render_context = None
+        self._worker = None
+        self._cache = ExecutionCache()
+
+        self._stop_action = QAction(
+            icon("stop"),
+            "Stop render",
+            self,
+            shortcut="ctrl+shift+F5",
+            enabled=False,
+            triggered=self.stop_render,
+        )
+        self._stop_only = StopOnlyFilter(self._stop_action)
+
+        self._profile_action = QAction(
+            icon("profile"),
+            "Profile render",
+            self,
+            shortcut="alt+F5",
+            triggered=self.profile_render,
+        )
+
+        self._export_profiles_action = QAction(
+            "Export render profiles",
+            self,
+            enabled=False,
+            triggered=self.export_profiles,
+        )
+
+    def updatePreferences(self, *args):
+
+        if not self.preferences["Incremental render"]:
+            self._cache.clear()
+
+        # keep the worker process warm while it is enabled
+        if self.preferences["Render in worker process"]:
+            if self._worker is None:
+                self._worker = RenderWorker()
+            self._worker.max_runs = self.preferences["Worker runs before restart"]
+            self._worker.max_memory = self.preferences["Worker memory limit [MB]"]
+            self._worker.start()
+        elif self._worker is not None and self._render_thread is None:
+            self._worker.shutdown()
+            self._worker = None
+
+    def menuActions(self):
+
+        run, *rest = self._actions["Run"]
+
+        return {
+            "Run": [run, self._stop_action, self._profile_action, *rest],
+            "Tools": [self._export_profiles_action],
+        }
+
+    def toolbarActions(self):
+
+        return self.menuActions()["Run"]
+
+    @pyqtSlot()
+    def export_profiles(self):
+
+        fname = get_save_filename("json")
+        if fname != "":
+            PROFILER.export(fname)
+
     def get_current_script(self):
 
         return self.parent().components["editor"].get_text_with_eol()
@@ -205,122 +455,317 @@ class Debugger(QObject, ComponentMixin):
     def compile_code(self, cq_script, cq_script_path=None):
 
         try:
-            module = ModuleType("__cq_main__")
-            if cq_script_path:
-                module.__dict__["__file__"] = cq_script_path
-            cq_code = compile(cq_script, DUMMY_FILE, "exec")
-            return cq_code, module
+            return compile_script(cq_script, cq_script_path)
         except Exception:
             self.sigTraceback.emit(sys.exc_info(), cq_script)
             return None, None
 
-    def _exec(self, code, locals_dict, globals_dict):
+    def _script_options(self):
+
+        return (
+            self.preferences["Add script dir to path"],
+            self.preferences["Change working dir to script dir"],
+            self.preferences["Reload imported modules"],
+        )
+
+    def _script_context(self):
 
-        with ExitStack() as stack:
-            p = (self.get_current_script_path() or Path("")).absolute().dirname()
+        # a background render runs in the context the GUI thread entered
+        if self._render_context is not None:
+            return nullcontext()
 
-            if self.preferences["Add script dir to path"] and p.exists():
-                sys.path.insert(0, p)
-                stack.callback(sys.path.remove, p)
-            if self.preferences["Change working dir to script dir"] and p.exists():
-                stack.enter_context(p)
-            if self.preferences["Reload imported modules"]:
-                stack.enter_context(module_manager())
+        return script_context(self.get_current_script_path(), *self._script_options())
 
+    def _exec(self, code, locals_dict, globals_dict):
+
+        with self._script_context():
             exec(code, locals_dict, globals_dict)
 
-    @staticmethod
-    def _rand_color(alpha=0.0, cfloat=False):
-        # helper function to generate a random color dict
-        # for CQ-editor's show_object function
-        lower = 10
-        upper = 100  # not too high to keep color brightness in check
-        if cfloat:  # for two output types depending on need
-            return (
-                (rrr(lower, upper) / 255),
-                (rrr(lower, upper) / 255),
-                (rrr(lower, upper) / 255),
-                alpha,
-            )
-        return {
-            "alpha": alpha,
-            "color": (
-                rrr(lower, upper),
-                rrr(lower, upper),
-                rrr(lower, upper),
-            ),
-        }
+    _rand_color = staticmethod(rand_color)
 
     def _inject_locals(self, module):
 
-        cq_objects = {}
+        return inject_locals(module)
 
-        def _show_object(obj, name=None, options={}):
+    def _cleanup_locals(self, module, injected_names):
 
-            if name:
-                cq_objects.update({name: SimpleNamespace(shape=obj, options=options)})
-            else:
-                # get locals of the enclosing scope
-                d = currentframe().f_back.f_locals
+        cleanup_locals(module, injected_names)
 
-                # try to find the name
-                try:
-                    name = list(d.keys())[list(d.values()).index(obj)]
-                except ValueError:
-                    # use id if not found
-                    name = str(id(obj))
+    @pyqtSlot(bool)
+    def render(self):
 
-                cq_objects.update({name: SimpleNamespace(shape=obj, options=options)})
+        # only one render at a time - re-run once the current one is done
+        if self._render_thread is not None:
+            self._render_pending = True
+            return
 
-        def _debug(obj, name=None):
+        cq_script = self.get_current_script()
+        cq_script_path = self.get_current_script_path()
 
-            _show_object(obj, name, options=dict(color="red", alpha=0.2))
+        if self.preferences["Profile renders"]:
+            PROFILER.begin(cq_script_path)
 
-        module.__dict__["show_object"] = _show_object
-        module.__dict__["debug"] = _debug
-        module.__dict__["rand_color"] = self._rand_color
-        module.__dict__["log"] = lambda x: info(str(x))
-        module.__dict__["cq"] = cq
+        with PROFILER.stage("compile"):
+            cq_code, module = self.compile_code(cq_script, cq_script_path)
 
-        return cq_objects, set(module.__dict__) - {"cq"}
+        if cq_code is None:
+            self._end_profile()
+            return
 
-    def _cleanup_locals(self, module, injected_names):
+        cancel = None
+        if self.preferences["Render in worker process"]:
+            self.updatePreferences()
+            target = partial(self._run_in_worker, cq_script, cq_script_path)
+            cancel = self._worker.kill
+        else:
+            seed(59798267586177)
+            if self.preferences["Reload CQ"]:
+                self._cache.clear()
+                reload_cq()
 
-        for name in injected_names:
-            module.__dict__.pop(name)
+            if self.preferences["Incremental render"]:
+                target = partial(self._run_incremental, cq_script, cq_script_path)
+            else:
+                cq_objects, injected_names = self._inject_locals(module)
+                target = partial(self._run, cq_code, module, cq_objects, injected_names)
+
+        # the working dir and sys.path are process wide, they are only changed
+        # by the GUI thread, around the whole render - the modules to unload
+        # are the ones imported by the render thread
+        context = nullcontext
+        if cancel is None:
+            add_to_path, change_dir, reload_modules = self._script_options()
+            self._render_context = ExitStack()
+            self._render_context.enter_context(
+                script_context(cq_script_path, add_to_path, change_dir, False)
+            )
+            if reload_modules:
+                context = module_manager
+
+        # the GUI thread records nothing into the profile meanwhile
+        self._render_thread = thread = RenderThread(
+            self, target, cancel, PROFILER.detach(), context
+        )
+        thread.finished.connect(lambda: self._render_finished(thread, cq_script))
+
+        # renders always run in a thread, so that Stop can cancel them - in
+        # the foreground the GUI waits for the results and takes only Stop
+        loop = None
+        if not self.preferences["Render in background"]:
+            loop = QEventLoop()
+            thread.finished.connect(loop.quit)
+
+        self._actions["Run"][1].setEnabled(False)
+        self._stop_action.setEnabled(True)
+        self.sigRendering.emit(True)
+
+        thread.start()
+
+        if loop is not None:
+            app = QApplication.instance()
+            app.installEventFilter(self._stop_only)
+            try:
+                loop.exec_()
+            finally:
+                app.removeEventFilter(self._stop_only)
 
-    @pyqtSlot(bool)
-    def render(self):
+    @pyqtSlot()
+    def profile_render(self):
+        """
+        Render in the foreground while timing every line of the script. The
+        script always runs in this process, even if renders normally use the
+        worker.
+        """
 
-        seed(59798267586177)
-        if self.preferences["Reload CQ"]:
-            reload_cq()
+        if self._render_thread is not None:
+            return
 
         cq_script = self.get_current_script()
-        cq_script_path = self.get_current_script_path()
-        cq_code, module = self.compile_code(cq_script, cq_script_path)
+        cq_code, module = self.compile_code(cq_script, self.get_current_script_path())
 
         if cq_code is None:
             return
 
+        seed(59798267586177)
+        if self.preferences["Reload CQ"]:
+            self._cache.clear()
+            reload_cq()
+
         cq_objects, injected_names = self._inject_locals(module)
 
-        try:
+        with LineProfiler() as profiler:
+            rv = self._run(cq_code, module, cq_objects, injected_names)
+
+        self._emit_results(cq_script, *rv)
+        self.sigLineProfile.emit(profiler.lines, profiler.total)
+
+    def _run(self, cq_code, module, cq_objects, injected_names):
+        """
+        Execute the compiled script and collect the shown objects. Safe to call
+        from a worker thread - nothing here touches the GUI.
+        """
+
+        def execute():
             self._exec(cq_code, module.__dict__, module.__dict__)
+            return cq_objects, module, injected_names
 
-            # remove the special methods
-            self._cleanup_locals(module, injected_names)
+        return self._collect(execute)
 
-            # collect all CQ objects if no explicit show_object was called
-            if len(cq_objects) == 0:
-                cq_objects = find_cq_objects(module.__dict__)
-            self.sigRendered.emit(cq_objects)
-            self.sigTraceback.emit(None, cq_script)
-            self.sigLocals.emit(module.__dict__)
-        except Exception:
-            exc_info = sys.exc_info()
+    def _run_incremental(self, cq_script, cq_script_path):
+        """Like _run, but only executes what changed since the previous render."""
+
+        def execute():
+            rv = self._cache.execute(
+                cq_script,
+                cq_script_path,
+                key=self._script_options(),
+                context=self._script_context,
+            )
+            if self._cache.reused:
+                self._logger.info(
+                    f"Reused the results of {self._cache.reused} statement(s)"
+                )
+            return rv
+
+        return self._collect(execute)
+
+    def _collect(self, execute):
+
+        try:
+            with Watchdog(self.preferences["Render time limit [s]"]):
+                with PROFILER.stage("exec"):
+                    cq_objects, module, injected_names = execute()
+
+                # remove the special methods
+                self._cleanup_locals(module, injected_names)
+
+                # collect all CQ objects if no explicit show_object was called
+                if len(cq_objects) == 0:
+                    with PROFILER.stage("find_cq_objects"):
+                        cq_objects = find_cq_objects(module.__dict__)
+
+            return cq_objects, module.__dict__, None
+        except (Exception, RenderCancelled):
+            return None, None, sys.exc_info()
+
+    def _run_in_worker(self, cq_script, cq_script_path):
+        """Execute the script in the worker process, blocking until it is done."""
+
+        try:
+            with PROFILER.stage("exec"):
+                rv = self._worker.render(
+                    cq_script,
+                    cq_script_path,
+                    timeout=self.preferences["Render time limit [s]"],
+                    reload_cq=self.preferences["Reload CQ"],
+                    add_to_path=self.preferences["Add script dir to path"],
+                    change_dir=self.preferences["Change working dir to script dir"],
+                    reload_modules=self.preferences["Reload imported modules"],
+                    incremental=self.preferences["Incremental render"],
+                )
+            cq_objects, local_vars, exc_info, output, messages = rv
+        except (Exception, RenderCancelled):
+            return None, None, sys.exc_info()
+
+        # replay what the script printed and logged in the worker
+        if output:
+            sys.stdout.write(output)
+        for msg in messages:
+            info(msg)
+
+        return cq_objects, local_vars, exc_info
+
+    def _emit_results(self, cq_script, cq_objects, local_vars, exc_info):
+
+        try:
+            self._show_results(cq_script, cq_objects, local_vars, exc_info)
+        finally:
+            # showing the objects is part of the profiled render
+            self._end_profile()
+
+    def _end_profile(self):
+
+        profile = PROFILER.end()
+        if profile is None:
+            return
+
+        self._logger.info(profile.report())
+        self._export_profiles_action.setEnabled(True)
+        self.sigProfiled.emit(profile)
+
+    def _show_results(self, cq_script, cq_objects, local_vars, exc_info):
+
+        # a cancelled render leaves everything as it was before the run
+        if exc_info and issubclass(exc_info[0], RenderCancelled):
+            if issubclass(exc_info[0], RenderTimeout):
+                self._logger.warning(
+                    "Render stopped after exceeding the time limit of "
+                    f"{self.preferences['Render time limit [s]']} s"
+                )
+            else:
+                self._logger.warning("Render stopped")
+            return
+
+        if exc_info is None:
+            try:
+                self.sigRendered.emit(cq_objects)
+                self.sigTraceback.emit(None, cq_script)
+                self.sigLocals.emit(local_vars)
+                return
+            except Exception:
+                exc_info = sys.exc_info()
+
+        # errors from the worker process carry a summary instead of a traceback
+        if isinstance(exc_info[-1], TracebackType):
             sys.last_traceback = exc_info[-1]
-            self.sigTraceback.emit(exc_info, cq_script)
+        self.sigTraceback.emit(exc_info, cq_script)
+
+    def _render_finished(self, thread, cq_script):
+
+        self._render_thread = None
+        thread.deleteLater()
+        PROFILER.attach(thread.profile)
+
+        if self._render_context is not None:
+            self._render_context.close()
+            self._render_context = None
+
+        self._actions["Run"][1].setEnabled(True)
+        self._stop_action.setEnabled(False)
+        self.sigRendering.emit(False)
+
+        self._emit_results(cq_script, *thread.result)
+
+        if self._worker is not None:
+            # keep a (possibly restarted) worker warm and apply pending changes
+            self.updatePreferences()
+
+        if self._render_pending:
+            self._render_pending = False
+            self.render()
+
+    @pyqtSlot()
+    def stop_render(self, wait=False):
+        """Cancel the running render, if any."""
+
+        thread = self._render_thread
+        if thread is None:
+            return
+
+        self._render_pending = False
+        thread.cancel()
+
+        if wait:
+            thread.wait()
+
+    def shutdown(self):
+        """Stop rendering and the worker process before the editor exits."""
+
+        self.stop_render(wait=True)
+
+        if self._worker is not None:
+            self._worker.shutdown()
+            self._worker = None
 
     @property
     def breakpoints(self):
@@ -431,16 +876,3 @@ class Debugger(QObject, ComponentMixin):
 
         if self._stop_debugging:
             raise BdbQuit  # stop debugging if requested
-
-
-@contextmanager
-def module_manager():
-    """unloads any modules loaded while the context manager is active"""
-    loaded_modules = set(sys.modules.keys())
-
-    try:
-        yield
-    finally:
-        new_modules = set(sys.modules.keys()) - loaded_modules
-        for module_name in new_modules:
-            del sys.modules[module_name]
@@ -2,16 +2,16 @@ import os
 
 # import spyder.utils.encoding
 from modulefinder import ModuleFinder
+from queue import Queue, Empty
+from threading import Lock, Thread
 
 from .code_editor import CodeEditor
 
-from PyQt5.QtCore import pyqtSignal, QFileSystemWatcher, QTimer, Qt, QEvent
+from PyQt5.QtCore import pyqtSignal, QFileSystemWatcher, QTimer, Qt, QEvent, QObject
 from PyQt5.QtWidgets import (
     QAction,
     QFileDialog,
-    QApplication,
     QListWidget,
-    QListWidgetItem,
     QShortcut,
 )
 from PyQt5.QtGui import (
@@ -33,6 +33,9 @@ from .pyhighlight import PythonHighlighter
 
 from ..icons import icon
 
+# jedi is not thread safe, the workers of several editors take turns
+JEDI_LOCK = Lock()
+
 
 class EditorDebugger:
     def __init__(self):
@@ -47,6 +50,112 @@ class EditorDebugger:
         return True
 
 
+def signature_text(signature):
+    """Human-readable signature, without the optional parameters."""
+
+    # Build a human-readable signature
+    i = 0
+    rv = f"{signature.name}("
+    for param in signature.params:
+        # Prevent trailing comma in parameter list
+        param_ending = ","
+        if i == len(signature.params) - 1:
+            param_ending = ""
+
+        # If the parameter is optional, do not overload the user with it
+        if "Optional" in param.description:
+            i += 1
+            continue
+
+        if "=" in param.description:
+            rv += (
+                f"{param.name}={param.description.split('=')[1].strip()}{param_ending}"
+            )
+        else:
+            rv += f"{param.name}{param_ending}"
+        i += 1
+    rv += ")"
+
+    return rv
+
+
+class CompletionWorker(QObject):
+    """
+    Runs jedi in a thread of its own, so that inferring e.g. cadquery never
+    blocks typing. Only the newest request is answered, the ones superseded
+    while jedi was busy are skipped. cadquery is completed once at start to
+    warm the caches of jedi, the project of the script directory is kept.
+    """
+
+    sigCompleted = pyqtSignal(int, list)
+
+    WARM_UP = "import cadquery as cq\ncq.Workplane().box("
+
+    def __init__(self):
+
+        super(CompletionWorker, self).__init__()
+
+        self._requests = Queue()
+        self._project = None
+
+        self._thread = Thread(
+            target=self._run, name="cq-editor-completion", daemon=True
+        )
+        self._thread.start()
+
+    def request(self, request_id, code, line, column, path, signatures):
+        """Ask for the completions (or signatures) at line and column."""
+
+        self._requests.put((request_id, code, line, column, path, signatures))
+
+    def stop(self, *args):
+
+        self._requests.put(None)
+
+    def _get_project(self, path):
+
+        root = os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+        if self._project is None or str(self._project.path) != root:
+            self._project = jedi.Project(root)
+
+        return self._project
+
+    def complete(self, code, line=None, column=None, path=None, signatures=False):
+
+        try:
+            with JEDI_LOCK:
+                script = jedi.Script(
+                    code, path=path or None, project=self._get_project(path)
+                )
+                if signatures:
+                    return [
+                        signature_text(s) for s in script.get_signatures(line, column)
+                    ]
+                return [c.name for c in script.complete(line, column)]
+        except Exception:
+            return []
+
+    def _run(self):
+
+        self.complete(self.WARM_UP, signatures=True)
+
+        while True:
+            request = self._requests.get()
+
+            # skip the requests superseded in the meantime
+            try:
+                while request is not None:
+                    request = self._requests.get_nowait()
+            except Empty:
+                pass
+
+            if request is None:
+                break
+
+            request_id, *args = request
+            self.sigCompleted.emit(request_id, self.complete(*args))
+
+
 class Editor(CodeEditor, ComponentMixin):
 
     name = "Code Editor"
@@ -63,6 +172,13 @@ class Editor(CodeEditor, ComponentMixin):
             {"name": "Font size", "type": "int", "value": 12},
             {"name": "Autoreload", "type": "bool", "value": False},
             {"name": "Autoreload delay", "type": "int", "value": 50},
+            {
+                "name": "Autocomplete delay",
+                "type": "int",
+                "value": 50,
+                "tip": "Milliseconds to wait for further requests before "
+                "completing [ms]",
+            },
             {
                 "name": "Autoreload: watch imported modules",
                 "type": "bool",
@@ -157,6 +273,20 @@ class Editor(CodeEditor, ComponentMixin):
         )
         self._file_watch_timer.timeout.connect(self._file_changed)
 
+        # completions are computed in the background, requested at most once
+        # per delay
+        self._completion_timer = QTimer(self)
+        self._completion_timer.setSingleShot(True)
+        self._completion_timer.timeout.connect(self._request_completions)
+
+        self._completion_worker = CompletionWorker()
+        self._completion_worker.sigCompleted.connect(self._show_completions)
+        self.destroyed.connect(self._completion_worker.stop)
+
+        # id of the latest request and the document state it was made for
+        self._completion_request = 0
+        self._completion_state = None
+
         self.updatePreferences()
 
         # Create a floating list widget for completions
@@ -221,6 +351,7 @@ class Editor(CodeEditor, ComponentMixin):
         self.findChild(QAction, "autoreload").setChecked(self.preferences["Autoreload"])
 
         self._file_watch_timer.setInterval(self.preferences["Autoreload delay"])
+        self._completion_timer.setInterval(self.preferences["Autocomplete delay"])
 
         self.toggle_wrap_mode(self.preferences["Line wrap"])
 
@@ -361,77 +492,52 @@ class Editor(CodeEditor, ComponentMixin):
 
     def _trigger_autocomplete(self):
         """
-        Allows the user to ask for autocomplete suggestions.
+        Allows the user to ask for autocomplete suggestions. Repeated requests
+        are debounced, the suggestions are shown once jedi is done.
         """
 
+        self._completion_timer.start()
+
+    def _request_completions(self):
+
         # Clear the status bar
         self.statusChanged.emit("")
 
-        # Track whether or not there are any completions to show
-        completions_present = False
+        # Check to see if the character before the cursor is an open parenthesis
+        cursor = self.textCursor()
+        text = self.toPlainText()
+        signatures = text[: cursor.position()].endswith("(")
+
+        # If there is a trailing close parentheis after the cursor, remove it
+        if signatures and text[cursor.position() :].startswith(")"):
+            cursor.deleteChar()
+
+        self._completion_request += 1
+        self._completion_state = (self.document().revision(), cursor.position())
+
+        self._completion_worker.request(
+            self._completion_request,
+            self.toPlainText(),
+            cursor.blockNumber() + 1,
+            cursor.positionInBlock(),
+            self.filename,
+            signatures,
+        )
+
+    def _show_completions(self, request_id, completions):
 
-        script = jedi.Script(self.toPlainText(), path=self.filename)
+        # drop the results of requests made for an older text or cursor
+        state = (self.document().revision(), self.textCursor().position())
+        if request_id != self._completion_request or state != self._completion_state:
+            return
 
         # Clear the completion list
         self.completion_list.clear()
 
-        # Check to see if the character before the cursor is an open parenthesis
-        cursor_pos = self.textCursor().position()
-        text_before_cursor = self.toPlainText()[:cursor_pos]
-        text_after_cursor = self.toPlainText()[cursor_pos:]
-        if text_before_cursor.endswith("("):
-            # If there is a trailing close parentheis after the cursor, remove it
-            if text_after_cursor.startswith(")"):
-                self.textCursor().deleteChar()
-
-                # Update the script with the modified text
-                script = jedi.Script(self.toPlainText(), path=self.filename)
-
-            # Check if there are any function signatures
-            signatures = script.get_signatures()
-            if signatures:
-                # Let the rest of the code know that there was a completion
-                completions_present = True
-
-                # Load the signatures into the completion list
-                for signature in signatures:
-                    # Build a human-readable signature
-                    i = 0
-                    cur_signature = f"{signature.name}("
-                    for param in signature.params:
-                        # Prevent trailing comma in parameter list
-                        param_ending = ","
-                        if i == len(signature.params) - 1:
-                            param_ending = ""
-
-                        # If the parameter is optional, do not overload the user with it
-                        if "Optional" in param.description:
-                            i += 1
-                            continue
-
-                        if "=" in param.description:
-                            cur_signature += f"{param.name}={param.description.split('=')[1].strip()}{param_ending}"
-                        else:
-                            cur_signature += f"{param.name}{param_ending}"
-                        i += 1
-                    cur_signature += ")"
-
-                    # Add the current signature to the list
-                    item = QListWidgetItem(cur_signature)
-                    self.completion_list.addItem(item)
-        else:
-            completions = script.complete()
-            if completions:
-                # Let the rest of the code know that there was a completion
-                completions_present = True
-
-                # Add completions to the list
-                for completion in completions:
-                    item = QListWidgetItem(completion.name)
-                    self.completion_list.addItem(item)
-
         # Only show the completions list if there were any
-        if completions_present:
+        if completions:
+            self.completion_list.addItems(completions)
+
             # Position the list near the cursor
             cursor_rect = self.cursorRect()
             global_pos = self.mapToGlobal(cursor_rect.bottomLeft())
@@ -489,11 +595,6 @@ class Editor(CodeEditor, ComponentMixin):
         if not Path(self._filename).exists():
             return
 
-        # Save the current cursor position and selection
-        cursor = self.textCursor()
-        cursor_position = cursor.position()
-        anchor_position = cursor.anchor()
-
         # Save the current scroll position
         vertical_scroll_pos = self.verticalScrollBar().value()
         horizontal_scroll_pos = self.horizontalScrollBar().value()
@@ -505,29 +606,16 @@ class Editor(CodeEditor, ComponentMixin):
         with open(self._filename, "r", encoding="utf-8") as f:
             file_contents = f.read()
 
-            # Insert new text while preserving history
-            cursor = self.textCursor()
-            cursor.select(QTextCursor.Document)
-            cursor.insertText(file_contents)
-
-            # The editor will not always update after a text insertion, so we force it
-            QApplication.processEvents()
+        # Replace only the changed lines, in one undo step. A file saved by
+        # the editor itself is unchanged and leaves the history as it is.
+        if self.update_text(file_contents):
+            # textChanged is blocked, the profile is of the old lines
+            self.clear_line_profile()
+        self.was_modified_by_self = False
 
         # Stop blocking signals
         self.blockSignals(False)
 
-        self.document().setModified(True)
-
-        # Undo has to be backed up one step to compensate for the text insertion
-        if self.was_modified_by_self:
-            self.document().undo()
-            self.was_modified_by_self = False
-
-        # Restore the cursor position and selection
-        cursor.setPosition(anchor_position)
-        cursor.setPosition(cursor_position, QTextCursor.KeepAnchor)
-        self.setTextCursor(cursor)
-
         # Restore the scroll position
         self.verticalScrollBar().setValue(vertical_scroll_pos)
         self.horizontalScrollBar().setValue(horizontal_scroll_pos)
@@ -1,3 +1,5 @@
+import re
+
 from cadquery import Location, Assembly
 from PyQt5.QtWidgets import (
     QTreeWidget,
@@ -11,7 +13,8 @@ from PyQt5.QtCore import Qt, pyqtSlot, pyqtSignal
 
 from pyqtgraph.parametertree import Parameter, ParameterTree
 
-from OCP.AIS import AIS_Line
+from OCP.AIS import AIS_Line, AIS_ConnectedInteractive
+from OCP.TopLoc import TopLoc_Location
 from OCP.Geom import Geom_CartesianPoint
 from OCP.gp import gp_Pnt
 from OCP.Bnd import Bnd_Box
@@ -27,9 +30,16 @@ from ..cq_utils import (
     set_color,
     set_transparency,
     to_compound,
+    instance_location,
+    shape_key,
+    shape_id,
+    get_ais_shape,
 )
+from ..profiler import PROFILER
+from ..export_worker import ExportJob, ExportBatch
+from ..batch import FORMATS
 from .viewer import DEFAULT_FACE_COLOR
-from ..utils import splitter, layout, get_save_filename
+from ..utils import splitter, layout, get_save_filename, get_save_directory
 
 # Default size of the axis helper lines half-length
 DEFAULT_AXIS_HALF_LEN = 100.0
@@ -71,19 +81,52 @@ class ObjectTreeItem(QTreeWidgetItem):
         self.shape = shape
         self.shape_display = shape_display
         self.sig = sig
+        self.key = None  # what the AIS object was made from, see shape_key
+        # (node, location, color, options) of a sub-assembly shown merged
+        self.lazy = None
+
+        # made on first use, large assemblies have thousands of items
+        self._properties = None
+
+    @property
+    def properties(self):
+
+        if self._properties is None:
+            self._properties = Parameter.create(name="Properties", children=self.props)
+
+            self._properties["Name"] = self.text(0)
+            self._properties["Visible"] = self.checkState(0) != Qt.Unchecked
+            # Alpha and Color from this panel fight with the options in show_object and so they are
+            # disabled for now until a better solution is found
+            # self._properties["Alpha"] = ais.Transparency()
+            # self._properties["Color"] = (
+            #     get_occ_color(ais)
+            #     if ais and ais.HasColor()
+            #     else get_occ_color(DEFAULT_FACE_COLOR)
+            # )
+            self._properties.sigTreeStateChanged.connect(self.propertiesChanged)
 
-        self.properties = Parameter.create(name="Properties", children=self.props)
+        return self._properties
 
-        self.properties["Name"] = name
-        # Alpha and Color from this panel fight with the options in show_object and so they are
-        # disabled for now until a better solution is found
-        # self.properties["Alpha"] = ais.Transparency()
-        # self.properties["Color"] = (
-        #     get_occ_color(ais)
-        #     if ais and ais.HasColor()
-        #     else get_occ_color(DEFAULT_FACE_COLOR)
-        # )
-        self.properties.sigTreeStateChanged.connect(self.propertiesChanged)
+    def propertyValues(self):
+        """Values of the properties, without making the Parameter tree."""
+
+        if self._properties is not None:
+            return {p.name(): p.value() for p in self._properties}
+
+        rv = {p["name"]: p["value"] for p in self.props}
+        rv["Name"] = self.text(0)
+        rv["Visible"] = self.checkState(0) != Qt.Unchecked
+
+        return rv
+
+    def setPropertyValues(self, values):
+
+        if self._properties is None and values == self.propertyValues():
+            return
+
+        for name, value in values.items():
+            self.properties[name] = value
 
     def propertiesChanged(self, properties, changed):
 
@@ -132,8 +175,44 @@ class ObjectTree(QWidget, ComponentMixin):
         children=[
             {"name": "Preserve properties on reload", "type": "bool", "value": False},
             {"name": "Clear all before each run", "type": "bool", "value": True},
+            {
+                "name": "Update changed objects only",
+                "type": "bool",
+                "value": True,
+                "tip": "When clearing before a run, keep showing the objects "
+                "whose shapes and options did not change instead of rebuilding them",
+            },
             {"name": "Merge Assemblies", "type": "bool", "value": False},
+            {
+                "name": "Explode assemblies on demand",
+                "type": "bool",
+                "value": False,
+                "tip": "Show every sub-assembly merged until it is expanded or "
+                "something inside it is selected or hidden",
+            },
+            {"name": "Instance repeated parts", "type": "bool", "value": True},
             {"name": "STL precision", "type": "float", "value": 0.1},
+            {
+                "name": "Export in background",
+                "type": "bool",
+                "value": True,
+                "tip": "Write exported files in a separate process, the editor "
+                "stays usable and the export can be cancelled",
+            },
+            {
+                "name": "Export all formats",
+                "type": "str",
+                "value": "step, stl, brep",
+                "tip": "Formats written by Export all",
+            },
+            {
+                "name": "Export processes",
+                "type": "int",
+                "value": 0,
+                "limits": (0, 256),
+                "tip": "Processes writing the files of Export all, 0 for one "
+                "per CPU",
+            },
         ],
     )
 
@@ -144,6 +223,9 @@ class ObjectTree(QWidget, ComponentMixin):
     sigItemChanged = pyqtSignal(QTreeWidgetItem, int)
     sigObjectPropertiesChanged = pyqtSignal()
     sigHelpersResized = pyqtSignal(list)
+    sigExporting = pyqtSignal(bool)
+    sigExported = pyqtSignal(str)
+    sigExportProgress = pyqtSignal(int, int)
 
     def __init__(self, parent):
 
@@ -157,6 +239,8 @@ class ObjectTree(QWidget, ComponentMixin):
         tree.setHeaderHidden(True)
         tree.setItemsExpandable(True)
         tree.setRootIsDecorated(False)
+        # lets the view skip measuring every row of large trees
+        tree.setUniformRowHeights(True)
         tree.setContextMenuPolicy(Qt.ActionsContextMenu)
 
         # forward itemChanged singal
@@ -167,6 +251,12 @@ class ObjectTree(QWidget, ComponentMixin):
         self.CQ = CQRootItem()
         self.Helpers = HelpersRootItem()
 
+        # shape_id of the shape shown by an item -> items, for viewer selection
+        self._selection_index = {}
+
+        # background exports that are still running
+        self._export_jobs = []
+
         root = tree.invisibleRootItem()
         root.addChild(self.CQ)
         root.addChild(self.Helpers)
@@ -180,10 +270,24 @@ class ObjectTree(QWidget, ComponentMixin):
             triggered=lambda: self.export("stl", self.preferences["STL precision"]),
         )
 
+        self._export_STL_shown_action = QAction(
+            "Export as STL as shown",
+            self,
+            enabled=False,
+            toolTip="Export the visible objects with the meshes of the viewer",
+            triggered=lambda: self.export(
+                "stl", self.preferences["STL precision"], remesh=False
+            ),
+        )
+
         self._export_STEP_action = QAction(
             "Export as STEP", self, enabled=False, triggered=lambda: self.export("step")
         )
 
+        self._export_all_action = QAction(
+            "Export all...", self, triggered=self.export_all
+        )
+
         self._clear_current_action = QAction(
             icon("delete"),
             "Clear current",
@@ -202,6 +306,7 @@ class ObjectTree(QWidget, ComponentMixin):
         self.prepareMenu()
 
         tree.itemSelectionChanged.connect(self.handleSelection)
+        tree.itemExpanded.connect(self.handleExpanded)
         tree.customContextMenuRequested.connect(self.showMenu)
 
         self.prepareLayout()
@@ -244,7 +349,12 @@ class ObjectTree(QWidget, ComponentMixin):
         self._context_menu = QMenu(self)
         self._context_menu.addActions(self._toolbar_actions)
         self._context_menu.addActions(
-            (self._export_STL_action, self._export_STEP_action)
+            (
+                self._export_STL_action,
+                self._export_STL_shown_action,
+                self._export_STEP_action,
+                self._export_all_action,
+            )
         )
 
     def prepareLayout(self):
@@ -264,7 +374,14 @@ class ObjectTree(QWidget, ComponentMixin):
 
     def menuActions(self):
 
-        return {"Tools": [self._export_STL_action, self._export_STEP_action]}
+        return {
+            "Tools": [
+                self._export_STL_action,
+                self._export_STL_shown_action,
+                self._export_STEP_action,
+                self._export_all_action,
+            ]
+        }
 
     def toolbarActions(self):
 
@@ -296,7 +413,7 @@ class ObjectTree(QWidget, ComponentMixin):
         parts = []
         node = item
         while node is not None and node is not self.CQ:
-            parts.append(node.properties["Name"])
+            parts.append(node.text(0))
             node = node.parent()
         return "/".join(reversed(parts))
 
@@ -308,7 +425,7 @@ class ObjectTree(QWidget, ComponentMixin):
         current_params = {}
         for i in range(self.CQ.childCount()):
             for it in self._iter_subtree(self.CQ.child(i)):
-                current_params[self._item_path(it)] = it.properties
+                current_params[self._item_path(it)] = it.propertyValues()
 
         return current_params
 
@@ -320,40 +437,31 @@ class ObjectTree(QWidget, ComponentMixin):
         for it in self._iter_subtree(obj):
             key = self._item_path(it)
             if key in properties:
-                for p in properties[key]:
-                    it.properties[p.name()] = p.value()
+                it.setPropertyValues(properties[key])
 
-    def _build_assembly_item(
-        self, node, label, options, parent_loc, inherited_color, ais_list
-    ):
+    def _build_assembly_item(self, node, label, parent_loc, inherited_color, parts):
         """
         Recursively build the tree item for one assembly node, mirroring
         the hierarchy. Accumulates world location and nearest-ancestor color.
+        Items with a shape are collected in parts, their AIS objects are made
+        by _make_parts_ais.
         """
         world = parent_loc * node.loc
         color = node.color if node.color is not None else inherited_color
 
-        ais = None
         shape = None
         if node.obj is not None:
             # A node can have both a shape and children
             shape = to_compound(node.obj).moved(world)
-            ais, _ = make_AIS(shape, options)
-            if color is not None:
-                r, g, b, a = color.toTuple()
-                set_color(ais, to_occ_color((r, g, b)))
-                set_transparency(ais, a)
-            ais_list.append(ais)
-
-        item = ObjectTreeItem(
-            label, shape=shape, ais=ais, sig=self.sigObjectPropertiesChanged
-        )
+
+        item = ObjectTreeItem(label, shape=shape, sig=self.sigObjectPropertiesChanged)
+
+        if shape is not None:
+            parts.append((item, color))
 
         for child in node.children:
             item.addChild(
-                self._build_assembly_item(
-                    child, child.name, options, world, color, ais_list
-                )
+                self._build_assembly_item(child, child.name, world, color, parts)
             )
 
         if node.children:
@@ -361,28 +469,214 @@ class ObjectTree(QWidget, ComponentMixin):
 
         return item
 
-    def _build_items(self, name, shape, options):
+    def _part_ais(self, shape, color, options):
+
+        ais, _ = make_AIS(shape, options)
+        if color is not None:
+            r, g, b, a = color.toTuple()
+            set_color(ais, to_occ_color((r, g, b)))
+            set_transparency(ais, a)
+
+        return ais
+
+    def _reusable_items(self, tops):
+        """Items of the previous run that can pass on their AIS object, by path."""
+        return {
+            self._item_path(it): it
+            for top in tops
+            for it in self._iter_subtree(top)
+            if it.ais is not None
+            and it.key is not None
+            and it.checkState(0) == Qt.Checked
+        }
+
+    def _reuse(self, item, previous):
+        """
+        Take over the AIS object of the previous item at the same path if it
+        was made from the same shapes and options. Returns True on success.
+        """
+        old = previous.get(self._item_path(item))
+        if old is None or item.key[0] is None or old.key != item.key:
+            return False
+
+        del previous[self._item_path(item)]
+        item.ais = old.ais
+        item.shape_display = old.shape_display
+
+        return True
+
+    def _make_parts_ais(self, parts, options, previous=None):
+        """
+        Make the AIS objects of exploded assembly parts. Parts that repeat
+        the same shapes in the same color are shown as instances of one
+        prototype, so they are triangulated and uploaded only once.
+        Unchanged parts keep the AIS objects of previous items.
+        """
+        groups = {}
+        for item, color in parts:
+            if previous is not None:
+                item.key = (
+                    shape_key(item.shape),
+                    color.toTuple() if color is not None else None,
+                    repr(options),
+                )
+                if self._reuse(item, previous):
+                    continue
+
+            key = (
+                color.toTuple() if color is not None else None,
+                tuple(hash(s.wrapped.Located(TopLoc_Location())) for s in item.shape),
+            )
+            groups.setdefault(key, []).append((item, color))
+
+        ais_list = []
+        for group in groups.values():
+            if len(group) == 1 or not self.preferences["Instance repeated parts"]:
+                for item, color in group:
+                    item.ais = self._part_ais(item.shape, color, options)
+                    ais_list.append(item.ais)
+                continue
+
+            prototypes = []
+            for item, color in group:
+                for proto_shape, proto_ais in prototypes:
+                    loc = instance_location(item.shape, proto_shape)
+                    if loc is not None:
+                        break
+                else:
+                    # the prototype is never displayed itself
+                    proto_shape = item.shape
+                    proto_ais = self._part_ais(proto_shape, color, options)
+                    prototypes.append((proto_shape, proto_ais))
+                    loc = Location()
+
+                item.ais = AIS_ConnectedInteractive()
+                item.ais.Connect(proto_ais, loc.wrapped.Transformation())
+                ais_list.append(item.ais)
+
+        return ais_list
+
+    def _merged_ais(self, item):
+        """One AIS object showing the whole sub-assembly of a lazy item."""
+        node, parent_loc, inherited_color, options = item.lazy
+
+        ais, doc = make_AIS(node, options)
+        ais.SetLocalTransformation(parent_loc.wrapped.Transformation())
+
+        # parts without a color of their own inherit it from the ancestors
+        if inherited_color is not None:
+            r, g, b, a = inherited_color.toTuple()
+            set_color(ais, to_occ_color((r, g, b)))
+            set_transparency(ais, a)
+
+        return ais, doc
+
+    def _explode(self, item):
+        """
+        Show the children of a lazy sub-assembly separately. Parts get AIS
+        objects of their own, sub-assemblies stay merged until they are
+        exploded themselves.
+        """
+        node, parent_loc, inherited_color, options = item.lazy
+        world = parent_loc * node.loc
+        color = node.color if node.color is not None else inherited_color
+
+        self._unindex_item(item)
+        merged = item.ais
+        item.ais = item.shape_display = item.key = item.lazy = None
+
+        children = [item.child(i) for i in range(item.childCount())]
+        parts = [(item, color)] if item.shape is not None else []
+
+        for child_node, child in zip(node.children, children):
+            if child_node.children:
+                child.lazy = (child_node, world, color, options)
+                child.ais, child.shape_display = self._merged_ais(child)
+            elif child.shape is not None:
+                parts.append(
+                    (child, child_node.color if child_node.color is not None else color)
+                )
+
+        self._make_parts_ais(parts, options)
+
+        shown = []
+        for it in [item, *children]:
+            if it.ais is not None:
+                self._index_item(it)
+                if it.checkState(0) != Qt.Unchecked:
+                    shown.append(it.ais)
+
+        self.sigObjectsRemoved.emit([merged])
+        self.sigObjectsAdded[list, bool].emit(shown, False)
+
+    def _explode_to(self, item):
+        """Explode the lazy sub-assemblies containing item, outermost first."""
+        ancestors = []
+        node = item.parent()
+        while node is not None and node is not self.CQ:
+            ancestors.append(node)
+            node = node.parent()
+
+        for it in reversed(ancestors):
+            if it.lazy is not None:
+                self._explode(it)
+
+    def _explode_partial(self, item):
+        """
+        Explode the lazy sub-assemblies containing item (or item itself) that
+        are shown in part only, outermost first. One checked or unchecked as
+        a whole stays merged, Qt passes the check state on to the children
+        before updating their ancestors.
+        """
+        nodes = []
+        node = item
+        while node is not None and node is not self.CQ:
+            nodes.append(node)
+            node = node.parent()
+
+        for it in reversed(nodes):
+            if getattr(it, "lazy", None) is None:
+                continue
+            if it.checkState(0) != Qt.PartiallyChecked:
+                break
+            self._explode(it)
+
+    def _build_items(self, name, shape, options, previous=None):
         """
         Build the ObjectTreeItem(s) for one shown object. Assemblies explode
-        into one item per part. Everything else is one item.
+        into one item per part. Everything else is one item. If previous
+        items are given (see _reusable_items), the unchanged ones pass on
+        their AIS objects, only the new AIS objects are returned.
         """
         # Explode assemblies into per-part items
         if isinstance(shape, Assembly) and not self.preferences["Merge Assemblies"]:
-            ais_list = []
-            item = self._build_assembly_item(
-                shape, name, options, Location(), None, ais_list
-            )
-            return [item], ais_list
-
-        ais, shape_display = make_AIS(shape, options)
-        item = ObjectTreeItem(
-            name,
-            shape=shape,
-            shape_display=shape_display,
-            ais=ais,
-            sig=self.sigObjectPropertiesChanged,
-        )
-        return [item], [ais]
+            parts = []
+            item = self._build_assembly_item(shape, name, Location(), None, parts)
+
+            if not self.preferences["Explode assemblies on demand"]:
+                return [item], self._make_parts_ais(parts, options, previous)
+
+            # shown merged until needed, see _explode
+            item.lazy = (shape, Location(), None, options)
+            if previous is not None:
+                item.key = (shape_key(shape), repr(options))
+                if self._reuse(item, previous):
+                    return [item], []
+
+            item.ais, item.shape_display = self._merged_ais(item)
+
+            return [item], [item.ais]
+
+        item = ObjectTreeItem(name, shape=shape, sig=self.sigObjectPropertiesChanged)
+
+        if previous is not None:
+            item.key = (shape_key(shape), repr(options))
+            if self._reuse(item, previous):
+                return [item], []
+
+        item.ais, item.shape_display = make_AIS(shape, options)
+
+        return [item], [item.ais]
 
     def _iter_subtree(self, item):
         """Yield item and every descendant."""
@@ -399,6 +693,53 @@ class ObjectTree(QWidget, ComponentMixin):
             p = p.parent()
         return False
 
+    def _selection_id(self, item):
+
+        ais = item.ais
+        if isinstance(ais, AIS_ConnectedInteractive):
+            # instances report the prototype shape moved into place
+            loc = TopLoc_Location(ais.LocalTransformation())
+            shape = ais.ConnectedTo().Shape().Moved(loc)
+        else:
+            shape = get_ais_shape(ais)
+            if shape is not None and ais.HasTransformation():
+                shape = shape.Moved(TopLoc_Location(ais.LocalTransformation()))
+
+        return shape_id(shape) if shape is not None and not shape.IsNull() else None
+
+    def _index_item(self, item):
+
+        key = self._selection_id(item) if item.ais is not None else None
+        if key is not None:
+            self._selection_index.setdefault(key, []).append(item)
+
+    def _unindex_item(self, item):
+
+        key = self._selection_id(item) if item.ais is not None else None
+        items = self._selection_index.get(key)
+        if items is None:
+            return
+
+        items[:] = [el for el in items if el is not item]
+        if not items:
+            del self._selection_index[key]
+
+    def _index(self, tops):
+        """Make the items shown under tops selectable from the viewer."""
+        for top in tops:
+            for it in self._iter_subtree(top):
+                self._index_item(it)
+
+    def _unindex(self, tops):
+        """Drop the items under tops, after they were taken from the tree."""
+        if self.CQ.childCount() == 0:
+            self._selection_index.clear()
+            return
+
+        for top in tops:
+            for it in self._iter_subtree(top):
+                self._unindex_item(it)
+
     def _subtree_ais(self, tops):
         return [
             it.ais
@@ -420,8 +761,15 @@ class ObjectTree(QWidget, ComponentMixin):
         if preserve_props:
             current_props = self._current_properties()
 
+        previous = None
         if clean or self.preferences["Clear all before each run"]:
-            self.removeObjects()
+            with PROFILER.stage("clear"):
+                if self.preferences["Update changed objects only"]:
+                    taken = self.CQ.takeChildren()
+                    self._unindex(taken)
+                    previous = self._reusable_items(taken)
+                else:
+                    self.removeObjects()
 
         ais_list = []
 
@@ -429,20 +777,41 @@ class ObjectTree(QWidget, ComponentMixin):
         objects_f = {k: v for k, v in objects.items() if not is_obj_empty(v.shape)}
 
         for name, obj in objects_f.items():
-            top_items, obj_ais = self._build_items(name, obj.shape, obj.options)
+            with PROFILER.stage("make_AIS", name):
+                top_items, obj_ais = self._build_items(
+                    name, obj.shape, obj.options, previous
+                )
             for item in top_items:
                 if preserve_props and name in current_props:
                     self._restore_properties(item, current_props)
                 self.CQ.addChild(item)
-                self.tree.expandItem(item)
+                if item.lazy is None:
+                    self.tree.expandItem(item)
+
+            self._index(top_items)
 
             ais_list.extend(obj_ais)
 
+        if previous is not None:
+            # erase only what was not passed on to the new items
+            tops = [self.CQ.child(i) for i in range(self.CQ.childCount())]
+            kept = {id(ais) for ais in self._subtree_ais(tops)}
+            self.sigObjectsRemoved.emit(
+                [ais for ais in self._subtree_ais(taken) if id(ais) not in kept]
+            )
+
         if request_fit_view:
             self.sigObjectsAdded[list, bool].emit(ais_list, True)
         else:
             self.sigObjectsAdded[list].emit(ais_list)
 
+        # restored hidden parts need to be shown separately
+        if preserve_props:
+            for i in range(self.CQ.childCount()):
+                for it in self._iter_subtree(self.CQ.child(i)):
+                    if it.checkState(0) == Qt.Unchecked:
+                        self._explode_partial(it)
+
         self._rescale_helpers()
 
     @pyqtSlot(object, str, object)
@@ -456,6 +825,7 @@ class ObjectTree(QWidget, ComponentMixin):
         top_items, ais_list = self._build_items(name, obj, options)
         for item in top_items:
             self.CQ.addChild(item)
+        self._index(top_items)
         self.sigObjectsAdded.emit(ais_list)
 
     @pyqtSlot(list)
@@ -467,6 +837,7 @@ class ObjectTree(QWidget, ComponentMixin):
             if objects
             else self.CQ.takeChildren()
         )
+        self._unindex(taken)
         removed_items_ais = [
             it.ais
             for top in taken
@@ -481,12 +852,14 @@ class ObjectTree(QWidget, ComponentMixin):
 
         if action:
             self._stash = self.CQ.takeChildren()
+            self._unindex(self._stash)
             # removed_items_ais = [ch.ais for ch in self._stash]
             removed_items_ais = self._subtree_ais(self._stash)
             self.sigObjectsRemoved.emit(removed_items_ais)
         else:
             self.removeObjects()
             self.CQ.addChildren(self._stash)
+            self._index(self._stash)
             ais_list = self._subtree_ais(self._stash)
             self.sigObjectsAdded.emit(ais_list)
 
@@ -496,9 +869,14 @@ class ObjectTree(QWidget, ComponentMixin):
         removed_items_ais = self._subtree_ais(tops)
         for it in tops:
             self.CQ.removeChild(it)
+        self._unindex(tops)
         self.sigObjectsRemoved.emit(removed_items_ais)
 
-    def export(self, export_type, precision=None):
+    def export(self, export_type, precision=None, remesh=True):
+        """
+        Export the selected objects. With remesh=False only the visible
+        ones are exported to STL, with the triangulation the viewer shows.
+        """
 
         items = self.tree.selectedItems()
 
@@ -513,13 +891,127 @@ class ObjectTree(QWidget, ComponentMixin):
         shapes = []
         for r in roots:
             for it in self._iter_subtree(r):
-                if it.shape is not None and id(it) not in seen:
-                    seen.add(id(it))
-                    shapes.append(it.shape)
+                if it.shape is None or id(it) in seen:
+                    continue
+                if not remesh and it.checkState(0) == Qt.Unchecked:
+                    continue
+
+                seen.add(id(it))
+                shapes.append(it.shape)
 
         fname = get_save_filename(export_type)
-        if fname != "":
-            export(shapes, export_type, fname, precision)
+        if fname == "":
+            return
+
+        if not self.preferences["Export in background"]:
+            export(shapes, export_type, fname, precision, remesh)
+            self.sigExported.emit(f"Exported {fname}")
+            return
+
+        self._start_export(
+            ExportJob(self, to_compound(shapes), export_type, fname, precision, remesh)
+        )
+
+    def _export_objects(self):
+        """
+        Tree path and shape of every top-level object, with all its parts
+        merged, and of every part of the assemblies among them.
+        """
+        rv = []
+
+        for i in range(self.CQ.childCount()):
+            top = self.CQ.child(i)
+            path = self._item_path(top)
+
+            parts = [
+                (self._item_path(it), it.shape)
+                for it in self._iter_subtree(top)
+                if it.shape is not None
+            ]
+            if not parts:
+                continue
+
+            rv.append((path, to_compound([shape for _, shape in parts])))
+            rv.extend(el for el in parts if el[0] != path)
+
+        return rv
+
+    @pyqtSlot()
+    def export_all(self, output=None):
+        """
+        Export every object and assembly part in all formats of the "Export
+        all formats" preference to output, files are named after the tree
+        paths. A manifest.json lists the files.
+        """
+        formats = [
+            el
+            for el in re.split(r"[\s,]+", self.preferences["Export all formats"])
+            if el
+        ]
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            self._logger.error(f"Unknown export formats: {', '.join(sorted(unknown))}")
+            return
+
+        objects = self._export_objects()
+        if not objects or not formats:
+            return
+
+        if output is None:
+            output = get_save_directory()
+        if output == "":
+            return
+
+        job = ExportBatch(
+            self,
+            objects,
+            formats,
+            output,
+            self.preferences["STL precision"],
+            self.preferences["Export processes"],
+        )
+        job.sigProgress.connect(self.sigExportProgress)
+
+        self._start_export(job)
+
+    def _start_export(self, job):
+
+        job.finished.connect(lambda: self._export_finished(job))
+
+        self._export_jobs.append(job)
+        if len(self._export_jobs) == 1:
+            self.sigExporting.emit(True)
+
+        job.start()
+
+    def _export_finished(self, job):
+
+        self._export_jobs.remove(job)
+        job.deleteLater()
+
+        if job.cancelled:
+            msg = f"Export of {job.description} cancelled"
+            self._logger.warning(msg)
+        elif job.error:
+            msg = f"Export of {job.description} failed"
+            self._logger.error(f"{msg}\n{job.error}")
+        else:
+            msg = f"Exported {job.description}"
+            self._logger.info(msg)
+
+        if not self._export_jobs:
+            self.sigExporting.emit(False)
+
+        self.sigExported.emit(msg)
+
+    @pyqtSlot()
+    def cancel_export(self, wait=False):
+        """Cancel all running background exports."""
+
+        for job in list(self._export_jobs):
+            job.cancel()
+            if wait:
+                job.wait()
 
     @pyqtSlot()
     def handleSelection(self):
@@ -527,9 +1019,14 @@ class ObjectTree(QWidget, ComponentMixin):
         items = self.tree.selectedItems()
         if len(items) == 0:
             self._export_STL_action.setEnabled(False)
+            self._export_STL_shown_action.setEnabled(False)
             self._export_STEP_action.setEnabled(False)
             return
 
+        for sel in items:
+            if self._under_cq(sel):
+                self._explode_to(sel)
+
         # emit list of all selected ais objects (might be empty)
         # ais_objects = [item.ais for item in items if item.parent() is self.CQ]
         ais_objects = [
@@ -545,6 +1042,7 @@ class ObjectTree(QWidget, ComponentMixin):
         item = items[-1]
         if self._under_cq(item):
             self._export_STL_action.setEnabled(True)
+            self._export_STL_shown_action.setEnabled(True)
             self._export_STEP_action.setEnabled(True)
             self._clear_current_action.setEnabled(True)
             if item.shape is not None:
@@ -553,9 +1051,11 @@ class ObjectTree(QWidget, ComponentMixin):
             self.properties_editor.setEnabled(True)
         elif item is self.CQ and item.childCount() > 0:
             self._export_STL_action.setEnabled(True)
+            self._export_STL_shown_action.setEnabled(True)
             self._export_STEP_action.setEnabled(True)
         else:
             self._export_STL_action.setEnabled(False)
+            self._export_STL_shown_action.setEnabled(False)
             self._export_STEP_action.setEnabled(False)
             self._clear_current_action.setEnabled(False)
             self.properties_editor.setEnabled(False)
@@ -566,17 +1066,26 @@ class ObjectTree(QWidget, ComponentMixin):
 
         self.tree.clearSelection()
 
-        for item in self._iter_subtree(self.CQ):
-            ais = getattr(item, "ais", None)
-            if ais is None:
-                continue
-            if any(ais.Shape().IsEqual(shape) for shape in shapes):
+        for shape in shapes:
+            for item in self._selection_index.get(shape_id(shape), ()):
                 item.setSelected(True)
 
+    @pyqtSlot(QTreeWidgetItem)
+    def handleExpanded(self, item):
+
+        if getattr(item, "lazy", None) is not None:
+            self._explode(item)
+
     @pyqtSlot(QTreeWidgetItem, int)
     def handleChecked(self, item, col):
 
+        # a merged sub-assembly shown in part only needs its parts shown
+        # separately, one hidden or shown as a whole is just erased or displayed
         if type(item) is ObjectTreeItem:
+            self._explode_partial(item)
+
+        # items without properties yet take the visibility from the check box
+        if type(item) is ObjectTreeItem and item._properties is not None:
             if item.checkState(0):
                 item.properties["Visible"] = True
             else:
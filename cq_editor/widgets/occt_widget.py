@@ -2,7 +2,7 @@ from sys import platform
 
 
 from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt, QPoint
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt, QPoint, QTimer
 
 import OCP
 
@@ -10,10 +10,19 @@ from OCP.Aspect import Aspect_DisplayConnection, Aspect_TypeOfTriedronPosition
 from OCP.OpenGl import OpenGl_GraphicDriver
 from OCP.V3d import V3d_Viewer
 from OCP.gp import gp_Trsf, gp_Ax1, gp_Dir
-from OCP.AIS import AIS_InteractiveContext, AIS_DisplayMode
+from OCP.AIS import (
+    AIS_InteractiveContext,
+    AIS_DisplayMode,
+    AIS_ConnectedInteractive,
+    AIS_Shape,
+)
+from OCP.TopLoc import TopLoc_Location
 from OCP.Quantity import Quantity_Color
+from OCP.Graphic3d import Graphic3d_ZLayerId_Default
 
 ZOOM_STEP = 0.9
+MSAA_SAMPLES = 8
+INTERACTION_TIMEOUT = 200  # ms after the last wheel event
 
 
 class OCCTWidget(QWidget):
@@ -40,6 +49,17 @@ class OCCTWidget(QWidget):
         # Orbit method settings
         self._orbit_method = "Turntable"
 
+        # Level of detail settings
+        self._min_size = 0
+        self._drag_min_size = 0
+        self._drag_antialiasing = True
+        self._interacting = False
+
+        self._interaction_timer = QTimer(self)
+        self._interaction_timer.setSingleShot(True)
+        self._interaction_timer.setInterval(INTERACTION_TIMEOUT)
+        self._interaction_timer.timeout.connect(self._end_interaction)
+
         # OCCT secific things
         self.display_connection = Aspect_DisplayConnection()
         self.graphics_driver = OpenGl_GraphicDriver(self.display_connection)
@@ -56,7 +76,7 @@ class OCCTWidget(QWidget):
         view = self.view
 
         params = view.ChangeRenderingParams()
-        params.NbMsaaSamples = 8
+        params.NbMsaaSamples = MSAA_SAMPLES
         params.IsAntialiasingEnabled = True
 
         view.TriedronDisplay(
@@ -87,11 +107,58 @@ class OCCTWidget(QWidget):
         else:
             raise ValueError(f"Unknown orbit method: {method}")
 
+    def set_level_of_detail(self, min_size=0, drag_min_size=0, drag_antialiasing=True):
+        """
+        Objects smaller than min_size pixels on screen are not drawn, while
+        the view is being dragged drag_min_size applies instead and
+        antialiasing can be turned off. The size is evaluated every frame.
+        """
+
+        self._min_size = min_size
+        self._drag_min_size = drag_min_size
+        self._drag_antialiasing = drag_antialiasing
+
+        self._apply_level_of_detail()
+
+    def _apply_level_of_detail(self):
+
+        fast = self._interacting
+
+        viewer = self.viewer
+        settings = viewer.ZLayerSettings(Graphic3d_ZLayerId_Default)
+        settings.SetCullingSize(self._drag_min_size if fast else self._min_size)
+        viewer.SetZLayerSettings(Graphic3d_ZLayerId_Default, settings)
+
+        antialiasing = self._drag_antialiasing or not fast
+        params = self.view.ChangeRenderingParams()
+        params.NbMsaaSamples = MSAA_SAMPLES if antialiasing else 0
+        params.IsAntialiasingEnabled = antialiasing
+
+    def _begin_interaction(self):
+
+        if not self._interacting:
+            self._interacting = True
+            self._apply_level_of_detail()
+
+    @pyqtSlot()
+    def _end_interaction(self):
+
+        self._interaction_timer.stop()
+
+        if self._interacting:
+            self._interacting = False
+            self._apply_level_of_detail()
+            self.view.Redraw()
+
     def wheelEvent(self, event):
 
         delta = event.angleDelta().y()
         factor = ZOOM_STEP if delta < 0 else 1 / ZOOM_STEP
 
+        # zooming is an interaction until the wheel stops
+        self._begin_interaction()
+        self._interaction_timer.start()
+
         self.view.SetZoom(factor)
 
     def mousePressEvent(self, event):
@@ -116,6 +183,10 @@ class OCCTWidget(QWidget):
         pos = event.pos()
         x, y = pos.x(), pos.y()
 
+        # draw at a lower level of detail while dragging
+        if event.buttons() != Qt.NoButton:
+            self._begin_interaction()
+
         # Check for mouse drag rotation
         if event.buttons() == Qt.LeftButton and event.modifiers() not in (
             Qt.ShiftModifier,
@@ -159,6 +230,9 @@ class OCCTWidget(QWidget):
 
     def mouseReleaseEvent(self, event):
 
+        if event.buttons() == Qt.NoButton:
+            self._end_interaction()
+
         if event.button() == Qt.LeftButton:
             pos = event.pos()
             x, y = pos.x(), pos.y()
@@ -176,6 +250,14 @@ class OCCTWidget(QWidget):
         selected = []
         if self.context.HasSelectedShape():
             selected.append(self.context.SelectedShape())
+        elif self.context.MoreSelected():
+            # instances do not own their shape, report the shape they show
+            ais = self.context.SelectedInteractive()
+            if isinstance(ais, AIS_ConnectedInteractive) and isinstance(
+                ais.ConnectedTo(), AIS_Shape
+            ):
+                loc = TopLoc_Location(ais.LocalTransformation())
+                selected.append(ais.ConnectedTo().Shape().Moved(loc))
 
         self.sigObjectSelected.emit(selected)
 
@@ -1,4 +1,4 @@
-from traceback import extract_tb, format_exception_only
+from traceback import extract_tb, format_exception_only, StackSummary
 from itertools import dropwhile
 
 from PyQt5.QtWidgets import QWidget, QTreeWidget, QTreeWidgetItem, QAction, QLabel
@@ -65,9 +65,10 @@ class TracebackPane(QWidget, ComponentMixin):
             root = self.tree.root
             code = code.splitlines()
 
-            for el in dropwhile(
-                lambda el: "string>" not in el.filename, extract_tb(tb)
-            ):
+            # errors from the render worker come with an extracted stack
+            stack = tb if isinstance(tb, StackSummary) else extract_tb(tb)
+
+            for el in dropwhile(lambda el: "string>" not in el.filename, stack):
                 # workaround of the traceback module
                 if el.line == "":
                     line = code[el.lineno - 1].strip()
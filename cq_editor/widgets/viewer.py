@@ -1,6 +1,10 @@
 from PyQt5.QtWidgets import QWidget, QDialog, QTreeWidgetItem, QApplication, QAction
 
-from PyQt5.QtCore import pyqtSlot, pyqtSignal
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, QTimer
 from PyQt5.QtGui import QIcon
 
 from OCP.Graphic3d import (
@@ -10,6 +14,7 @@ from OCP.Graphic3d import (
     Graphic3d_MaterialAspect,
 )
 from OCP.AIS import (
+    AIS_ConnectedInteractive,
     AIS_Shaded,
     AIS_WireFrame,
     AIS_ColoredShape,
@@ -17,6 +22,7 @@ from OCP.AIS import (
     AIS_Line,
     AIS_ListOfInteractive,
 )
+from OCP.PrsMgr import PrsMgr_DisplayStatus_None
 from OCP.Aspect import Aspect_GDM_Lines, Aspect_GT_Rectangular
 from OCP.Quantity import (
     Quantity_NOC_BLACK as BLACK,
@@ -30,7 +36,14 @@ from OCP.Bnd import Bnd_Box
 from ..utils import layout, get_save_filename
 from ..mixins import ComponentMixin
 from ..icons import icon
-from ..cq_utils import to_occ_color, make_AIS, DEFAULT_FACE_COLOR
+from ..profiler import PROFILER
+from ..cq_utils import (
+    to_occ_color,
+    make_AIS,
+    get_ais_shape,
+    DEFAULT_FACE_COLOR,
+    TESSELLATION_CACHE,
+)
 
 from .occt_widget import OCCTWidget
 
@@ -40,6 +53,9 @@ import qtawesome as qta
 DEFAULT_EDGE_COLOR = Quantity_Color(BLACK)
 DEFAULT_EDGE_WIDTH = 2
 
+# time spent refining meshes before giving control back to the event loop
+REFINE_BUDGET = 0.05
+
 
 class OCCViewer(QWidget, ComponentMixin):
 
@@ -66,6 +82,48 @@ class OCCViewer(QWidget, ComponentMixin):
                 "dec": True,
                 "step": 1,
             },
+            {
+                "name": "Tessellation cache [MB]",
+                "type": "int",
+                "value": 256,
+                "limits": (0, None),
+                "tip": "Reuse triangulations of unchanged faces between renders, "
+                "0 disables the cache",
+            },
+            {
+                "name": "Parallel tessellation",
+                "type": "bool",
+                "value": True,
+                "tip": "Mesh new objects on all cores before displaying them",
+            },
+            {
+                "name": "Progressive display",
+                "type": "bool",
+                "value": False,
+                "tip": "Show coarse meshes right away and refine them afterwards",
+            },
+            {
+                "name": "Coarse deviation",
+                "type": "float",
+                "value": 1e-2,
+                "dec": True,
+                "step": 1,
+            },
+            {
+                "name": "Culling size [px]",
+                "type": "int",
+                "value": 0,
+                "limits": (0, None),
+                "tip": "Skip drawing objects smaller than this on screen, "
+                "0 draws everything",
+            },
+            {
+                "name": "Culling size while dragging [px]",
+                "type": "int",
+                "value": 4,
+                "limits": (0, None),
+            },
+            {"name": "Antialiasing while dragging", "type": "bool", "value": False},
             {
                 "name": "Projection Type",
                 "type": "list",
@@ -115,6 +173,17 @@ class OCCViewer(QWidget, ComponentMixin):
         self.canvas = OCCTWidget()
         self.canvas.sigObjectSelected.connect(self.handle_selection)
 
+        # objects shown with a coarse mesh, waiting to be refined
+        self._refine_queue = deque()
+        self._refine_timer = QTimer(self)
+        self._refine_timer.setSingleShot(True)
+        self._refine_timer.timeout.connect(self._refine)
+
+        # viewer updates requested inside a batch, done once it ends
+        self._batch_depth = 0
+        self._pending_update = False
+        self._pending_fit = False
+
         self.create_actions(self)
 
         self.layout_ = layout(
@@ -158,12 +227,24 @@ class OCCViewer(QWidget, ComponentMixin):
             orbit_method = "Trackball"
         self.canvas.set_orbit_method(orbit_method)
 
+        self.canvas.set_level_of_detail(
+            self.preferences["Culling size [px]"],
+            self.preferences["Culling size while dragging [px]"],
+            self.preferences["Antialiasing while dragging"],
+        )
+
         self.canvas.update()
 
         ctx = self.canvas.context
         ctx.SetDeviationCoefficient(self.preferences["Deviation"])
         ctx.SetDeviationAngle(self.preferences["Angular deviation"])
 
+        TESSELLATION_CACHE.configure(
+            self.preferences["Tessellation cache [MB]"] * 2**20,
+            self.preferences["Deviation"],
+            self.preferences["Angular deviation"],
+        )
+
         v = self._get_view()
         camera = v.Camera()
         projection_type = self.preferences["Projection Type"]
@@ -275,6 +356,7 @@ class OCCViewer(QWidget, ComponentMixin):
 
     def clear(self):
 
+        self._refine_queue.clear()
         self.displayed_shapes = []
         self.displayed_ais = []
         self.canvas.context.EraseAll(True)
@@ -292,28 +374,163 @@ class OCCViewer(QWidget, ComponentMixin):
 
         # self.canvas._display.Repaint()
 
+    def _tessellate(self, ais_list):
+
+        # instances are shown with the mesh of their prototype
+        shapes = {}
+        for ais in ais_list:
+            if isinstance(ais, AIS_ConnectedInteractive):
+                ais = ais.ConnectedTo()
+
+            shape = get_ais_shape(ais)
+            if shape is not None and not shape.IsNull():
+                shapes[hash(shape)] = shape
+
+        TESSELLATION_CACHE.tessellate(
+            list(shapes.values()), self.preferences["Parallel tessellation"]
+        )
+
+    def _display_coarse(self, ais_list):
+        """Let the objects be shown with a coarse mesh and queue them for refining."""
+
+        shapes = []
+        # instances are shown with the mesh of their prototype
+        instances = {}
+
+        for ais in ais_list:
+            proto = ais
+            if isinstance(ais, AIS_ConnectedInteractive):
+                proto = ais.ConnectedTo()
+
+            key = hash(proto)
+            if key in instances:
+                instances[key].append(ais)
+                continue
+
+            shape = get_ais_shape(proto)
+            if shape is None or shape.IsNull():
+                continue
+
+            proto.SetOwnDeviationCoefficient(self.preferences["Coarse deviation"])
+            # keep triangulations that are already fine enough
+            proto.Attributes().UpdatePreviousDeviationCoefficient()
+
+            instances[key] = [ais]
+            shapes.append(shape)
+            self._refine_queue.append((proto, instances[key], shape))
+
+        TESSELLATION_CACHE.reuse(shapes)
+        self._refine_timer.start()
+
+    @pyqtSlot()
+    def _refine(self):
+
+        ctx = self._get_context()
+        start = perf_counter()
+
+        while self._refine_queue and perf_counter() - start < REFINE_BUDGET:
+            proto, instances, shape = self._refine_queue.popleft()
+
+            # removed in the meantime
+            shown = [
+                ais
+                for ais in instances
+                if ctx.DisplayStatus(ais) != PrsMgr_DisplayStatus_None
+            ]
+            if not shown:
+                continue
+
+            proto.SetOwnDeviationCoefficient()  # back to the viewer deviation
+            TESSELLATION_CACHE.tessellate(
+                [shape], self.preferences["Parallel tessellation"]
+            )
+            # prototypes are not displayed, recompute them for their instances
+            if proto not in shown:
+                ctx.Redisplay(proto, False)
+            for ais in shown:
+                ctx.Redisplay(ais, False)
+
+        ctx.UpdateCurrentViewer()
+
+        if self._refine_queue:
+            self._refine_timer.start()
+
+    def begin_update(self):
+        """Start collecting viewer updates, see batch."""
+
+        self._batch_depth += 1
+
+    def end_update(self):
+        """Do the updates collected since the matching begin_update."""
+
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._flush()
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the redraws requested by displaying, erasing, redisplaying and
+        fitting inside the block into one update of the viewer at its end.
+        Batches can be nested, only the outermost one updates the viewer.
+        """
+
+        self.begin_update()
+        try:
+            yield self
+        finally:
+            self.end_update()
+
+    def _request_update(self, fit=False):
+
+        self._pending_update = True
+        self._pending_fit |= bool(fit)
+
+        if self._batch_depth == 0:
+            self._flush()
+
+    def _flush(self):
+
+        fit, update = self._pending_fit, self._pending_update
+        self._pending_fit = self._pending_update = False
+
+        # fitting redraws the view anyway
+        if fit:
+            with PROFILER.stage("fit"):
+                self.fit()
+        elif update:
+            with PROFILER.stage("redraw"):
+                self._get_context().UpdateCurrentViewer()
+
     @pyqtSlot(object)
     def display(self, ais):
 
+        self._tessellate([ais])
+
         context = self._get_context()
-        context.Display(ais, True)
+        context.Display(ais, False)
 
-        if self.preferences["Fit automatically"]:
-            self.fit()
+        self._request_update(self.preferences["Fit automatically"])
 
     @pyqtSlot(list)
     @pyqtSlot(list, bool)
     def display_many(self, ais_list, fit=None):
+
+        with PROFILER.stage("tessellation"):
+            if self.preferences["Progressive display"]:
+                self._display_coarse(ais_list)
+            else:
+                # mesh everything at once instead of one object at a time on display
+                self._tessellate(ais_list)
+
         context = self._get_context()
-        for ais in ais_list:
-            context.Display(ais, False)
+        with PROFILER.stage("display"):
+            for ais in ais_list:
+                context.Display(ais, False)
 
-        if self.preferences["Fit automatically"] and fit is None:
-            self.fit()
-        elif fit:
-            self.fit()
-        elif ais_list:
-            context.UpdateCurrentViewer()
+        fit = (self.preferences["Fit automatically"] and fit is None) or fit
+        if fit or ais_list:
+            self._request_update(fit)
 
     @pyqtSlot(QTreeWidgetItem, int)
     def update_item(self, item, col):
@@ -323,16 +540,20 @@ class OCCViewer(QWidget, ComponentMixin):
 
         ctx = self._get_context()
         if item.checkState(0):
-            ctx.Display(item.ais, True)
+            ctx.Display(item.ais, False)
         else:
-            ctx.Erase(item.ais, True)
+            ctx.Erase(item.ais, False)
+
+        self._request_update()
 
     @pyqtSlot(list)
     def redisplay(self, ais_list):
         ctx = self._get_context()
-        for ais in ais_list:
-            if ctx.IsDisplayed(ais):
-                ctx.Redisplay(ais, True)
+        displayed = [ais for ais in ais_list if ctx.IsDisplayed(ais)]
+        for ais in displayed:
+            ctx.Redisplay(ais, False)
+        if displayed:
+            self._request_update()
 
     @pyqtSlot(list)
     def remove_items(self, ais_items):
@@ -341,12 +562,15 @@ class OCCViewer(QWidget, ComponentMixin):
         for ais in ais_items:
             ctx.Erase(ais, False)
         if ais_items:
-            ctx.UpdateCurrentViewer()
+            self._request_update()
 
     @pyqtSlot()
     def redraw(self):
 
-        self._get_viewer().Redraw()
+        if self._batch_depth:
+            self._pending_update = True
+        else:
+            self._get_viewer().Redraw()
 
     def fit(self):
         ctx = self._get_context()
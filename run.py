@@ -14,6 +14,11 @@ if sys.stderr is None:
 
 faulthandler.enable()
 
+# render worker processes are started from the bundled executable
+from multiprocessing import freeze_support
+
+freeze_support()
+
 from cq_editor.cqe_run import main
 
 if __name__ == "__main__":
@@ -27,6 +27,9 @@ setup(
         "gui_scripts": [
             "cq-editor = cq_editor.__main__:main",
             "CQ-editor = cq_editor.__main__:main",
-        ]
+        ],
+        "console_scripts": [
+            "cq-editor-batch = cq_editor.batch:main",
+        ],
     },
 )
@@ -1,23 +1,35 @@
 from path import Path
-import os, sys, asyncio
+import os, sys, asyncio, json
 from time import perf_counter
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 from multiprocessing import Process
+from threading import Thread
 
 import pytest
 import pytestqt
 import cadquery as cq
 
-from PyQt5.QtCore import Qt, QSettings, QPoint, QEvent, QSize
+from PyQt5.QtCore import Qt, QSettings, QPoint, QPointF, QEvent, QSize, QTimer
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
-from PyQt5.QtGui import QMouseEvent
+from PyQt5.QtGui import QMouseEvent, QWheelEvent
+
+from OCP.Graphic3d import Graphic3d_ZLayerId_Default
+from OCP.AIS import AIS_ConnectedInteractive, AIS_Shape
+from OCP.TopLoc import TopLoc_Location
+from OCP.XCAFPrs import XCAFPrs_AISObject
 
 from cq_editor.__main__ import MainWindow
 from cq_editor.widgets.editor import Editor
+from cq_editor.widgets.debugger import Watchdog
+from cq_editor.runner import DUMMY_FILE, RenderTimeout, module_manager
+from cq_editor.render_worker import RenderWorker
+from cq_editor.export_worker import ExportBatch
 from cq_editor.cq_utils import export, get_occ_color
+from cq_editor.profiler import PROFILER, LineProfiler
+from cq_editor import benchmark
 
 code = """import cadquery as cq
 result = cq.Workplane("XY" )
@@ -330,19 +342,70 @@ def test_export(main, mocker):
 
     # export STL
     mocker.patch.object(QFileDialog, "getSaveFileName", return_value=("out.stl", ""))
-    obj_tree_comp._export_STL_action.triggered.emit()
+    with qtbot.waitSignal(obj_tree_comp.sigExported, timeout=30000):
+        obj_tree_comp._export_STL_action.triggered.emit()
+        assert win.export_progress.isVisible()
+        assert win.export_cancel.isVisible()
     assert os.path.isfile("out.stl")
+    assert not win.export_progress.isVisible()
 
     # export STEP
     mocker.patch.object(QFileDialog, "getSaveFileName", return_value=("out.step", ""))
-    obj_tree_comp._export_STEP_action.triggered.emit()
+    with qtbot.waitSignal(obj_tree_comp.sigExported, timeout=30000):
+        obj_tree_comp._export_STEP_action.triggered.emit()
     assert os.path.isfile("out.step")
+    assert win.statusBar().currentMessage() == "Exported out.step"
+
+    # export STL with the meshes of the viewer
+    mocker.patch.object(QFileDialog, "getSaveFileName", return_value=("shown.stl", ""))
+    with qtbot.waitSignal(obj_tree_comp.sigExported, timeout=30000):
+        obj_tree_comp._export_STL_shown_action.triggered.emit()
+    assert os.path.isfile("shown.stl")
+    os.remove("shown.stl")
+
+    # export in the foreground
+    obj_tree_comp.preferences["Export in background"] = False
+    try:
+        os.remove("out.step")
+        obj_tree_comp._export_STEP_action.triggered.emit()
+        assert os.path.isfile("out.step")
+        assert not obj_tree_comp._export_jobs
+    finally:
+        obj_tree_comp.preferences["Export in background"] = True
 
     # clean
     os.remove("out.step")
     os.remove("out.stl")
 
 
+def test_export_cancel(main, mocker):
+
+    qtbot, win = main
+
+    obj_tree_comp = win.components["object_tree"]
+    obj_tree_comp.CQ.setSelected(True)
+
+    # an existing file is left as it was
+    with open("out.stl", "w") as f:
+        f.write("previous")
+
+    mocker.patch.object(QFileDialog, "getSaveFileName", return_value=("out.stl", ""))
+    with qtbot.waitSignal(
+        obj_tree_comp.sigExporting, check_params_cb=lambda busy: not busy
+    ):
+        obj_tree_comp.export("stl", 1e-5)
+        win.export_cancel.click()
+
+    assert not obj_tree_comp._export_jobs
+    assert win.statusBar().currentMessage() == "Export of out.stl cancelled"
+    assert not os.path.exists("out.stl.part")
+
+    with open("out.stl") as f:
+        assert f.read() == "previous"
+
+    os.remove("out.stl")
+
+
 def number_visible_items(viewer):
 
     from OCP.AIS import AIS_ListOfInteractive
@@ -662,6 +725,454 @@ def test_traceback(main):
     assert traceback_view.tree.root.childCount() == 3  # 1 in user code + 2 in CQ code
 
 
+def test_render_background(main_clean):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+    traceback_view = win.components["traceback_viewer"]
+
+    debugger.preferences["Render in background"] = True
+
+    try:
+        editor.set_text(code_show_Workplane)
+        with qtbot.waitSignal(
+            debugger.sigRendering, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+            assert win.render_progress.isVisible()
+
+            # entered by the GUI thread, not by the render thread
+            assert debugger._render_context is not None
+
+        assert not win.render_progress.isVisible()
+        assert debugger._render_context is None
+        assert object_tree.CQ.childCount() == 1
+        assert traceback_view.current_exception.text() == ""
+
+        # errors raised in the worker are reported as usual
+        editor.set_text(code_err2)
+        with qtbot.waitSignal(
+            debugger.sigRendering, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+
+        assert "NameError" in traceback_view.current_exception.text()
+        assert object_tree.CQ.childCount() == 1
+    finally:
+        debugger.preferences["Render in background"] = False
+
+
+code_endless = """while True:
+    pass
+"""
+
+
+def test_render_stop(main):
+
+    qtbot, win = main
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+
+    assert object_tree.CQ.childCount() == 1
+    assert not debugger._stop_action.isEnabled()
+
+    debugger.preferences["Render in background"] = True
+
+    try:
+        # stop a runaway script manually
+        editor.set_text(code_endless)
+        with qtbot.waitSignal(
+            debugger.sigRendering, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+            assert debugger._stop_action.isEnabled()
+            debugger._stop_action.triggered.emit()
+
+        assert not debugger._stop_action.isEnabled()
+        assert object_tree.CQ.childCount() == 1
+
+        # stop it using the time limit
+        debugger.preferences["Render time limit [s]"] = 0.5
+        with qtbot.waitSignal(
+            debugger.sigRendering, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+
+        assert object_tree.CQ.childCount() == 1
+
+        # the limit does not affect renders that finish in time
+        editor.set_text(code_multi)
+        with qtbot.waitSignal(
+            debugger.sigRendering, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+
+        assert object_tree.CQ.childCount() == 2
+    finally:
+        debugger.preferences["Render in background"] = False
+        debugger.preferences["Render time limit [s]"] = 0.0
+
+
+def test_render_stop_foreground(main):
+
+    qtbot, win = main
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+
+    assert not debugger.preferences["Render in background"]
+    assert object_tree.CQ.childCount() == 1
+
+    # the foreground render only returns once it is stopped
+    editor.set_text(code_endless)
+    QTimer.singleShot(500, debugger._stop_action.trigger)
+    debugger._actions["Run"][0].triggered.emit()
+
+    assert debugger._render_thread is None
+    assert not debugger._stop_action.isEnabled()
+    assert object_tree.CQ.childCount() == 1
+
+    # the editor takes no input meanwhile
+    QTimer.singleShot(200, lambda: qtbot.keyClicks(editor, "x = 1"))
+    QTimer.singleShot(500, debugger._stop_action.trigger)
+    debugger._actions["Run"][0].triggered.emit()
+
+    assert editor.get_text_with_eol() == code_endless
+
+
+def test_watchdog():
+
+    # stops code running too long
+    with pytest.raises(RenderTimeout):
+        with Watchdog(0.1):
+            start = perf_counter()
+            while perf_counter() - start < 5:
+                pass
+
+    # a timer firing once the watchdog is left does nothing
+    watchdog = Watchdog(10)
+    with watchdog:
+        pass
+
+    watchdog._expire()
+    for _ in range(10000):
+        pass
+
+    # 0 disables the limit
+    with Watchdog(0):
+        pass
+
+
+def test_render_worker(main_clean):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+    traceback_view = win.components["traceback_viewer"]
+    log = win.components["log"]
+
+    def render():
+        with qtbot.waitSignal(
+            debugger.sigRendering, timeout=30000, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+
+    debugger.preferences["Render in worker process"] = True
+
+    try:
+        # shapes, names and log messages come back from the worker
+        editor.set_text(code_show_Workplane_named)
+        render()
+
+        assert object_tree.CQ.childCount() == 1
+        assert object_tree.CQ.child(0).text(0) == "test"
+        assert isinstance(object_tree.CQ.child(0).shape, cq.Workplane)
+
+        qtbot.wait(100)
+        assert "test" in log.toPlainText()
+
+        # errors keep their location in the script
+        editor.set_text(code_err2)
+        render()
+
+        assert "NameError" in traceback_view.current_exception.text()
+        assert traceback_view.tree.root.childCount() == 1
+        assert object_tree.CQ.childCount() == 1
+
+        # stopping kills the worker, the next render starts a new one
+        editor.set_text(code_endless)
+        with qtbot.waitSignal(
+            debugger.sigRendering, timeout=30000, check_params_cb=lambda busy: not busy
+        ):
+            debugger._actions["Run"][0].triggered.emit()
+            debugger._stop_action.triggered.emit()
+
+        assert object_tree.CQ.childCount() == 1
+
+        editor.set_text(code_multi)
+        render()
+
+        assert object_tree.CQ.childCount() == 2
+    finally:
+        debugger.preferences["Render in worker process"] = False
+
+    assert debugger._worker is None
+
+
+def test_render_worker_timeout():
+
+    worker = RenderWorker()
+    options = dict(
+        reload_cq=False,
+        add_to_path=False,
+        change_dir=False,
+        reload_modules=False,
+        incremental=False,
+    )
+
+    try:
+        with pytest.raises(RenderTimeout):
+            worker.render(code_endless, timeout=1, **options)
+
+        assert not worker.alive
+
+        # the next render restarts the worker
+        objects, *_ = worker.render(code_show_Workplane_named, timeout=30, **options)
+
+        assert worker.alive
+        assert list(objects) == ["test"]
+    finally:
+        worker.shutdown()
+
+
+code_incremental = """import cadquery as cq
+parts = []
+a = cq.Workplane().box(1, 1, 1)
+parts.append(a)
+"""
+
+
+def test_render_incremental(main_clean):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+    log = win.components["log"]
+
+    debugger.preferences["Incremental render"] = True
+
+    try:
+        editor.set_text(code_incremental)
+        debugger._actions["Run"][0].triggered.emit()
+
+        assert debugger._cache.reused == 0
+        assert object_tree.CQ.childCount() == 1
+
+        # only the new statement runs
+        editor.set_text(code_incremental + "b = a.faces('>Z').hole(0.1)\n")
+        debugger._actions["Run"][0].triggered.emit()
+
+        assert debugger._cache.reused == 4
+        assert object_tree.CQ.childCount() == 2
+
+        qtbot.wait(100)
+        assert "Reused the results of 4 statement(s)" in log.toPlainText()
+
+        # parts was changed in place after the snapshot, everything runs again
+        editor.set_text(code_incremental.replace("parts.append(a)", "c = 1"))
+        debugger._actions["Run"][0].triggered.emit()
+
+        assert debugger._cache.reused == 0
+        assert debugger._cache._module.__dict__["parts"] == []
+    finally:
+        debugger.preferences["Incremental render"] = False
+
+    assert debugger._cache._module is None
+
+
+code_reuse = """import cadquery as cq
+a = cq.Workplane().box(1, 1, 1)
+b = cq.Workplane().sphere(1)
+show_object(a, name="a")
+show_object(b, name="b")
+"""
+
+
+def test_reuse_unchanged_objects(main_clean, mocker):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+    viewer = win.components["viewer"]
+
+    debugger.preferences["Incremental render"] = True
+
+    try:
+        editor.set_text(code_reuse)
+        debugger._actions["Run"][0].triggered.emit()
+
+        a, b = (object_tree.CQ.child(i) for i in range(2))
+
+        # a is reused from the previous run, only b is rebuilt
+        remove_items = mocker.spy(viewer, "remove_items")
+        display_many = mocker.spy(viewer, "display_many")
+
+        editor.set_text(code_reuse.replace("sphere(1)", "sphere(2)"))
+        debugger._actions["Run"][0].triggered.emit()
+
+        a2, b2 = (object_tree.CQ.child(i) for i in range(2))
+        assert a2 is not a
+        assert a2.ais is a.ais
+        assert b2.ais is not b.ais
+
+        assert remove_items.call_args[0][0] == [b.ais]
+        assert display_many.call_args[0][0] == [b2.ais]
+        assert viewer.canvas.context.IsDisplayed(a2.ais)
+
+        # everything is rebuilt if disabled
+        object_tree.preferences["Update changed objects only"] = False
+        debugger._actions["Run"][0].triggered.emit()
+        assert object_tree.CQ.child(0).ais is not a.ais
+    finally:
+        debugger.preferences["Incremental render"] = False
+        object_tree.preferences["Update changed objects only"] = True
+
+
+def test_render_profile(main_clean, mocker):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    log = win.components["log"]
+
+    debugger.preferences["Profile renders"] = True
+
+    try:
+        editor.set_text(code_show_Workplane_named)
+        debugger._actions["Run"][0].triggered.emit()
+
+        profile = PROFILER.profiles[-1]
+        for stage in ("compile", "exec", "make_AIS", "tessellation", "display"):
+            assert stage in profile.stages
+        assert "make_AIS" in profile.objects["test"]
+        assert PROFILER.current is None
+
+        assert win.statusBar().currentMessage() == profile.summary()
+        qtbot.wait(100)
+        assert "Render profile" in log.toPlainText()
+
+        # profiles can be exported for tracking them over time
+        mocker.patch.object(
+            QFileDialog, "getSaveFileName", return_value=("profile.json", "")
+        )
+        debugger._export_profiles_action.triggered.emit()
+
+        with open("profile.json") as f:
+            exported = json.load(f)
+        assert exported[-1]["stages"] == profile.stages
+        os.remove("profile.json")
+    finally:
+        debugger.preferences["Profile renders"] = False
+
+    # nothing is recorded while profiling is off
+    n = len(PROFILER.profiles)
+    debugger._actions["Run"][0].triggered.emit()
+    assert len(PROFILER.profiles) == n
+
+
+def test_profiler_threads():
+
+    def work():
+        with PROFILER.stage("other"):
+            pass
+
+    def handed_over():
+        PROFILER.attach(profile)
+        work()
+        PROFILER.detach()
+
+    profile = PROFILER.begin()
+
+    # only the thread the profile is active in records stages
+    thread = Thread(target=work)
+    thread.start()
+    thread.join()
+
+    with PROFILER.stage("own"):
+        pass
+
+    assert PROFILER.detach() is profile
+
+    thread = Thread(target=handed_over)
+    thread.start()
+    thread.join()
+
+    with PROFILER.stage("detached"):
+        pass
+
+    PROFILER.attach(profile)
+    assert PROFILER.end() is profile
+    assert PROFILER.current is None
+
+    assert list(profile.stages) == ["own", "other"]
+
+
+def test_benchmark(main_clean, mocker):
+
+    qtbot, win = main_clean
+
+    debugger = win.components["debugger"]
+    viewer = win.components["viewer"]
+    debugger.preferences["Profile renders"] = True
+
+    components = [c for c in (win, *win.components.values()) if c.preferences]
+    states = [c.preferences.saveState() for c in components]
+
+    try:
+        # whatever the user set, the benchmark runs with the defaults
+        viewer.preferences["Deviation"] = 1e-3
+        benchmark.configure(win)
+
+        assert viewer.preferences["Deviation"] == 1e-5
+        assert debugger.preferences["Profile renders"]
+        assert not win.components["object_tree"].preferences[
+            "Update changed objects only"
+        ]
+
+        cases = benchmark.find_cases(win, ["01_hello_box"])
+        assert list(cases) == ["01_hello_box"]
+
+        clear = mocker.spy(benchmark.TESSELLATION_CACHE, "clear")
+        results = benchmark.run_case(win, cases["01_hello_box"], repeat=2)
+        for stage in ("compile", "exec", "make_AIS", "display", "fit", "total"):
+            assert stage in results
+
+        # every repeat tessellates anew
+        assert clear.call_count == 2
+    finally:
+        for component, state in zip(components, states):
+            component.preferences.restoreState(state, removeChildren=False)
+        debugger.preferences["Profile renders"] = False
+
+    # only slowdowns above the threshold and the noise level are regressions
+    baseline = {"case": {"display": 1.0, "fit": 1.0, "exec": 1e-3}}
+    results = {"case": {"display": 1.1, "fit": 1.5, "exec": 2e-3, "new": 1.0}}
+    assert benchmark.compare(results, baseline) == [("case", "fit", 1.0, 1.5)]
+
+
 @pytest.fixture
 def editor(qtbot):
 
@@ -987,6 +1498,92 @@ def test_line_number_area(editor):
     qtbot.mouseClick(editor.line_number_area, Qt.LeftButton, pos=pos)
 
 
+def test_line_profile(editor):
+    qtbot, editor = editor
+
+    editor.set_text(base_editor_text)
+    editor.set_line_profile({1: [0.8, 12.0, 1], 2: [0.1, 0.0, 3]}, 1.0)
+
+    assert editor.line_profile_text(1) == "800 ms (80%), 1 hit(s), +12 MB"
+    assert editor.line_profile_text(2) == "100 ms (10%), 3 hit(s)"
+    assert editor.line_profile_text(3) is None
+
+    # the heat bar is painted next to the line numbers
+    editor.line_number_area.repaint()
+
+    # editing invalidates the profile
+    editor.set_text(base_editor_text + "\n")
+    assert editor.line_profile == {}
+
+
+def test_line_profile_reload(editor, tmp_path):
+    qtbot, editor = editor
+
+    script = tmp_path / "script.py"
+    script.write_text(base_editor_text)
+    editor.load_from_file(str(script))
+
+    editor.set_line_profile({1: [0.8, 12.0, 1]}, 1.0)
+
+    # reloading the unchanged file keeps the profile
+    editor._file_changed()
+    assert editor.line_profile
+
+    # a changed file invalidates it
+    script.write_text(base_editor_text + "\nx = 1\n")
+    editor._file_changed()
+    assert editor.line_profile == {}
+
+
+def test_line_profiler_memory(mocker):
+
+    memory = mocker.patch("cq_editor.profiler.memory_usage", return_value=0)
+
+    code = compile("x = 0\nfor i in range(10000):\n    x += i\n", DUMMY_FILE, "exec")
+    with LineProfiler() as profiler:
+        exec(code, {})
+
+    # every line is timed, but the memory is only sampled now and then
+    assert profiler.lines[3][2] == 10000
+    assert memory.call_count < 1000
+
+    # no memory information is no growth
+    assert all(mb == 0 for _, mb, _ in profiler.lines.values())
+
+
+code_line_profile = """import cadquery as cq
+
+def part():
+    return cq.Workplane().box(1, 1, 1).edges().fillet(0.1)
+
+for i in range(3):
+    result = part()
+"""
+
+
+def test_render_line_profile(main_clean):
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+
+    editor.set_text(code_line_profile)
+    debugger._profile_action.triggered.emit()
+
+    assert object_tree.CQ.childCount() == 1
+
+    # every executed line is profiled, calls include the time of the callee
+    assert set(editor.line_profile) == {1, 3, 4, 6, 7}
+    assert editor.line_profile[6][2] == 4
+    assert editor.line_profile[7][0] >= editor.line_profile[4][0]
+    assert "hit(s)" in editor.line_profile_text(7)
+
+    # a normal render keeps the profile
+    debugger._actions["Run"][0].triggered.emit()
+    assert editor.line_profile
+
+
 def test_console(main):
     qtbot, win = main
 
@@ -1022,6 +1619,149 @@ def test_viewer(main):
         a.trigger()
 
 
+def test_viewer_batch(main, mocker):
+
+    qtbot, win = main
+
+    viewer = win.components["viewer"]
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+
+    fit = mocker.spy(viewer, "fit")
+    flush = mocker.spy(viewer, "_flush")
+
+    # updates inside a batch are done once, at its end
+    ais_list = object_tree._subtree_ais(
+        [object_tree.CQ.child(i) for i in range(object_tree.CQ.childCount())]
+    )
+    assert ais_list
+    with viewer.batch():
+        with viewer.batch():
+            viewer.remove_items(ais_list)
+            viewer.display_many(ais_list, True)
+            viewer.redisplay(ais_list)
+            viewer.redraw()
+
+        assert fit.call_count == 0
+        assert flush.call_count == 0
+
+    assert fit.call_count == 1
+    assert flush.call_count == 1
+    assert not viewer._pending_update and not viewer._pending_fit
+
+    # one render erases, displays and rescales the helpers but fits only once
+    fit.reset_mock()
+    flush.reset_mock()
+    object_tree.removeObjects()
+    flush.reset_mock()
+
+    debugger.render()
+
+    assert fit.call_count == 1
+    assert flush.call_count == 1
+
+
+def test_level_of_detail(main):
+
+    qtbot, win = main
+
+    viewer = win.components["viewer"]
+    canvas = viewer.canvas
+
+    def culling_size():
+        return canvas.viewer.ZLayerSettings(Graphic3d_ZLayerId_Default).CullingSize()
+
+    viewer.preferences["Culling size [px]"] = 1
+
+    try:
+        assert culling_size() == 1
+
+        # lower level of detail while the view is dragged
+        canvas._begin_interaction()
+        assert culling_size() == 4
+        assert canvas.view.RenderingParams().NbMsaaSamples == 0
+
+        canvas._end_interaction()
+        assert culling_size() == 1
+        assert canvas.view.RenderingParams().NbMsaaSamples > 0
+
+        # and until the wheel stops
+        canvas.wheelEvent(
+            QWheelEvent(
+                QPointF(10, 10),
+                QPointF(10, 10),
+                QPoint(0, 0),
+                QPoint(0, 120),
+                Qt.NoButton,
+                Qt.NoModifier,
+                Qt.NoScrollPhase,
+                False,
+            )
+        )
+        assert canvas._interacting
+        qtbot.waitUntil(lambda: not canvas._interacting)
+    finally:
+        viewer.preferences["Culling size [px]"] = 0
+
+
+def test_progressive_display(main_clean):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    viewer = win.components["viewer"]
+    object_tree = win.components["object_tree"]
+
+    viewer.preferences["Progressive display"] = True
+
+    try:
+        editor.set_text(code_multi)
+        debugger._actions["Run"][0].triggered.emit()
+
+        # shown right away with the coarse mesh
+        ais = [object_tree.CQ.child(i).ais for i in range(2)]
+        assert all(a.Attributes().HasOwnDeviationCoefficient() for a in ais)
+        assert len(viewer._refine_queue) == 2
+
+        # and refined in the background
+        qtbot.waitUntil(lambda: not viewer._refine_queue)
+        assert not any(a.Attributes().HasOwnDeviationCoefficient() for a in ais)
+    finally:
+        viewer.preferences["Progressive display"] = False
+
+
+def test_progressive_display_instances(main_clean):
+
+    qtbot, win = main_clean
+
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    viewer = win.components["viewer"]
+    object_tree = win.components["object_tree"]
+
+    viewer.preferences["Progressive display"] = True
+
+    try:
+        editor.set_text(code_assy_instances)
+        debugger._actions["Run"][0].triggered.emit()
+
+        assy = object_tree.CQ.child(0)
+        parts = [assy.child(i).ais for i in range(assy.childCount())]
+        instances = [ais for ais in parts if isinstance(ais, AIS_ConnectedInteractive)]
+        assert len(instances) == 4
+
+        # prototypes get the coarse mesh and are refined once for all instances
+        protos = [ais.ConnectedTo() for ais in instances]
+        assert all(p.Attributes().HasOwnDeviationCoefficient() for p in protos)
+        assert len(viewer._refine_queue) == 3
+
+        qtbot.waitUntil(lambda: not viewer._refine_queue)
+        assert not any(p.Attributes().HasOwnDeviationCoefficient() for p in protos)
+    finally:
+        viewer.preferences["Progressive display"] = False
+
+
 code_module = """def dummy(): return True"""
 
 code_import = """from module import dummy
@@ -1053,6 +1793,31 @@ def test_module_import(main, tmp_path, monkeypatch):
     assert traceback_view.current_exception.text() == ""
 
 
+def test_module_manager_threads(tmp_path, monkeypatch):
+
+    for name in ("script_module", "other_module"):
+        (tmp_path / f"{name}.py").write_text(code_module)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    def import_other():
+        import other_module
+
+    try:
+        with module_manager():
+            import script_module
+
+            # imports of other threads meanwhile are kept
+            thread = Thread(target=import_other)
+            thread.start()
+            thread.join()
+
+        assert "script_module" not in sys.modules
+        assert "other_module" in sys.modules
+    finally:
+        sys.modules.pop("script_module", None)
+        sys.modules.pop("other_module", None)
+
+
 def test_auto_fit_view(main_clean):
 
     def concat(eye, proj, scale):
@@ -1122,6 +1887,30 @@ def test_preserve_properties(main):
     # assert props["Alpha"] == 0.5
 
 
+def test_lazy_properties(main):
+    qtbot, win = main
+
+    debugger = win.components["debugger"]
+    object_tree = win.components["object_tree"]
+
+    debugger._actions["Run"][0].triggered.emit()
+
+    # properties are made only when needed
+    item = object_tree.CQ.child(0)
+    assert item._properties is None
+    assert item.propertyValues()["Visible"] == True
+
+    item.setCheckState(0, Qt.Unchecked)
+    assert item._properties is None
+    assert item.propertyValues()["Visible"] == False
+
+    # e.g. for the properties editor
+    item.setSelected(True)
+    assert item._properties is not None
+    assert item.properties["Visible"] == False
+    assert item.properties["Name"] == item.text(0)
+
+
 def test_selection(main_multi, mocker):
 
     qtbot, win = main_multi
@@ -1137,14 +1926,16 @@ def test_selection(main_multi, mocker):
     obj1.setSelected(True)
     obj2.setSelected(True)
 
-    object_tree._export_STEP_action.triggered.emit()
+    with qtbot.waitSignal(object_tree.sigExported, timeout=30000):
+        object_tree._export_STEP_action.triggered.emit()
     imported = cq.importers.importStep("out.step")
     assert len(imported.solids().vals()) == 2
 
     # export with one selected objects
     obj2.setSelected(False)
 
-    object_tree._export_STEP_action.triggered.emit()
+    with qtbot.waitSignal(object_tree.sigExported, timeout=30000):
+        object_tree._export_STEP_action.triggered.emit()
     imported = cq.importers.importStep("out.step")
     assert len(imported.solids().vals()) == 1
 
@@ -1152,7 +1943,8 @@ def test_selection(main_multi, mocker):
     obj1.setSelected(False)
     CQ.setSelected(True)
 
-    object_tree._export_STEP_action.triggered.emit()
+    with qtbot.waitSignal(object_tree.sigExported, timeout=30000):
+        object_tree._export_STEP_action.triggered.emit()
     imported = cq.importers.importStep("out.step")
     assert len(imported.solids().vals()) == 2
 
@@ -1577,6 +2369,206 @@ def test_render_assy(main):
     assert obj_tree_comp.CQ.childCount() == 2
 
 
+code_assy_instances = """import cadquery as cq
+
+bolt = cq.Workplane().cylinder(5, 1)
+
+assy = cq.Assembly()
+for i in range(4):
+    assy.add(bolt, loc=cq.Location((3 * i, 0, 0)), color=cq.Color("red"))
+assy.add(bolt, loc=cq.Location((0, 5, 0)), color=cq.Color("blue"))
+assy.add(cq.Workplane().box(1, 1, 1), name="box")
+
+show_object(assy)
+"""
+
+
+def test_assy_instances(main_clean):
+
+    qtbot, win = main_clean
+
+    obj_tree_comp = win.components["object_tree"]
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+
+    editor.set_text(code_assy_instances)
+    debugger._actions["Run"][0].triggered.emit()
+    qtbot.wait(100)
+
+    assy = obj_tree_comp.CQ.child(0)
+    parts = [assy.child(i) for i in range(assy.childCount())]
+    assert len(parts) == 6
+
+    # repeated parts in the same color share one prototype
+    instances = [it.ais for it in parts[:4]]
+    assert all(isinstance(ais, AIS_ConnectedInteractive) for ais in instances)
+    proto = instances[0].ConnectedTo().Shape()
+    assert all(ais.ConnectedTo().Shape().IsPartner(proto) for ais in instances)
+    assert isinstance(parts[4].ais, AIS_Shape)
+    assert isinstance(parts[5].ais, AIS_Shape)
+
+    # graphical selection finds the instance
+    ais = instances[2]
+    shape = ais.ConnectedTo().Shape().Moved(TopLoc_Location(ais.LocalTransformation()))
+    obj_tree_comp.handleGraphicalSelection([shape])
+    assert [it for it in parts if it.isSelected()] == [parts[2]]
+
+    # selection is looked up in an index that follows the tree
+    assert sum(map(len, obj_tree_comp._selection_index.values())) == len(parts)
+    obj_tree_comp.removeObjects()
+    assert obj_tree_comp._selection_index == {}
+
+    # instancing can be disabled
+    obj_tree_comp.preferences["Instance repeated parts"] = False
+    try:
+        debugger._actions["Run"][0].triggered.emit()
+        qtbot.wait(100)
+
+        assy = obj_tree_comp.CQ.child(0)
+        assert all(
+            isinstance(assy.child(i).ais, AIS_Shape) for i in range(assy.childCount())
+        )
+    finally:
+        obj_tree_comp.preferences["Instance repeated parts"] = True
+
+
+code_assy_nested = """import cadquery as cq
+
+box = cq.Workplane().box(1, 1, 1)
+
+sub = cq.Assembly(name="sub", loc=cq.Location((0, 5, 0)))
+for i in range(3):
+    sub.add(box, name=f"part{i}", loc=cq.Location((2 * i, 0, 0)))
+
+assy = cq.Assembly(name="assy")
+assy.add(sub)
+assy.add(box, name="leaf", loc=cq.Location((0, 0, 3)))
+
+show_object(assy)
+"""
+
+
+def test_assy_lazy(main_clean):
+
+    qtbot, win = main_clean
+
+    obj_tree_comp = win.components["object_tree"]
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+    viewer = win.components["viewer"]
+    ctx = viewer.canvas.context
+
+    obj_tree_comp.preferences["Explode assemblies on demand"] = True
+    try:
+        editor.set_text(code_assy_nested)
+        debugger._actions["Run"][0].triggered.emit()
+        qtbot.wait(100)
+
+        # everything is shown merged at first
+        assy = obj_tree_comp.CQ.child(0)
+        sub, leaf = assy.child(0), assy.child(1)
+        merged = assy.ais
+        assert isinstance(merged, XCAFPrs_AISObject)
+        assert ctx.IsDisplayed(merged)
+        assert sub.ais is None and leaf.ais is None
+
+        # hiding it as a whole only erases the merged presentation
+        assy.setCheckState(0, Qt.Unchecked)
+        assert assy.lazy is not None
+        assert not ctx.IsDisplayed(merged)
+
+        assy.setCheckState(0, Qt.Checked)
+        assert assy.lazy is not None
+        assert ctx.IsDisplayed(merged)
+
+        # expanding shows the children, sub-assemblies stay merged
+        assy.setExpanded(True)
+        assert not ctx.IsDisplayed(merged)
+        assert isinstance(sub.ais, XCAFPrs_AISObject)
+        assert isinstance(leaf.ais, AIS_Shape)
+        assert ctx.IsDisplayed(sub.ais) and ctx.IsDisplayed(leaf.ais)
+
+        # so do hidden ones
+        sub.setCheckState(0, Qt.Unchecked)
+        assert sub.lazy is not None
+        assert not ctx.IsDisplayed(sub.ais)
+        sub.setCheckState(0, Qt.Checked)
+
+        # hiding a part explodes its sub-assembly
+        part = sub.child(1)
+        part.setCheckState(0, Qt.Unchecked)
+        assert sub.lazy is None
+        assert not ctx.IsDisplayed(part.ais)
+        assert ctx.IsDisplayed(sub.child(0).ais)
+    finally:
+        obj_tree_comp.preferences["Explode assemblies on demand"] = False
+
+
+def test_export_all(main_clean, tmp_path):
+
+    qtbot, win = main_clean
+
+    obj_tree_comp = win.components["object_tree"]
+    editor = win.components["editor"]
+    debugger = win.components["debugger"]
+
+    editor.set_text(code_assy_nested)
+    debugger._actions["Run"][0].triggered.emit()
+    qtbot.wait(100)
+
+    with qtbot.waitSignal(obj_tree_comp.sigExported, timeout=60000):
+        obj_tree_comp.export_all(str(tmp_path))
+
+    assert win.statusBar().currentMessage() == f"Exported 15 files to {tmp_path}"
+
+    # every part is exported next to the whole assembly, named after its path
+    with open(tmp_path / "manifest.json") as f:
+        manifest = json.load(f)
+
+    objects = ["assy", "assy/sub/part0", "assy/sub/part1", "assy/sub/part2"]
+    objects += ["assy/leaf"]
+    assert [el["object"] for el in manifest["files"][::3]] == objects
+    assert {el["format"] for el in manifest["files"]} == {"step", "stl", "brep"}
+
+    for el in manifest["files"]:
+        assert el["error"] is None
+        assert (tmp_path / el["file"]).stat().st_size == el["size"]
+
+    imported = cq.importers.importStep(str(tmp_path / "assy" / "sub" / "part1.step"))
+    assert imported.val().Center().toTuple() == pytest.approx((2, 5, 0))
+    imported = cq.importers.importStep(str(tmp_path / "assy.step"))
+    assert len(imported.solids().vals()) == 4
+
+
+def test_export_batch_names(tmp_path):
+
+    box = cq.Workplane().box(1, 1, 1).val()
+    paths = ["assy/part 1", "assy/part_1", "assy/Part_1", "../part", "assy/.."]
+
+    job = ExportBatch(None, [(p, box) for p in paths], ["brep"], str(tmp_path), 1)
+    job.run()
+
+    assert job.error is None
+
+    # names that sanitize alike or differ by case get files of their own
+    with open(tmp_path / "manifest.json") as f:
+        manifest = json.load(f)
+
+    assert [el["object"] for el in manifest["files"]] == paths
+    assert [el["file"] for el in manifest["files"]] == [
+        os.path.join("assy", "part_1.brep"),
+        os.path.join("assy", "part_1-2.brep"),
+        os.path.join("assy", "Part_1-3.brep"),
+        os.path.join("_", "part.brep"),
+        os.path.join("assy", "_.brep"),
+    ]
+
+    # and nothing is written outside of the output directory
+    assert not (Path(tmp_path).parent / "part.brep").exists()
+    for el in manifest["files"]:
+        assert (tmp_path / el["file"]).stat().st_size == el["size"]
+
+
 code_show_ais = """import cadquery as cq
 from cadquery.occ_impl.assembly import toCAF
 
@@ -1940,8 +2932,8 @@ def test_autocomplete(main):
     editor.set_cursor_position(len(editor.get_text_with_eol()))
 
     # Trigger auto-complete
-    editor._trigger_autocomplete()
-    qtbot.wait(100)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        editor._trigger_autocomplete()
 
     # Check that the completion list has two items
     assert len(editor.completion_list) == 2
@@ -1970,8 +2962,8 @@ def test_autocomplete(main):
     editor.set_cursor_position(len(editor.get_text_with_eol()) - 1)
 
     # Trigger auto-complete
-    editor._trigger_autocomplete()
-    qtbot.wait(100)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        editor._trigger_autocomplete()
 
     # Check to make sure that the auto-complete trigger removed the last ")"
     assert (
@@ -1979,6 +2971,46 @@ def test_autocomplete(main):
     )
 
 
+def test_editor_autocomplete_async(editor):
+
+    qtbot, editor = editor
+
+    worker = editor._completion_worker
+
+    editor.set_text("import cadquery as cq\nres = cq.W")
+    editor.set_cursor_position(len(editor.get_text_with_eol()))
+
+    # repeated requests are debounced, jedi runs once
+    with qtbot.waitSignal(worker.sigCompleted, timeout=10000) as blocker:
+        for _ in range(3):
+            editor._trigger_autocomplete()
+
+    assert blocker.args[0] == editor._completion_request == 1
+    assert editor.completion_list.count() == 2
+    assert editor.completion_list.isVisible()
+
+    # the signature at the cursor, not at the end of the text
+    editor.completion_list.hide()
+    editor.set_text("import cadquery as cq\nres = cq.Workplane().box(\nx = 1")
+    editor.set_cursor_position(len("import cadquery as cq\nres = cq.Workplane().box("))
+
+    with qtbot.waitSignal(worker.sigCompleted, timeout=10000):
+        editor._trigger_autocomplete()
+
+    assert editor.completion_list.item(0).text().startswith("box(length,width")
+
+    # results for a text that changed since are dropped
+    editor.completion_list.hide()
+    editor.set_text("import cadquery as cq\nres = cq.W")
+    editor.set_cursor_position(len(editor.get_text_with_eol()))
+
+    with qtbot.waitSignal(worker.sigCompleted, timeout=10000):
+        editor._request_completions()
+        editor.insertPlainText("x")
+
+    assert not editor.completion_list.isVisible()
+
+
 # Skip this test on Linux due to a known issue with Qt and keystrokes
 @pytest.mark.skipif(
     sys.platform.startswith("linux"), reason="Known issue with Qt keystrokes"
@@ -2003,8 +3035,8 @@ def test_autocomplete_keystrokes(main):
     editor.set_cursor_position(len(editor.get_text_with_eol()))
 
     # Inject the Alt+/ key combo
-    qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
-    qtbot.wait(250)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
 
     # Check that the completion list is visible
     assert editor.completion_list.isVisible()
@@ -2022,8 +3054,8 @@ def test_autocomplete_keystrokes(main):
     editor.set_cursor_position(len(editor.get_text_with_eol()))
 
     # Inject the Alt+/ key combo
-    qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
-    qtbot.wait(250)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
 
     # Check that the completion list is visible
     assert editor.completion_list.isVisible()
@@ -2042,8 +3074,8 @@ def test_autocomplete_keystrokes(main):
     editor.set_text(r"""import cadquery as cq\nres = cq.Workplane().box(""")
 
     # Trigger autocomplete again
-    qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
-    qtbot.wait(250)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
 
     # Check that the completion list is visible
     assert editor.completion_list.isVisible()
@@ -2054,8 +3086,8 @@ def test_autocomplete_keystrokes(main):
     assert not editor.completion_list.isVisible()
 
     # Trigger autocomplete again
-    qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
-    qtbot.wait(250)
+    with qtbot.waitSignal(editor._completion_worker.sigCompleted, timeout=10000):
+        qtbot.keyClick(editor, Qt.Key_Slash, modifier=Qt.AltModifier)
 
     # Trigger a key press that is not handled by the completion list
     qtbot.keyClick(editor.completion_list, Qt.Key_A)
@@ -2178,6 +3210,50 @@ def test_editor_autoreload(editor):
         editor.save()
 
 
+def test_editor_update_text(editor):
+
+    qtbot, editor = editor
+
+    old = "a = 1\nb = 2  # \U0001f600\nc = 3\nd = 4\ne = 5"
+    new = "a = 10\nb = 2  # \U0001f600\nc = 3\nd = 4\nf = 6\ne = 5\n"
+
+    editor.set_text(old)
+    editor.document().setUndoRedoEnabled(False)
+    editor.document().setUndoRedoEnabled(True)
+
+    # cursor on "c = 3"
+    cursor = editor.textCursor()
+    cursor.setPosition(editor.document().findBlockByNumber(2).position() + 1)
+    editor.setTextCursor(cursor)
+
+    assert editor.update_text(new)
+    assert editor.toPlainText() == new
+
+    # the cursor stays in the unchanged line
+    assert editor.textCursor().block().text() == "c = 3"
+    assert editor.textCursor().positionInBlock() == 1
+
+    # only the changed lines are replaced, as one undo step
+    editor.document().undo()
+    assert editor.toPlainText() == old
+    editor.document().redo()
+
+    revision = editor.document().revision()
+    assert not editor.update_text(new)
+    assert editor.document().revision() == revision
+
+    assert editor.update_text("")
+    assert editor.toPlainText() == ""
+
+    # lines are only split at "\n", like the blocks of the document
+    old = "a = 1\n\x0cb = 2\nc = 3\nd = 4\n"
+    new = "a = 1\n\x0cb = 2\nc = 30\nd = 4\n"
+
+    editor.set_text(old)
+    assert editor.update_text(new)
+    assert editor.toPlainText() == new
+
+
 # def test_autoreload_nested(editor):
 
 #     qtbot, editor = editor
@@ -0,0 +1,136 @@
+import csv
+import json
+
+import pytest
+from path import Path
+
+from cq_editor.batch import render_file, main, sweep
+
+code = """import cadquery as cq
+
+width = 2
+log("building")
+result = cq.Workplane().box(width, 1, 1)
+show_object(result, name="my part")
+"""
+
+code_err = """import cadquery as cq
+
+result = cq.Workplane().box(1, 1, 1).faces(">Z").fillet(5)
+"""
+
+
+def test_render_file(tmp_path):
+
+    script = Path(tmp_path) / "part.py"
+    script.write_text(code)
+
+    result = render_file(script, tmp_path, formats=("step", "stl"))
+
+    assert result["error"] is None
+    assert result["objects"] == ["my part"]
+    assert result["log"] == ["building"]
+    assert set(result["timings"]) == {"compile", "exec", "export"}
+    assert [Path(f).name for f in result["files"]] == [
+        "part-my_part.step",
+        "part-my_part.stl",
+    ]
+    assert all(Path(f).exists() for f in result["files"])
+
+    # nothing is exported without an output directory
+    result = render_file(script)
+    assert result["files"] == []
+
+
+def test_batch_main(tmp_path):
+
+    tmp_path = Path(tmp_path)
+    (tmp_path / "a.py").write_text(code)
+    (tmp_path / "b.py").write_text(code_err)
+
+    report = tmp_path / "report.json"
+    # scripts are rendered by a pool of processes
+    rv = main([tmp_path, "-o", tmp_path / "out", "-j", "2", "--report", report])
+
+    assert rv == 1
+    assert (tmp_path / "out" / "a-my_part.step").exists()
+
+    results = json.loads(report.read_text())
+    assert [Path(r["script"]).name for r in results] == ["a.py", "b.py"]
+    assert results[0]["error"] is None
+    assert results[1]["error"]
+
+
+def test_sweep(tmp_path):
+
+    tmp_path = Path(tmp_path)
+    script = tmp_path / "part.py"
+    script.write_text(code)
+
+    variants = list(sweep({"width": [1, 3], "name": ["a", "b"]}))
+    assert variants == [
+        {"width": 1, "name": "a"},
+        {"width": 1, "name": "b"},
+        {"width": 3, "name": "a"},
+        {"width": 3, "name": "b"},
+    ]
+
+    # top-level assignments are overridden
+    result = render_file(script, parameters={"width": 5})
+    assert result["error"] is None
+    assert result["measures"]["my part"]["volume"] == pytest.approx(5)
+    assert result["measures"]["my part"]["bbox"][3] == pytest.approx(2.5)
+
+    table = tmp_path / "table.csv"
+    rv = main(
+        [script, "-o", tmp_path, "-j", "1", "--set", "width=1,2", "--table", table]
+    )
+    assert rv == 0
+
+    rows = list(csv.DictReader(table.open()))
+    assert [row["width"] for row in rows] == ["1", "2"]
+    assert [float(row["volume"]) for row in rows] == pytest.approx([1, 2])
+    assert rows[1]["files"].endswith("part-width=2-my_part.step")
+
+
+code_names = """import cadquery as cq
+from OCP.AIS import AIS_Shape
+
+box = cq.Workplane().box(1, 1, 1)
+show_object(box, name="a b")
+show_object(box.translate((2, 0, 0)), name="a_b")
+show_object(AIS_Shape(box.val().wrapped), name="ais")
+"""
+
+
+def test_export_names(tmp_path):
+
+    tmp_path = Path(tmp_path)
+    script = tmp_path / "part.py"
+    script.write_text(code_names)
+
+    # names that sanitize alike do not overwrite each other
+    result = render_file(script, tmp_path)
+
+    assert result["error"] is None
+    assert [Path(f).name for f in result["files"]] == [
+        "part-a_b.step",
+        "part-a_b-2.step",
+    ]
+
+    # presentations are not exported
+    assert result["objects"] == ["a b", "a_b"]
+    assert result["skipped"] == ["ais"]
+
+    # nor do scripts of the same name in different directories
+    for d in ("x", "y"):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "part.py").write_text(code)
+
+    rv = main([tmp_path / "x", tmp_path / "y", "-o", tmp_path / "out", "-j", "1"])
+
+    assert rv == 0
+    assert sorted(f.name for f in (tmp_path / "out").files()) == [
+        "x-part-my_part.step",
+        "y-part-my_part.step",
+    ]
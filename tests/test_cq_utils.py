@@ -1,7 +1,24 @@
+import struct
+
 import cadquery as cq
 import pytest
 
-from cq_editor.cq_utils import to_compound
+from OCP.StdPrs import StdPrs_ToolTriangulatedShape
+from OCP.Prs3d import Prs3d_Drawer
+from OCP.BRep import BRep_Tool
+from OCP.BRepTools import BRepTools
+from OCP.TopLoc import TopLoc_Location
+
+from cq_editor.cq_utils import (
+    to_compound,
+    make_AIS,
+    get_ais_shape,
+    instance_location,
+    same_location,
+    shape_key,
+    export_stl,
+    TessellationCache,
+)
 
 
 def test_to_compound_applies_sketch_placement():
@@ -11,3 +28,181 @@ def test_to_compound_applies_sketch_placement():
 
     assert f.Area() == pytest.approx(1)
     assert f.normalAt().toTuple() == pytest.approx((0, -1, 0))
+
+
+def test_instance_location():
+    part = cq.Workplane().box(1, 2, 3).faces(">Z").workplane().circle(0.2).extrude(1)
+    loc1 = cq.Location((1, 2, 3), (0, 0, 1), 30)
+    loc2 = cq.Location((5, 0, 0), (1, 0, 0), 90)
+
+    shape1 = to_compound(part).moved(loc1)
+    shape2 = to_compound(part).moved(loc2)
+
+    loc = instance_location(shape2, shape1)
+    assert loc is not None
+    assert same_location(loc * loc1, loc2)
+    assert not same_location(loc, cq.Location())
+
+    # a rebuilt part does not share the underlying shapes
+    other = to_compound(part.translate((0, 0, 0)))
+    assert instance_location(other, shape1) is None
+
+
+def test_shape_key():
+    part = cq.Workplane().box(1, 2, 3)
+    loc = cq.Location((1, 2, 3))
+
+    # the same shapes in the same place, even if wrapped or located anew
+    assert shape_key(part) == shape_key(part.val())
+    assert shape_key(to_compound(part).moved(loc)) == shape_key(
+        to_compound(part).moved(cq.Location((1, 2, 3)))
+    )
+
+    assert shape_key(part) != shape_key(to_compound(part).moved(loc))
+    assert shape_key(part) != shape_key(cq.Workplane().box(1, 2, 3))
+
+    def assy(color):
+        return cq.Assembly().add(part, loc=loc, color=cq.Color(color))
+
+    assert shape_key(assy("red")) == shape_key(assy("red"))
+    assert shape_key(assy("red")) != shape_key(assy("green"))
+
+
+def test_tessellation_cache():
+    cache = TessellationCache(2**30)
+
+    def part(d):
+        return (
+            cq.Workplane().box(10, 10, 10).edges().fillet(1).faces(">Z").hole(d).val()
+        )
+
+    drawer = Prs3d_Drawer()
+    drawer.SetDeviationCoefficient(cache.deviation)
+    drawer.SetDeviationAngle(cache.angle)
+
+    shape = part(1)
+    cache.tessellate([shape.wrapped])
+    n = len(cache._items)
+    size = cache.size
+
+    assert n == len(shape.Faces())
+    assert size > 0
+
+    # an identical rebuilt shape does not need meshing
+    shape = part(1)
+    cache.tessellate([shape.wrapped])
+    assert len(cache._items) == n
+    assert not StdPrs_ToolTriangulatedShape.Tessellate_s(shape.wrapped, drawer)
+
+    # only the changed faces are added
+    shape = part(2)
+    cache.tessellate([shape.wrapped])
+    assert n < len(cache._items) < 2 * n
+    assert not StdPrs_ToolTriangulatedShape.Tessellate_s(shape.wrapped, drawer)
+
+    # least recently used entries are dropped first
+    cache.configure(size, cache.deviation, cache.angle)
+    assert 0 < cache.size <= size
+    assert len(cache._items) < n
+
+    cache.configure(0, cache.deviation, cache.angle)
+    assert cache.size == 0
+
+
+def test_tessellate_many():
+    cache = TessellationCache()
+
+    small = cq.Workplane().box(1, 1, 1).edges().fillet(0.1)
+    shapes = [
+        small.val(),
+        small.translate((5, 0, 0)).val(),
+        cq.Workplane().box(100, 100, 100).edges().fillet(10).val(),
+    ]
+    # keep the assembly document alive, its AIS object refers to it
+    ais, docs = zip(
+        *(make_AIS(s) for s in [*shapes, cq.Assembly().add(small, name="s")])
+    )
+
+    cache.tessellate([get_ais_shape(a) for a in ais], parallel=True)
+
+    drawer = Prs3d_Drawer()
+    drawer.SetDeviationCoefficient(cache.deviation)
+    drawer.SetDeviationAngle(cache.angle)
+
+    for a in ais:
+        shape = get_ais_shape(a)
+        assert not StdPrs_ToolTriangulatedShape.Tessellate_s(shape, drawer)
+    assert cache.size == 0
+
+
+def test_export_stl(tmp_path):
+
+    part = cq.Workplane().box(1, 1, 1).edges().fillet(0.2).val()
+    face = cq.Face.makePlane(2, 2).moved(cq.Location((0, 0, 5)))
+    shape = cq.Compound.makeCompound(
+        [part.moved(cq.Location((2 * i, 0, 0))) for i in range(10)] + [face]
+    )
+
+    shape.exportStl(str(tmp_path / "cq.stl"), tolerance=0.01)
+    with open(tmp_path / "cq.stl", "rb") as f:
+        expected = f.read()[84:]
+
+    BRepTools.Clean_s(shape.wrapped)
+
+    # written at once, the same as cadquery
+    count = export_stl(shape.wrapped, tmp_path / "one.stl", 0.01, max_faces=1000)
+    with open(tmp_path / "one.stl", "rb") as f:
+        data = f.read()
+
+    assert struct.unpack("<I", data[80:84])[0] == count
+    assert data[84:] == expected
+
+    # instances share their faces, which are meshed once over all chunks,
+    # the triangles of some faces can differ
+    count = export_stl(shape.wrapped, tmp_path / "chunked.stl", 0.01, max_faces=20)
+    with open(tmp_path / "chunked.stl", "rb") as f:
+        data = f.read()
+
+    assert struct.unpack("<I", data[80:84])[0] == count
+    assert len(data) == 84 + 50 * count
+    assert 50 * count == len(expected)
+
+    # the new triangulations are dropped again
+    for el in (part, face):
+        assert (
+            BRep_Tool.Triangulation_s(el.Faces()[0].wrapped, TopLoc_Location()) is None
+        )
+
+    # nothing to write is an error, not an empty file
+    wire = cq.Workplane().rect(1, 1).val()
+    with pytest.raises(ValueError):
+        export_stl(wire.wrapped, tmp_path / "wire.stl")
+
+    assert not (tmp_path / "wire.stl").exists()
+
+
+def test_export_stl_reuse(tmp_path):
+
+    part = cq.Workplane().sphere(10).union(cq.Workplane().box(5, 5, 30)).val()
+    other = cq.Workplane().cylinder(3, 2).val().moved(cq.Location((30, 0, 0)))
+    shape = cq.Compound.makeCompound([part, other])
+
+    # meshed like the viewer does
+    TessellationCache(deviation=1e-3).tessellate([part.wrapped])
+    shown = sum(
+        BRep_Tool.Triangulation_s(f.wrapped, TopLoc_Location()).NbTriangles()
+        for f in part.Faces()
+    )
+    missing = export_stl(other.wrapped, tmp_path / "other.stl", 0.1)
+
+    # the finer mesh of the viewer is reused
+    assert export_stl(shape.wrapped, tmp_path / "out.stl", 0.1) == shown + missing
+
+    # unless the export asks for a finer one
+    assert export_stl(shape.wrapped, tmp_path / "out.stl", 1e-4) > shown + missing
+
+    # as shown, whatever the tolerance
+    BRepTools.Clean_s(part.wrapped)
+    TessellationCache(deviation=1e-3).tessellate([part.wrapped])
+    count = export_stl(shape.wrapped, tmp_path / "out.stl", 1e-4, remesh=False)
+    assert count == shown + export_stl(other.wrapped, tmp_path / "other.stl", 1e-4)